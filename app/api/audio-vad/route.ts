@@ -0,0 +1,68 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { spawn } from 'child_process';
+import path from 'path';
+
+const VAD_TIMEOUT = 10000;
+
+// 以 stdin 傳入音訊 (base64 可能超過命令列長度限制)，讀取 audio_vad.py 輸出的 JSON
+function runVad(scriptPath: string, payload: object): Promise<any> {
+  return new Promise((resolve, reject) => {
+    const child = spawn('python3', [scriptPath, 'stage'], { cwd: process.cwd() });
+    let stdout = '';
+    const timer = setTimeout(() => {
+      child.kill();
+      reject(new Error('audio_vad.py timed out'));
+    }, VAD_TIMEOUT);
+
+    child.stdout.on('data', (chunk: Buffer) => { stdout += chunk.toString(); });
+    child.stderr.on('data', (chunk: Buffer) => {
+      console.error(`[AudioVadAPI] Python 腳本 stderr 輸出: ${chunk.toString()}`);
+    });
+    child.on('error', (error) => {
+      clearTimeout(timer);
+      reject(error);
+    });
+    child.on('close', (code) => {
+      clearTimeout(timer);
+      if (code !== 0) {
+        reject(new Error(`audio_vad.py exited with code ${code}`));
+        return;
+      }
+      try {
+        resolve(JSON.parse(stdout));
+      } catch (error) {
+        reject(error);
+      }
+    });
+    child.stdin.end(JSON.stringify(payload));
+  });
+}
+
+export async function POST(request: NextRequest) {
+  const startedAt = performance.now();
+  try {
+    const { data, mimeType, sampleRate } = await request.json();
+
+    if (!data) {
+      return NextResponse.json(
+        { error: 'No audio provided' },
+        { status: 400 }
+      );
+    }
+
+    const scriptPath = path.join(process.cwd(), 'scripts', 'audio_vad.py');
+    const result = await runVad(scriptPath, { data, mime_type: mimeType, sample_rate: sampleRate });
+    const routeMs = performance.now() - startedAt;
+
+    return NextResponse.json(
+      { data: result.data, mimeType: result.mime_type, stats: result.stats },
+      { headers: { 'Server-Timing': `vad;dur=${result.stats.elapsed_ms}, route;dur=${routeMs.toFixed(2)}` } }
+    );
+  } catch (error) {
+    console.error('[AudioVadAPI] 語音偵測錯誤:', error);
+    return NextResponse.json(
+      { error: 'Internal server error' },
+      { status: 500 }
+    );
+  }
+}
@@ -0,0 +1,133 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import path from 'path';
+
+// 判定為不同畫面的漢明距離門檻與比較的畫面數量，可由環境變數調整
+const DEDUP_THRESHOLD = process.env.FRAME_DEDUP_THRESHOLD || '6';
+const DEDUP_WINDOW = process.env.FRAME_DEDUP_WINDOW || '4';
+const DEDUP_TIMEOUT = 5000;
+
+interface PendingRequest {
+  resolve: (result: any) => void;
+  reject: (error: Error) => void;
+  timer: NodeJS.Timeout;
+}
+
+// 常駐的 frame_dedup.py 程序，每個 session 的比較緩衝區保存在程序中
+class DedupServer {
+  private child: ChildProcessWithoutNullStreams;
+  private pending = new Map<number, PendingRequest>();
+  private nextId = 1;
+  private buffer = '';
+  private ready: Promise<void>;
+  private alive = true;
+
+  constructor(scriptPath: string) {
+    this.child = spawn('python3', [scriptPath, '--server', '--threshold', DEDUP_THRESHOLD, '--window', DEDUP_WINDOW], {
+      cwd: process.cwd(),
+    });
+
+    let markReady: () => void;
+    let markFailed: (error: Error) => void;
+    this.ready = new Promise((resolve, reject) => {
+      markReady = resolve;
+      markFailed = reject;
+    });
+    this.ready.catch(() => {});
+
+    this.child.stdout.setEncoding('utf8');
+    this.child.stdout.on('data', (chunk: string) => {
+      this.buffer += chunk;
+      let newline;
+      while ((newline = this.buffer.indexOf('\n')) >= 0) {
+        const line = this.buffer.slice(0, newline).trim();
+        this.buffer = this.buffer.slice(newline + 1);
+        if (!line) continue;
+
+        let message;
+        try {
+          message = JSON.parse(line);
+        } catch {
+          console.error(`[FrameDedupAPI] 無法解析常駐程序輸出: ${line}`);
+          continue;
+        }
+
+        if (message.ready) {
+          markReady();
+          continue;
+        }
+
+        const request = this.pending.get(message.id);
+        if (request) {
+          clearTimeout(request.timer);
+          this.pending.delete(message.id);
+          request.resolve(message.result);
+        }
+      }
+    });
+
+    this.child.stderr.on('data', (chunk: Buffer) => {
+      console.error(`[FrameDedupAPI] 常駐程序 stderr 輸出: ${chunk.toString()}`);
+    });
+
+    const fail = (error: Error) => {
+      this.alive = false;
+      markFailed(error);
+      for (const request of this.pending.values()) {
+        clearTimeout(request.timer);
+        request.reject(error);
+      }
+      this.pending.clear();
+      if (dedupServer === this) {
+        dedupServer = null;
+      }
+    };
+
+    this.child.on('error', fail);
+    this.child.on('exit', (code) => fail(new Error(`Frame dedup server exited with code ${code}`)));
+  }
+
+  isAlive() {
+    return this.alive;
+  }
+
+  async send(message: object): Promise<any> {
+    await this.ready;
+
+    const id = this.nextId++;
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error('Frame dedup request timed out'));
+      }, DEDUP_TIMEOUT);
+
+      this.pending.set(id, { resolve, reject, timer });
+      this.child.stdin.write(JSON.stringify({ id, ...message }) + '\n');
+    });
+  }
+}
+
+let dedupServer: DedupServer | null = null;
+
+function getDedupServer(): DedupServer {
+  if (!dedupServer || !dedupServer.isAlive()) {
+    dedupServer = new DedupServer(path.join(process.cwd(), 'scripts', 'frame_dedup.py'));
+  }
+  return dedupServer;
+}
+
+// POST {session, data, force}：返回 {forward, distance, stats}；沒有 data 時只返回該 session 的統計
+export async function POST(request: NextRequest) {
+  try {
+    const { session, data, force, reset } = await request.json();
+    const result = await getDedupServer().send({ session, data, force: Boolean(force), reset: Boolean(reset) });
+    return NextResponse.json(result);
+  } catch (error) {
+    console.error('[FrameDedupAPI] 畫面比對錯誤:', error);
+    // 無法比對時讓前端照常送出畫面
+    return NextResponse.json(
+      { forward: true, error: 'Internal server error' },
+      { status: 500 }
+    );
+  }
+}
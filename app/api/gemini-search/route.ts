@@ -1,14 +1,134 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { exec } from 'child_process';
+import { exec, spawn } from 'child_process';
 import { promisify } from 'util';
 import path from 'path';
+import { SEARCH_SERVER_ENABLED, getSearchServer, requestTimeout } from './searchServer';
 
 // 將 exec 轉換為 Promise
 const execAsync = promisify(exec);
 
+// 預設是否將包含多個問題的查詢拆成子問題並行搜尋，請求可用 decompose 覆寫
+const SEARCH_DECOMPOSE_DEFAULT = process.env.GEMINI_SEARCH_DECOMPOSE === '1';
+
+// search_entry_point 預設只包含每次查詢不同的部分，共用的 CSS 與圖示以 <!--ep:雜湊--> 參照，
+// 由前端在顯示時向 /api/search-entry-point/[hash] 取得 (經常駐的搜尋伺服器讀取，不另啟動 python)；請求帶 inlineEntryPoint: true 時直接回傳完整 HTML
+
+// deadline 為秒數，無效時視為未指定
+function parseDeadline(value: unknown): number | undefined {
+  const deadline = Number(value);
+  return Number.isFinite(deadline) && deadline > 0 ? deadline : undefined;
+}
+
+// 將 Python 端回傳的各階段耗時 (毫秒) 轉為 Server-Timing 標頭
+function serverTiming(timings: Record<string, number> | undefined, routeMs: number): string {
+  const entries = Object.entries(timings || {})
+    .filter(([, value]) => typeof value === 'number')
+    .map(([stage, value]) => `${stage};dur=${value.toFixed(2)}`);
+  // route 包含程序間通訊或啟動 Python 的額外成本
+  entries.push(`route;dur=${routeMs.toFixed(2)}`);
+  return entries.join(', ');
+}
+
+// 一次性執行 Python 腳本，作為常駐程序無法使用時的備援
+async function searchOnce(scriptPath: string, query: string, model: string, deadline?: number, decompose = false,
+                          inlineEntryPoint = false) {
+  const deadlineArg = deadline ? ` --deadline ${deadline}` : '';
+  const decomposeArg = decompose ? ' --decompose' : '';
+  const inlineArg = inlineEntryPoint ? ' --inline-entry-point' : '';
+  const { stdout, stderr } = await execAsync(`python3 "${scriptPath}"${deadlineArg}${decomposeArg}${inlineArg} "${query}" "${model}"`, {
+    timeout: deadline ? requestTimeout(deadline) : 0,
+  });
+
+  // Python 端預設只在警告或錯誤時寫入 stderr
+  if (stderr) {
+    console.error(`[GeminiSearchAPI] Python 腳本 stderr 輸出: ${stderr}`);
+  }
+
+  // 解析 Python 腳本的輸出
+  return JSON.parse(stdout);
+}
+
+// 以串流模式一次性執行 Python 腳本，將 NDJSON 事件轉送給 controller，返回停止程序的函式
+function spawnStream(controller: ReadableStreamDefaultController<Uint8Array>, scriptPath: string, query: string,
+                     model: string, deadline?: number, inlineEntryPoint = false): () => void {
+  const args = [scriptPath, '--stream'];
+  if (deadline) {
+    args.push('--deadline', String(deadline));
+  }
+  if (inlineEntryPoint) {
+    args.push('--inline-entry-point');
+  }
+  const child = spawn('python3', [...args, '--', query, model], {
+    cwd: process.cwd(),
+  });
+  child.stdout.on('data', (chunk: Buffer) => controller.enqueue(new Uint8Array(chunk)));
+  child.stderr.on('data', (chunk: Buffer) => {
+    console.error(`[GeminiSearchAPI] Python 腳本 stderr 輸出: ${chunk.toString()}`);
+  });
+  child.on('error', (error) => controller.error(error));
+  child.on('close', () => controller.close());
+  return () => child.kill();
+}
+
+// 串流搜尋：優先交給常駐程序 (沿用預熱的客戶端與期限、對沖、過期快取設定)，
+// 常駐程序在送出任何事件前失敗時改為一次性執行
+function streamSearch(scriptPath: string, query: string, model: string, deadline?: number,
+                      inlineEntryPoint = false): Response {
+  const encoder = new TextEncoder();
+  let stop = () => {};
+
+  const stream = new ReadableStream<Uint8Array>({
+    start(controller) {
+      const spawnOnce = () => {
+        stop = spawnStream(controller, scriptPath, query, model, deadline, inlineEntryPoint);
+      };
+      if (!SEARCH_SERVER_ENABLED) {
+        spawnOnce();
+        return;
+      }
+
+      let cancelled = false;
+      let sent = false;
+      stop = () => {
+        cancelled = true;
+      };
+      getSearchServer(scriptPath).stream(query, model, (event) => {
+        if (cancelled) return;
+        sent = true;
+        controller.enqueue(encoder.encode(JSON.stringify(event) + '\n'));
+      }, deadline, inlineEntryPoint)
+        .then(() => {
+          if (!cancelled) controller.close();
+        })
+        .catch((error) => {
+          if (cancelled) return;
+          if (sent) {
+            controller.error(error);
+            return;
+          }
+          console.error('[GeminiSearchAPI] 常駐程序串流失敗，改用一次性執行:', error);
+          spawnOnce();
+        });
+    },
+    cancel() {
+      stop();
+    },
+  });
+
+  return new Response(stream, {
+    headers: {
+      'Content-Type': 'application/x-ndjson; charset=utf-8',
+      'Cache-Control': 'no-cache',
+    },
+  });
+}
+
 export async function POST(request: NextRequest) {
+  const startedAt = performance.now();
   try {
-    const { query, model } = await request.json();
+    const { query, model, stream, deadline: rawDeadline, decompose: rawDecompose, inlineEntryPoint } = await request.json();
+    const deadline = parseDeadline(rawDeadline);
+    const decompose = typeof rawDecompose === 'boolean' ? rawDecompose : SEARCH_DECOMPOSE_DEFAULT;
 
     if (!query) {
       return NextResponse.json(
@@ -19,24 +139,35 @@ export async function POST(request: NextRequest) {
 
     // 使用 Python 腳本進行搜尋
     const scriptPath = path.join(process.cwd(), 'scripts', 'gemini_search.py');
-    const { stdout, stderr } = await execAsync(`python3 "${scriptPath}" "${query}" "${model || 'gemini-2.0-flash'}"`);
-    
-    if (stderr) {
-      console.error(`[GeminiSearchAPI] Python 腳本錯誤: ${stderr}`);
-      console.log(`[GeminiSearchAPI] Python 腳本 stderr 輸出: ${stderr}`);
+    const modelId = model || 'gemini-2.0-flash';
+
+    if (stream) {
+      return streamSearch(scriptPath, query, modelId, deadline, Boolean(inlineEntryPoint));
+    }
+
+    let result;
+    if (SEARCH_SERVER_ENABLED) {
+      try {
+        result = await getSearchServer(scriptPath).search(query, modelId, deadline, decompose, Boolean(inlineEntryPoint));
+      } catch (error) {
+        console.error('[GeminiSearchAPI] 常駐程序搜尋失敗，改用一次性執行:', error);
+      }
     }
-    
-    // 解析 Python 腳本的輸出
-    const result = JSON.parse(stdout);
-    
+
+    if (!result) {
+      result = await searchOnce(scriptPath, query, modelId, deadline, decompose, Boolean(inlineEntryPoint));
+    }
+
+    const headers = { 'Server-Timing': serverTiming(result.timings, performance.now() - startedAt) };
+
     if (result.error) {
       return NextResponse.json(
         { error: result.error },
-        { status: 500 }
+        { status: 500, headers }
       );
     }
-    
-    return NextResponse.json(result);
+
+    return NextResponse.json(result, { headers });
   } catch (error) {
     console.error('[GeminiSearchAPI] 搜尋錯誤:', error);
     return NextResponse.json(
@@ -44,4 +175,4 @@ export async function POST(request: NextRequest) {
       { status: 500 }
     );
   }
-} 
\ No newline at end of file
+}
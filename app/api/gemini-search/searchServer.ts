@@ -0,0 +1,156 @@
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+
+// 常駐搜尋程序的設定
+export const SEARCH_SERVER_ENABLED = process.env.GEMINI_SEARCH_SERVER !== '0';
+const SEARCH_SERVER_WORKERS = parseInt(process.env.GEMINI_SEARCH_WORKERS || '4', 10);
+const SEARCH_SERVER_TIMEOUT = 60000;
+
+// 取得 search_entry_point 共用片段的逾時 (毫秒)
+const ENTRY_POINT_PART_TIMEOUT = 5000;
+
+// 啟用時，常駐程序會在閒置期間預取結果中的後續問題
+const SEARCH_PREFETCH_ENABLED = process.env.GEMINI_SEARCH_PREFETCH === '1';
+
+// 逾時後 Python 端會回傳過期快取，這裡多等一段時間讓結果送回
+const DEADLINE_GRACE_MS = 2000;
+
+export function requestTimeout(deadline?: number) {
+  return deadline ? deadline * 1000 + DEADLINE_GRACE_MS : SEARCH_SERVER_TIMEOUT;
+}
+
+interface PendingRequest {
+  resolve: (result: any) => void;
+  reject: (error: Error) => void;
+  timer: NodeJS.Timeout;
+  // 串流請求的事件，type 為 done 的事件代表結束
+  onEvent?: (event: any) => void;
+}
+
+// 常駐的 gemini_search.py 程序，透過 stdin/stdout 交換 JSON 行；搜尋與 search_entry_point 的 route 共用
+export class SearchServer {
+  private child: ChildProcessWithoutNullStreams;
+  private pending = new Map<number, PendingRequest>();
+  private nextId = 1;
+  private buffer = '';
+  private ready: Promise<void>;
+  private alive = true;
+
+  constructor(scriptPath: string, workers: number) {
+    const args = [scriptPath, '--server', '--workers', String(workers)];
+    if (SEARCH_PREFETCH_ENABLED) {
+      args.push('--prefetch');
+    }
+    this.child = spawn('python3', args, {
+      cwd: process.cwd(),
+    });
+
+    let markReady: () => void;
+    let markFailed: (error: Error) => void;
+    this.ready = new Promise((resolve, reject) => {
+      markReady = resolve;
+      markFailed = reject;
+    });
+    // 避免在沒有請求等待時出現未處理的 rejection
+    this.ready.catch(() => {});
+
+    this.child.stdout.setEncoding('utf8');
+    this.child.stdout.on('data', (chunk: string) => {
+      this.buffer += chunk;
+      let newline;
+      while ((newline = this.buffer.indexOf('\n')) >= 0) {
+        const line = this.buffer.slice(0, newline).trim();
+        this.buffer = this.buffer.slice(newline + 1);
+        if (!line) continue;
+
+        let message;
+        try {
+          message = JSON.parse(line);
+        } catch {
+          console.error(`[GeminiSearchAPI] 無法解析常駐程序輸出: ${line}`);
+          continue;
+        }
+
+        if (message.ready) {
+          markReady();
+          continue;
+        }
+
+        const request = this.pending.get(message.id);
+        if (!request) continue;
+        if (message.event) {
+          request.onEvent?.(message.event);
+          if (message.event.type !== 'done') continue;
+        }
+        clearTimeout(request.timer);
+        this.pending.delete(message.id);
+        request.resolve(message.result ?? message.event);
+      }
+    });
+
+    this.child.stderr.on('data', (chunk: Buffer) => {
+      console.error(`[GeminiSearchAPI] 常駐程序 stderr 輸出: ${chunk.toString()}`);
+    });
+
+    const fail = (error: Error) => {
+      this.alive = false;
+      markFailed(error);
+      for (const request of this.pending.values()) {
+        clearTimeout(request.timer);
+        request.reject(error);
+      }
+      this.pending.clear();
+      if (searchServer === this) {
+        searchServer = null;
+      }
+    };
+
+    this.child.on('error', fail);
+    this.child.on('exit', (code) => fail(new Error(`Search server exited with code ${code}`)));
+  }
+
+  isAlive() {
+    return this.alive;
+  }
+
+  // 送出一個請求並等待回應；串流請求的事件交給 onEvent，收到 done 事件後 resolve
+  private async send(request: Record<string, unknown>, timeoutMs: number, onEvent?: (event: any) => void): Promise<any> {
+    await this.ready;
+
+    const id = this.nextId++;
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error('Search server request timed out'));
+      }, timeoutMs);
+
+      this.pending.set(id, { resolve, reject, timer, onEvent });
+      this.child.stdin.write(JSON.stringify({ id, ...request }) + '\n');
+    });
+  }
+
+  search(query: string, model: string, deadline?: number, decompose = false, inlineEntryPoint = false): Promise<any> {
+    return this.send({ query, model, deadline, decompose, inline_entry_point: inlineEntryPoint }, requestTimeout(deadline));
+  }
+
+  // 串流搜尋：每個事件呼叫一次 onEvent，收到 done 事件後 resolve
+  async stream(query: string, model: string, onEvent: (event: any) => void, deadline?: number,
+               inlineEntryPoint = false): Promise<void> {
+    await this.send({ query, model, deadline, stream: true, inline_entry_point: inlineEntryPoint },
+                    requestTimeout(deadline), onEvent);
+  }
+
+  // 取得 search_entry_point 的共用片段，不存在時返回 null；常駐程序已將片段保留在記憶體中
+  async entryPointPart(hash: string): Promise<string | null> {
+    const result = await this.send({ entry_point_part: hash }, ENTRY_POINT_PART_TIMEOUT);
+    return typeof result?.content === 'string' ? result.content : null;
+  }
+}
+
+let searchServer: SearchServer | null = null;
+
+export function getSearchServer(scriptPath: string): SearchServer {
+  if (!searchServer || !searchServer.isAlive()) {
+    searchServer = new SearchServer(scriptPath, SEARCH_SERVER_WORKERS);
+  }
+  return searchServer;
+}
@@ -0,0 +1,47 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { execFile } from 'child_process';
+import { promisify } from 'util';
+import path from 'path';
+import { SEARCH_SERVER_ENABLED, getSearchServer } from '../../gemini-search/searchServer';
+
+const execFileAsync = promisify(execFile);
+
+const HASH_PATTERN = /^[0-9a-f]{32}$/;
+
+// 優先向常駐搜尋程序取得片段 (已在記憶體中)，常駐程序無法使用時才一次性執行 entry_point_store.py
+async function readPart(hash: string): Promise<string | null> {
+  if (SEARCH_SERVER_ENABLED) {
+    try {
+      return await getSearchServer(path.join(process.cwd(), 'scripts', 'gemini_search.py')).entryPointPart(hash);
+    } catch (error) {
+      console.error('[SearchEntryPointAPI] 常駐程序讀取片段失敗，改用一次性執行:', error);
+    }
+  }
+  try {
+    const scriptPath = path.join(process.cwd(), 'scripts', 'entry_point_store.py');
+    const { stdout } = await execFileAsync('python3', [scriptPath, 'get', hash], { maxBuffer: 4 * 1024 * 1024 });
+    return stdout;
+  } catch {
+    return null;
+  }
+}
+
+// 取得 search_entry_point 的共用片段；內容以雜湊定址、不會改變，瀏覽器可以永久快取
+export async function GET(request: NextRequest, { params }: { params: Promise<{ hash: string }> }) {
+  const { hash } = await params;
+  if (!HASH_PATTERN.test(hash)) {
+    return NextResponse.json({ error: 'Invalid hash' }, { status: 400 });
+  }
+
+  const content = await readPart(hash);
+  if (content === null) {
+    console.error(`[SearchEntryPointAPI] 找不到片段 ${hash}`);
+    return NextResponse.json({ error: 'Not found' }, { status: 404 });
+  }
+  return new Response(content, {
+    headers: {
+      'Content-Type': 'text/html; charset=utf-8',
+      'Cache-Control': 'public, max-age=31536000, immutable',
+    },
+  });
+}
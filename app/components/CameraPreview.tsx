@@ -11,6 +11,7 @@ import { Avatar, AvatarImage, AvatarFallback } from "@/components/ui/avatar";
 import ImageGallery from './ImageGallery';
 import SearchEntryPoint from './SearchEntryPoint';
 import { useRouter } from "next/navigation";
+import { newDedupSession, shouldSendFrame } from '../utils/frameDedup';
 
 interface CameraPreviewProps {
   onTranscription: (text: string) => void;
@@ -30,6 +31,7 @@ export default function CameraPreview({ onTranscription, isVoiceEnabled }: Camer
   const setupInProgressRef = useRef(false);
   const [isWebSocketReady, setIsWebSocketReady] = useState(false);
   const imageIntervalRef = useRef<NodeJS.Timeout | null>(null);
+  const dedupSessionRef = useRef<string>(newDedupSession());
   const [isModelSpeaking, setIsModelSpeaking] = useState(false);
   const [outputAudioLevel, setOutputAudioLevel] = useState(0);
   const [connectionStatus, setConnectionStatus] = useState<'disconnected' | 'connecting' | 'connected'>('disconnected');
@@ -338,7 +340,12 @@ export default function CameraPreview({ onTranscription, isVoiceEnabled }: Camer
       context.drawImage(videoRef.current, 0, 0);
       const imageData = canvas.toDataURL('image/jpeg', 0.8);
       const b64Data = imageData.split(',')[1];
-      geminiWsRef.current.sendMediaChunk(b64Data, "image/jpeg");
+      // 畫面沒有明顯變化時不重複上傳
+      shouldSendFrame(dedupSessionRef.current, b64Data).then((forward) => {
+        if (forward) {
+          geminiWsRef.current?.sendMediaChunk(b64Data, "image/jpeg");
+        }
+      });
     }, 3000); // 每3秒截圖一次
 
     return () => {
@@ -465,6 +472,8 @@ export default function CameraPreview({ onTranscription, isVoiceEnabled }: Camer
     const imageData = canvas.toDataURL('image/jpeg', 0.8);
     const b64Data = imageData.split(',')[1];
     geminiWsRef.current.sendMediaChunk(b64Data, "image/jpeg");
+    // 明確要求的截圖一定送出，並記錄為上游已看過的畫面
+    shouldSendFrame(dedupSessionRef.current, b64Data, true);
   };
 
   // 監聽引用更新事件
@@ -1,15 +1,40 @@
 'use client';
 
-import React from 'react';
+import React, { useEffect, useState } from 'react';
+import { hasEntryPointRefs, inlineEntryPoint } from '../utils/entryPoint';
 
 interface SearchEntryPointProps {
   html: string;
 }
 
 const SearchEntryPoint: React.FC<SearchEntryPointProps> = ({ html }) => {
+  // 含有共用片段參照時，取得片段後才顯示，避免出現沒有樣式的內容
+  const [inlined, setInlined] = useState<string | null>(hasEntryPointRefs(html) ? null : html);
+
+  useEffect(() => {
+    if (!hasEntryPointRefs(html)) {
+      setInlined(html);
+      return;
+    }
+    let cancelled = false;
+    setInlined(null);
+    inlineEntryPoint(html).then((result) => {
+      if (!cancelled) {
+        setInlined(result);
+      }
+    });
+    return () => {
+      cancelled = true;
+    };
+  }, [html]);
+
+  if (!inlined) {
+    return null;
+  }
+
   return (
     <div className="mt-4 border rounded-lg p-4 bg-white">
-      <div dangerouslySetInnerHTML={{ __html: html }} />
+      <div dangerouslySetInnerHTML={{ __html: inlined }} />
     </div>
   );
 };
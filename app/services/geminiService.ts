@@ -264,8 +264,8 @@ export class GeminiService {
         sources = newsData.sources;
       }
       
-      // 提取 search_entry_point
-      const searchEntryPoint = result.search_entry_point;
+      // 提取 search_entry_point；共用片段保留為參照，由 SearchEntryPoint 元件顯示時才取得
+      const searchEntryPoint = result.search_entry_point || null;
       console.log('[GeminiService] Extracted search_entry_point:', searchEntryPoint);
       
       return {
@@ -274,7 +274,7 @@ export class GeminiService {
         images: result.images || [],
         headlines,
         sources,
-        search_entry_point: searchEntryPoint
+        search_entry_point: searchEntryPoint || undefined
       };
     } catch (error) {
       console.error('[GeminiService] 搜尋錯誤:', error);
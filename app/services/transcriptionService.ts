@@ -3,6 +3,33 @@ import { GoogleGenerativeAI } from "@google/generative-ai";
 const genAI = new GoogleGenerativeAI(process.env.NEXT_PUBLIC_GEMINI_API_KEY || '');
 const MODEL_NAME = "gemini-1.5-flash-8b";
 
+// 啟用時，上傳前先由 /api/audio-vad 去除靜音；整段都沒有語音時不呼叫模型
+const VAD_ENABLED = process.env.NEXT_PUBLIC_AUDIO_VAD === '1';
+
+interface TrimmedAudio {
+  data: string;
+  mimeType: string;
+  stats: { speech: boolean; bytes_saved: number; upload_bytes_saved: number };
+}
+
+// 失敗時返回 null，改用原始音訊
+async function trimSilence(audioBase64: string, mimeType: string): Promise<TrimmedAudio | null> {
+  try {
+    const response = await fetch('/api/audio-vad', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ data: audioBase64, mimeType }),
+    });
+    if (!response.ok) {
+      return null;
+    }
+    return await response.json();
+  } catch (error) {
+    console.error("Audio VAD error:", error);
+    return null;
+  }
+}
+
 export class TranscriptionService {
   private model;
 
@@ -16,6 +43,17 @@ export class TranscriptionService {
 
   async transcribeAudio(audioBase64: string, mimeType: string = "audio/wav"): Promise<string> {
     try {
+      if (VAD_ENABLED) {
+        const trimmed = await trimSilence(audioBase64, mimeType);
+        if (trimmed) {
+          if (!trimmed.stats.speech) {
+            return "";
+          }
+          audioBase64 = trimmed.data;
+          mimeType = trimmed.mimeType;
+        }
+      }
+
       const result = await this.model.generateContent([
         {
           inlineData: {
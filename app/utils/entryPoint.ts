@@ -0,0 +1,39 @@
+// search_entry_point 中共用片段 (CSS 與圖示) 的參照，內容以雜湊定址；
+// 顯示時才取得，同一片段只取得一次，之後由記憶體與瀏覽器快取 (immutable) 提供
+const ENTRY_POINT_REF = /<!--ep:([0-9a-f]{32})-->/g;
+const entryPointParts = new Map<string, Promise<string>>();
+
+export function hasEntryPointRefs(html: string): boolean {
+  return html.includes('<!--ep:');
+}
+
+function fetchEntryPointPart(hash: string): Promise<string> {
+  let part = entryPointParts.get(hash);
+  if (!part) {
+    part = fetch(`/api/search-entry-point/${hash}`).then((response) => {
+      if (!response.ok) {
+        throw new Error(`Missing search_entry_point part ${hash}`);
+      }
+      return response.text();
+    });
+    // 失敗時不保留，下次重新取得
+    part.catch(() => entryPointParts.delete(hash));
+    entryPointParts.set(hash, part);
+  }
+  return part;
+}
+
+// 將參照還原為完整的 HTML；無法取得片段時返回 null
+export async function inlineEntryPoint(html: string): Promise<string | null> {
+  const hashes = Array.from(new Set(Array.from(html.matchAll(ENTRY_POINT_REF), (match) => match[1])));
+  if (hashes.length === 0) {
+    return html;
+  }
+  try {
+    const parts = new Map(await Promise.all(hashes.map(async (hash) => [hash, await fetchEntryPointPart(hash)] as const)));
+    return html.replace(ENTRY_POINT_REF, (_, hash: string) => parts.get(hash) || '');
+  } catch (error) {
+    console.error('[EntryPoint] 無法取得 search_entry_point 共用片段:', error);
+    return null;
+  }
+}
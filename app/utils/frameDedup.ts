@@ -0,0 +1,28 @@
+// 啟用時，截圖在送往即時 API 前先由 /api/frame-dedup 比對，略過與最近送出畫面幾乎相同的截圖
+export const FRAME_DEDUP_ENABLED = process.env.NEXT_PUBLIC_FRAME_DEDUP === '1';
+
+export function newDedupSession(): string {
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+}
+
+// 返回是否要送出畫面；未啟用或比對失敗時一律送出。force 的畫面一定送出，但仍會記錄雜湊
+export async function shouldSendFrame(session: string, b64Data: string, force = false): Promise<boolean> {
+  if (!FRAME_DEDUP_ENABLED) {
+    return true;
+  }
+  try {
+    const response = await fetch('/api/frame-dedup', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ session, data: b64Data, force }),
+    });
+    const result = await response.json();
+    if (!result.forward && result.stats) {
+      console.log(`[FrameDedup] Skipped frame (distance ${result.distance}), ${result.stats.skipped}/${result.stats.frames} skipped`);
+    }
+    return result.forward !== false;
+  } catch (error) {
+    console.error("[FrameDedup] Dedup check failed:", error);
+    return true;
+  }
+}
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+from search_cache import normalize_query
+
+# 預設的回答索引位置
+DEFAULT_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "answer_index.sqlite3")
+
+# 問題與索引中的問題相似度至少要達到此值才直接使用舊的回答 (見 similarity)。
+# 在四字的問題後多問一個兩字的面向 (「量子電腦」與「量子電腦原理」) 為 0.75，必須低於門檻
+DEFAULT_MIN_SIMILARITY = 0.8
+
+# 以 BM25 取出的候選數量，以及問題、回答、引用標題三個欄位的權重
+CANDIDATES = 20
+BM25_WEIGHTS = (10.0, 1.0, 2.0)
+
+# 依問題類型決定回答可以沿用多久 (秒)：即時資訊、新聞，其他問題使用 GENERAL_MAX_AGE
+FRESHNESS_RULES = (
+    ("realtime", 10 * 60, re.compile(
+        r"股價|價格|匯率|天氣|比分|即時|現在|今天|今日|目前|當前|price|stock|weather|score|today|now|current|live",
+        re.IGNORECASE)),
+    ("news", 3 * 3600, re.compile(r"新聞|頭條|最新|近期|本週|這週|news|headline|latest|recent|this week", re.IGNORECASE)),
+)
+GENERAL_MAX_AGE = 7 * 24 * 3600
+
+# 前端會把問題包在提示詞裡 (「問題: ...」)，索引只使用問題本身
+QUESTION_MARKER = re.compile(r"問題\s*[:：]")
+
+# 英文單字與數字，以及連續的中日韓文字
+LATIN_TOKEN = re.compile(r"[a-z0-9][a-z0-9.+#-]*")
+CJK_RUN = re.compile(r"[㐀-鿿豈-﫿぀-ヿ가-힯]+")
+
+# 比較問題時，英文單字中有數字、或 (句首以外) 含大寫字母的視為實體 (公司、產品、年份)；
+# 出現在中文問題中的英文單字也都是名稱。實體與相對日期必須完全相同
+ENTITY_TOKEN = re.compile(r"[A-Za-z0-9][A-Za-z0-9.+#-]*")
+RELATIVE_DATE = re.compile(r"今天|明天|昨天|後天|前天|今日|明日|昨日|今年|去年|明年|前年|本週|這週|上週|下週|本月|這個月|上個?月|下個?月")
+
+# 兩側順序有意義的連接詞，例如起訖地點、貨幣對與比較
+DIRECTION = re.compile(r"(?=(\S{2})(到|往|至|兌|比)(\S{2}))")
+
+# 常見的同義說法先統一 (依序套用，長的說法在前)
+SYNONYMS = (
+    (re.compile(r"股票價格|股票價錢|股價"), "股價"),
+    (re.compile(r"價格|價錢|售價|多少錢"), "價格"),
+    (re.compile(r"什麼時候|何時|時間|日期"), "時間"),
+    (re.compile(r"大選|選舉"), "選舉"),
+    (re.compile(r"對|兌"), "兌"),
+)
+
+# 不影響問題內容的詞：「現在、目前」等由 freshness 決定有效期限，疑問詞與語助詞不比較
+PRESENT_WORDS = re.compile(r"現在|目前|當前|此刻|即時")
+CJK_STOPWORDS = re.compile(
+    r"為什麼|是多少|是什麼|有哪些|有什麼|多少|什麼|甚麼|怎麼|怎樣|如何|哪裡|哪個|哪些|請問|告訴我|一下|嗎|呢|吧|啊|呀|嘛|了|的|是|和|與|及|或"
+)
+STOPWORDS = frozenset("""
+a an the is are was were be been being am do does did of to in on at for from by with about as and or but
+what whats which who whom whose when where why how much many please tell me i you it its this that these those
+there can could would should will shall may might now current currently right s
+""".split())
+
+def extract_question(query):
+    parts = QUESTION_MARKER.split(query or "")
+    return parts[-1].strip()
+
+def tokenize(text):
+    """
+    英文與數字以單字為詞，中文沒有空白分隔，以相鄰兩字 (bigram) 為詞；單獨一個字時保留該字
+    """
+    text = (text or "").lower()
+    tokens = LATIN_TOKEN.findall(text)
+    for run in CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def freshness(question):
+    """
+    返回 (問題類型, 回答可沿用的秒數)
+    """
+    for name, max_age, pattern in FRESHNESS_RULES:
+        if pattern.search(question):
+            return name, max_age
+    return "general", GENERAL_MAX_AGE
+
+def _canonical(text):
+    for pattern, replacement in SYNONYMS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def question_terms(question):
+    """
+    返回 (實體, 英文內容詞, 中文內容)：實體是英文名稱、數字與相對日期；中文內容是去除停用詞、
+    統一同義說法後依原順序保留的連續文字 (以空白分隔)
+    """
+    entities = set(RELATIVE_DATE.findall(question))
+    words = set()
+    has_cjk = CJK_RUN.search(question) is not None
+    for position, match in enumerate(ENTITY_TOKEN.finditer(question)):
+        word = match.group()
+        token = word.lower()
+        if token in STOPWORDS:
+            continue
+        if has_cjk or any(c.isdigit() for c in word) or (position > 0 and not word.islower()) or word.isupper():
+            entities.add(token)
+        else:
+            words.add(token)
+    # 「多少錢」、「什麼時候」含有停用詞，先統一；去除停用詞後「股票的當前價格」才會接成「股票價格」
+    text = _canonical(RELATIVE_DATE.sub("", question))
+    cjk = " ".join(CJK_RUN.findall(_canonical(CJK_STOPWORDS.sub("", PRESENT_WORDS.sub("", text)))))
+    # 方向與比較兩側的名稱不能對調 (北京到上海、美元兌日圓)，連同兩側各兩字視為實體
+    entities.update(match.group(1) + match.group(2) + match.group(3) for match in DIRECTION.finditer(cjk))
+    return entities, words, cjk
+
+def _bigrams(cjk):
+    terms = set()
+    for run in cjk.split():
+        if len(run) == 1:
+            terms.add(run)
+        else:
+            terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+def _substituted(a, b):
+    """
+    兩段中文內容中是否有一段文字被換成另一段 (「台北」與「新北」、「北京到上海」與「上海到北京」)。
+    沒有斷詞字典無法認出中文名稱，被替換的片段視為名稱不同；只多出或少了片段 (多問一件事) 則交給相似度判斷
+    """
+    from difflib import SequenceMatcher
+
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+        if tag == "replace" and CJK_RUN.search(a[i1:i2]) and CJK_RUN.search(b[j1:j2]):
+            return True
+    return False
+
+def similarity(a, b):
+    """
+    兩個問題的相似度：實體不同或中文有片段被替換時為 0，否則為內容詞 (中文相鄰兩字、英文單字) 的
+    Dice 係數；沒有內容詞時為 1
+    """
+    entities_a, words_a, cjk_a = question_terms(a)
+    entities_b, words_b, cjk_b = question_terms(b)
+    if entities_a != entities_b or _substituted(cjk_a, cjk_b):
+        return 0.0
+    terms_a = words_a | _bigrams(cjk_a)
+    terms_b = words_b | _bigrams(cjk_b)
+    if not terms_a and not terms_b:
+        return 1.0 if entities_a else 0.0
+    return 2 * len(terms_a & terms_b) / (len(terms_a) + len(terms_b))
+
+class AnswerIndex:
+    """
+    以 SQLite FTS5 (BM25 排序) 建立的過去回答索引，可逐筆新增。
+
+    查詢時先以 BM25 從問題、回答與引用標題中取出候選，再只接受問題本身高度相似、
+    且仍在該類問題有效期限內的回答，避免以相關但不同問題的回答取代網路搜尋
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, min_similarity=DEFAULT_MIN_SIMILARITY):
+        self.min_similarity = min_similarity
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                normalized TEXT NOT NULL UNIQUE,
+                question TEXT NOT NULL,
+                model TEXT,
+                result TEXT NOT NULL,
+                upstream_ms REAL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_created_at ON answers (created_at)")
+        # 欄位內容是預先切好、以空白分隔的詞
+        self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS answers_fts USING fts5(question, answer, titles)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS lookups (
+                ts REAL NOT NULL,
+                hit INTEGER NOT NULL,
+                answer_id INTEGER,
+                lookup_ms REAL,
+                saved_ms REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_lookups_ts ON lookups (ts)")
+
+    def add(self, query, model, result, upstream_ms=None, now=None):
+        """
+        加入或更新一個回答；同一個問題只保留最新的回答，超過最長有效期限的回答同時刪除
+        """
+        question = extract_question(query)
+        if not question or not result.get("answer") or result.get("error"):
+            return None
+        now = time.time() if now is None else now
+        titles = " ".join(c.get("title") or "" for c in result.get("citations") or [])
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT id FROM answers WHERE normalized = ?",
+                                         (normalize_query(question),)).fetchone()
+                if row is not None:
+                    self._conn.execute("DELETE FROM answers WHERE id = ?", row)
+                    self._conn.execute("DELETE FROM answers_fts WHERE rowid = ?", row)
+                cursor = self._conn.execute(
+                    "INSERT INTO answers (normalized, question, model, result, upstream_ms, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (normalize_query(question), question, model, json.dumps(result, ensure_ascii=False),
+                     upstream_ms, now),
+                )
+                answer_id = cursor.lastrowid
+                self._conn.execute(
+                    "INSERT INTO answers_fts (rowid, question, answer, titles) VALUES (?, ?, ?, ?)",
+                    (answer_id, " ".join(tokenize(question)), " ".join(tokenize(result["answer"])),
+                     " ".join(tokenize(titles))),
+                )
+                self._prune(now)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return answer_id
+
+    def _prune(self, now):
+        expired = [row[0] for row in self._conn.execute(
+            "SELECT id FROM answers WHERE created_at < ?", (now - GENERAL_MAX_AGE,))]
+        if expired:
+            marks = ",".join("?" * len(expired))
+            self._conn.execute(f"DELETE FROM answers WHERE id IN ({marks})", expired)
+            self._conn.execute(f"DELETE FROM answers_fts WHERE rowid IN ({marks})", expired)
+
+    def search(self, query, limit=CANDIDATES, now=None):
+        """
+        以 BM25 取出候選，返回 [{"id", "question", "model", "age", "bm25", "similarity", "fresh"}]，依相似度排序
+        """
+        question = extract_question(query)
+        tokens = tokenize(question)
+        if not tokens:
+            return []
+        now = time.time() if now is None else now
+        _, max_age = freshness(question)
+        match = " OR ".join('"' + token.replace('"', '""') + '"' for token in dict.fromkeys(tokens))
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT answers.id, answers.question, answers.model, answers.created_at,
+                       bm25(answers_fts, {", ".join(map(str, BM25_WEIGHTS))}) AS rank
+                FROM answers_fts JOIN answers ON answers.id = answers_fts.rowid
+                WHERE answers_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+                """,
+                (match, limit),
+            ).fetchall()
+        candidates = []
+        for answer_id, candidate, model, created_at, rank in rows:
+            age = now - created_at
+            candidates.append({
+                "id": answer_id,
+                "question": candidate,
+                "model": model,
+                "age": round(age, 1),
+                "bm25": round(rank, 4),
+                "similarity": round(similarity(question, candidate), 4),
+                "fresh": age <= max_age,
+            })
+        candidates.sort(key=lambda c: (-c["similarity"], c["bm25"]))
+        return candidates
+
+    def lookup(self, query, now=None):
+        """
+        找出可以直接使用的舊回答，返回 (result, match)；沒有時返回 (None, None)。
+        每次查詢都會記錄是否命中，以及命中時省下的上游延遲
+        """
+        started = time.perf_counter()
+        best = next((c for c in self.search(query, now=now)
+                     if c["fresh"] and c["similarity"] >= self.min_similarity), None)
+        result = upstream_ms = None
+        if best is not None:
+            with self._lock:
+                row = self._conn.execute("SELECT result, upstream_ms FROM answers WHERE id = ?",
+                                         (best["id"],)).fetchone()
+            if row is not None:
+                result, upstream_ms = json.loads(row[0]), row[1]
+        lookup_ms = (time.perf_counter() - started) * 1000
+        saved_ms = None
+        if result is not None:
+            saved_ms = max(0.0, upstream_ms - lookup_ms) if upstream_ms is not None else None
+            best["saved_ms"] = None if saved_ms is None else round(saved_ms, 2)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO lookups (ts, hit, answer_id, lookup_ms, saved_ms) VALUES (?, ?, ?, ?, ?)",
+                (time.time(), result is not None, best["id"] if result is not None else None, lookup_ms, saved_ms),
+            )
+        return (result, best) if result is not None else (None, None)
+
+    def stats(self, since=None):
+        """
+        查詢次數、直接使用舊回答 (省下網路呼叫) 的次數與省下的延遲
+        """
+        since = 0 if since is None else since
+        with self._lock:
+            lookups, hits, saved, lookup_ms = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(hit), 0), COALESCE(SUM(saved_ms), 0), AVG(lookup_ms) "
+                "FROM lookups WHERE ts >= ?",
+                (since,),
+            ).fetchone()
+            entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        return {
+            "entries": entries,
+            "lookups": lookups,
+            "hits": hits,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "saved_ms": round(saved, 2),
+            "avg_lookup_ms": None if lookup_ms is None else round(lookup_ms, 3),
+        }
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+def get_default_index():
+    """
+    取得共用的回答索引；GEMINI_ANSWER_INDEX_MIN_SIMILARITY 可調整相似度門檻
+    """
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = AnswerIndex(
+                os.environ.get("GEMINI_ANSWER_INDEX_PATH", DEFAULT_INDEX_PATH),
+                float(os.environ.get("GEMINI_ANSWER_INDEX_MIN_SIMILARITY", DEFAULT_MIN_SIMILARITY)),
+            )
+        return _default_index
+
+def index_enabled():
+    return os.environ.get("GEMINI_ANSWER_INDEX") == "1"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查看過去回答的本機檢索索引")
+    sub = parser.add_subparsers(dest="command", required=True)
+    search = sub.add_parser("search", help="列出查詢在索引中的候選與相似度")
+    search.add_argument("query")
+    stats = sub.add_parser("stats", help="命中次數與省下的延遲")
+    stats.add_argument("--window", default=None, help="時間範圍，例如 1h、7d")
+    args = parser.parse_args(argv)
+
+    index = get_default_index()
+    if args.command == "search":
+        kind, max_age = freshness(extract_question(args.query))
+        print(json.dumps({"type": kind, "max_age": max_age, "min_similarity": index.min_similarity,
+                          "candidates": index.search(args.query)}, ensure_ascii=False, indent=2))
+        return 0
+
+    since = None
+    if args.window:
+        from search_metrics import parse_window
+        since = time.time() - parse_window(args.window)
+    print(json.dumps(index.stats(since), ensure_ascii=False))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
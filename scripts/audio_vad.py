@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+import io
+import sys
+import json
+import time
+import wave
+import base64
+import argparse
+
+import numpy as np
+
+# 分析用的音框長度 (毫秒)
+DEFAULT_FRAME_MS = 20
+
+# 高於噪音底 (能量的第 NOISE_PERCENTILE 百分位數) 多少 dB 視為語音；低於 MIN_SPEECH_DB 一律視為靜音
+DEFAULT_MARGIN_DB = 10.0
+NOISE_PERCENTILE = 10
+MIN_SPEECH_DB = -50.0
+
+# 清音 (s、f 等摩擦音) 能量較低但過零率較高，只在語音附近才計入
+ZCR_MIN = 0.1
+ZCR_MAX = 0.5
+
+# 語音段前後保留的長度，以及短於此長度的孤立片段視為雜音 (毫秒)
+DEFAULT_HANGOVER_MS = 200
+MIN_SPEECH_MS = 60
+
+# pcmToWav 與即時 API 使用的取樣率
+DEFAULT_SAMPLE_RATE = 16000
+
+def frame_signal(samples, frame_len):
+    """
+    將 16-bit PCM 樣本切成不重疊的音框 (n_frames, frame_len)，最後不足一框的部分補零
+    """
+    n_frames = -(-len(samples) // frame_len)
+    padded = np.zeros(n_frames * frame_len, dtype=np.float32)
+    padded[:len(samples)] = samples
+    return padded.reshape(n_frames, frame_len)
+
+def frame_features(frames):
+    """
+    計算每個音框的能量 (dBFS) 與過零率
+    """
+    energy = np.mean(np.square(frames / 32768.0), axis=1)
+    energy_db = 10.0 * np.log10(energy + 1e-10)
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frames.shape[1] - 1)
+    return energy_db, zcr
+
+def _dilate(mask, radius):
+    if radius <= 0 or not mask.any():
+        return mask
+    return np.convolve(mask.astype(np.int32), np.ones(2 * radius + 1, dtype=np.int32), mode="same") > 0
+
+def _runs(mask):
+    """
+    返回布林陣列中連續 True 區段的 (起點, 終點) 陣列
+    """
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return edges.reshape(-1, 2)
+
+def detect_speech(samples, sample_rate=DEFAULT_SAMPLE_RATE, frame_ms=DEFAULT_FRAME_MS, margin_db=DEFAULT_MARGIN_DB,
+                  hangover_ms=DEFAULT_HANGOVER_MS):
+    """
+    以能量與過零率判斷每個音框是否為語音，返回 (mask, frame_len)：
+    高於噪音底的音框為濁音，緊鄰濁音且過零率落在摩擦音範圍的較弱音框為清音，
+    過短的孤立片段去除後，再於語音段前後各保留 hangover_ms
+    """
+    frame_len = max(1, int(sample_rate * frame_ms / 1000))
+    if len(samples) == 0:
+        return np.zeros(0, dtype=bool), frame_len
+    energy_db, zcr = frame_features(frame_signal(samples, frame_len))
+
+    threshold = max(np.percentile(energy_db, NOISE_PERCENTILE) + margin_db, MIN_SPEECH_DB)
+    voiced = energy_db > threshold
+    hangover = int(round(hangover_ms / frame_ms))
+    unvoiced = (energy_db > threshold - margin_db / 2) & (zcr >= ZCR_MIN) & (zcr <= ZCR_MAX)
+    speech = voiced | (unvoiced & _dilate(voiced, hangover))
+
+    min_frames = max(1, int(round(MIN_SPEECH_MS / frame_ms)))
+    for start, end in _runs(speech):
+        if end - start < min_frames:
+            speech[start:end] = False
+    return _dilate(speech, hangover), frame_len
+
+def trim_silence(samples, sample_rate=DEFAULT_SAMPLE_RATE, **options):
+    """
+    去除靜音與環境噪音，只保留語音段 (含前後的 hangover)，返回 (trimmed, stats)
+    """
+    started = time.perf_counter()
+    samples = np.asarray(samples, dtype=np.int16)
+    mask, frame_len = detect_speech(samples, sample_rate, **options)
+    segments = [(start * frame_len, min(end * frame_len, len(samples))) for start, end in _runs(mask)]
+    trimmed = np.concatenate([samples[s:e] for s, e in segments]) if segments else np.zeros(0, dtype=np.int16)
+
+    input_bytes = samples.nbytes
+    output_bytes = trimmed.nbytes
+    stats = {
+        "speech": bool(segments),
+        "segments": len(segments),
+        "duration_ms": round(len(samples) * 1000 / sample_rate, 1),
+        "kept_ms": round(len(trimmed) * 1000 / sample_rate, 1),
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "bytes_saved": input_bytes - output_bytes,
+        "saved_ratio": round(1 - output_bytes / input_bytes, 4) if input_bytes else 0.0,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    }
+    return trimmed, stats
+
+def read_wav(data):
+    """
+    讀取 WAV 位元組 (例如 pcmToWav 的輸出)，返回 (samples, sample_rate)；只支援 16-bit 單聲道
+    """
+    with wave.open(io.BytesIO(data)) as wav:
+        if wav.getsampwidth() != 2 or wav.getnchannels() != 1:
+            raise ValueError("Only 16-bit mono WAV is supported")
+        return np.frombuffer(wav.readframes(wav.getnframes()), dtype="<i2"), wav.getframerate()
+
+def write_wav(samples, sample_rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(np.asarray(samples, dtype="<i2").tobytes())
+    return buffer.getvalue()
+
+def process_base64(data, mime_type="audio/wav", sample_rate=DEFAULT_SAMPLE_RATE, **options):
+    """
+    轉錄前的處理階段：輸入 base64 的 WAV 或原始 PCM (audio/pcm)，返回同格式的裁剪結果與統計
+    """
+    raw = base64.b64decode(data)
+    if mime_type.startswith("audio/pcm"):
+        samples = np.frombuffer(raw[:len(raw) // 2 * 2], dtype="<i2")
+        trimmed, stats = trim_silence(samples, sample_rate, **options)
+        output = trimmed.astype("<i2").tobytes()
+    else:
+        samples, sample_rate = read_wav(raw)
+        trimmed, stats = trim_silence(samples, sample_rate, **options)
+        output = write_wav(trimmed, sample_rate)
+    # 以實際上傳的 base64 長度計算節省的流量
+    encoded = base64.b64encode(output).decode("ascii")
+    stats["upload_bytes_saved"] = len(data) - len(encoded)
+    return {"data": encoded, "mime_type": mime_type, "sample_rate": sample_rate, "stats": stats}
+
+def synthetic_meeting(seconds=60, sample_rate=DEFAULT_SAMPLE_RATE, speech_ratio=0.45, seed=0):
+    """
+    沒有錄音檔時的基準測試資料：帶有室內噪音的背景，加上隨機長度、以音節調變的諧波語音段
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    audio = rng.normal(0, 80, n)
+    t = np.arange(n) / sample_rate
+    position = 0
+    while position < n:
+        length = int(rng.uniform(0.8, 4.0) * sample_rate)
+        if rng.random() < speech_ratio:
+            end = min(n, position + length)
+            seg_t = t[position:end]
+            pitch = rng.uniform(100, 220)
+            voice = sum(np.sin(2 * np.pi * pitch * k * seg_t) / k for k in range(1, 6))
+            syllables = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * seg_t), 0, None)
+            audio[position:end] += 3000 * voice * syllables
+        position += length
+    return np.clip(audio, -32768, 32767).astype(np.int16)
+
+def run_benchmark(paths, repeat=5, **options):
+    """
+    對錄音檔 (或合成的會議音訊) 執行 VAD，報告處理速度與節省的位元組
+    """
+    inputs = []
+    for path in paths:
+        with open(path, "rb") as f:
+            samples, sample_rate = read_wav(f.read())
+        inputs.append((path, samples, sample_rate))
+    if not inputs:
+        inputs.append(("synthetic:60s", synthetic_meeting(), DEFAULT_SAMPLE_RATE))
+
+    report = []
+    for name, samples, sample_rate in inputs:
+        timings = []
+        for _ in range(max(1, repeat)):
+            _, stats = trim_silence(samples, sample_rate, **options)
+            timings.append(stats["elapsed_ms"])
+        timings.sort()
+        median = timings[len(timings) // 2]
+        report.append(dict(stats, file=name, sample_rate=sample_rate, median_ms=median,
+                           realtime_factor=round(stats["duration_ms"] / median, 1) if median else None))
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="16-bit PCM 的語音活動偵測與靜音裁剪")
+    parser.add_argument("--frame-ms", type=int, default=DEFAULT_FRAME_MS)
+    parser.add_argument("--margin-db", type=float, default=DEFAULT_MARGIN_DB)
+    parser.add_argument("--hangover-ms", type=int, default=DEFAULT_HANGOVER_MS)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    trim = sub.add_parser("trim", help="裁剪 WAV 檔並印出統計")
+    trim.add_argument("input")
+    trim.add_argument("-o", "--output", default=None)
+
+    sub.add_parser("stage", help='從 stdin 讀取 {"data", "mime_type", "sample_rate"}，輸出裁剪後的 JSON')
+
+    bench = sub.add_parser("bench", help="以錄音檔 (預設為合成的會議音訊) 測試速度與節省的位元組")
+    bench.add_argument("files", nargs="*")
+    bench.add_argument("--repeat", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    options = {"frame_ms": args.frame_ms, "margin_db": args.margin_db, "hangover_ms": args.hangover_ms}
+
+    if args.command == "stage":
+        request = json.load(sys.stdin)
+        result = process_base64(request["data"], request.get("mime_type") or "audio/wav",
+                                request.get("sample_rate") or DEFAULT_SAMPLE_RATE, **options)
+        print(json.dumps(result))
+        return 0
+
+    if args.command == "trim":
+        with open(args.input, "rb") as f:
+            samples, sample_rate = read_wav(f.read())
+        trimmed, stats = trim_silence(samples, sample_rate, **options)
+        if args.output:
+            with open(args.output, "wb") as f:
+                f.write(write_wav(trimmed, sample_rate))
+        print(json.dumps(stats, indent=2))
+        return 0
+
+    for entry in run_benchmark(args.files, args.repeat, **options):
+        print(f"{entry['file']}: {entry['duration_ms'] / 1000:.1f} 秒音訊, {entry['segments']} 個語音段, "
+              f"保留 {entry['kept_ms'] / 1000:.1f} 秒, 節省 {entry['bytes_saved']} 位元組 ({entry['saved_ratio']:.1%}), "
+              f"處理 {entry['median_ms']:.2f} ms (即時速度的 {entry['realtime_factor']} 倍)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
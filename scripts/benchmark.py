@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from hedging import percentile
+from upstream_stub import StubConfig, start_stub, parse_model_latency
+from state_paths import isolated_env
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SEARCH_SCRIPT = os.path.join(SCRIPT_DIR, "gemini_search.py")
+
+# gemini 的階段來自 gemini_search 結果中的 timings；search 為 gemini_web_search 本身的總耗時，
+# startup 為其餘的時間 (程序啟動、匯入，以及追蹤、指標與路由紀錄的寫入)
+STAGES = ["startup", "cache_lookup", "client_init", "build_request", "rate_limit_wait", "upstream", "parse",
+          "search", "total"]
+
+# 與測試腳本相同的查詢
+DEFAULT_QUERIES = [
+    "今天的新聞頭條是什麼？",
+    "NVIDIA 股票的當前價格是多少？",
+    "最新的 AI 技術發展有哪些？",
+]
+
+DEFAULT_MODELS = {
+    "gemini": "gemini-2.0-flash",
+    "perplexity": "sonar",
+}
+
+def unique_query(query, n):
+    """
+    為每次迭代產生不同的查詢，讓每次都走完整的快取未命中路徑
+    """
+    return f"{query} (#{n})"
+
+def search_timings(result, total):
+    """
+    將 gemini_search 結果中的 timings (毫秒) 轉為各階段秒數
+    """
+    if result.get("error"):
+        return {"error": result["error"], "total": total}
+    stages = result.get("timings") or {}
+    timings = {stage: stages[stage] / 1000 for stage in STAGES if stage in stages and stage != "total"}
+    timings["search"] = stages.get("total", 0.0) / 1000
+    timings["startup"] = max(0.0, total - timings["search"])
+    timings["total"] = total
+    return timings
+
+def run_gemini(mode, model, query, env):
+    """
+    以 gemini_search 執行一次完整的搜尋 (快取、請求合併、限流、重試與斷路器，以及結束時的紀錄寫入)；
+    process 模式與 route 的一次性執行相同，每次查詢啟動新的 gemini_search.py 程序
+    """
+    start = time.monotonic()
+    if mode == "process":
+        completed = subprocess.run([sys.executable, SEARCH_SCRIPT, query, model], env=env,
+                                   capture_output=True, text=True)
+        total = time.monotonic() - start
+        try:
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            return {"error": completed.stderr.strip()[-500:] or f"exit code {completed.returncode}", "total": total}
+        return search_timings(result, total)
+
+    import gemini_search
+    try:
+        result = gemini_search.gemini_web_search(query, model)
+        gemini_search.record_call(query, model, result, "benchmark")
+    except Exception as e:
+        return {"error": str(e), "total": time.monotonic() - start}
+    return search_timings(result, time.monotonic() - start)
+
+def run_stages(model, query, base_url):
+    """
+    依序執行 Perplexity 搜尋路徑的各個階段並記錄耗時 (秒)
+    """
+    timings = {}
+    start = time.monotonic()
+    from openai import OpenAI
+    timings["import"] = time.monotonic() - start
+
+    start = time.monotonic()
+    client = OpenAI(api_key="stub", base_url=base_url)
+    timings["client_init"] = time.monotonic() - start
+
+    start = time.monotonic()
+    response = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": query}],
+    )
+    timings["upstream"] = time.monotonic() - start
+
+    start = time.monotonic()
+    answer = response.choices[0].message.content
+    citations = getattr(response, "citations", None) or []
+    timings["parse"] = time.monotonic() - start
+    if not answer and not citations:
+        raise ValueError("Empty response")
+
+    return timings
+
+def run_iteration(mode, provider, model, query, base_url, env=None):
+    """
+    執行一次查詢，返回各階段耗時；process 模式會為每次查詢啟動新的 Python 程序
+    """
+    if provider == "gemini":
+        return run_gemini(mode, model, query, env)
+
+    start = time.monotonic()
+    if mode == "process":
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker",
+             "--provider", provider, "--model", model, "--query", query, "--base-url", base_url],
+            capture_output=True, text=True, env=env,
+        )
+        total = time.monotonic() - start
+        try:
+            timings = json.loads(completed.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            return {"error": completed.stderr.strip()[-500:] or f"exit code {completed.returncode}", "total": total}
+        if timings.get("error"):
+            timings["total"] = total
+            return timings
+    else:
+        try:
+            timings = run_stages(model, query, base_url)
+        except Exception as e:
+            return {"error": str(e), "total": time.monotonic() - start}
+        total = time.monotonic() - start
+
+    # startup 包含程序啟動與 import，其餘時間由各階段扣除得到
+    timings["startup"] = max(0.0, total - timings["client_init"] - timings["upstream"] - timings["parse"])
+    timings["total"] = total
+    return timings
+
+def summarize(samples, wall_time):
+    """
+    計算各階段的 p50/p95/p99 與吞吐量
+    """
+    ok = [s for s in samples if not s.get("error")]
+    stages = {}
+    for stage in STAGES:
+        values = sorted(s[stage] for s in ok if stage in s)
+        if not values:
+            continue
+        stages[stage] = {
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+            "mean": sum(values) / len(values),
+        }
+    return {
+        "iterations": len(samples),
+        "errors": len(samples) - len(ok),
+        "wall_time": wall_time,
+        "throughput": len(ok) / wall_time if wall_time > 0 else 0.0,
+        "stages": stages,
+    }
+
+def compare_with_baseline(summary, baseline, tolerance, min_delta):
+    """
+    與基準結果比較，返回退步的項目列表
+    """
+    regressions = []
+    for stage, stats in summary["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base:
+            continue
+        for key in ("p50", "p95", "p99"):
+            current, previous = stats[key], base[key]
+            if current - previous > min_delta and current > previous * (1 + tolerance):
+                regressions.append({"stage": stage, "metric": key, "baseline": previous, "current": current})
+    return regressions
+
+def print_summary(summary, regressions=None):
+    print(f"迭代次數: {summary['iterations']}  錯誤: {summary['errors']}")
+    print(f"總耗時: {summary['wall_time']:.2f} 秒  吞吐量: {summary['throughput']:.2f} 次/秒")
+    print("-" * 50)
+    print(f"{'階段':<16}{'p50':>10}{'p95':>10}{'p99':>10}{'平均':>10}")
+    for stage in STAGES:
+        stats = summary["stages"].get(stage)
+        if stats:
+            print(f"{stage:<16}" + "".join(f"{stats[k] * 1000:>9.1f}ms" for k in ("p50", "p95", "p99", "mean")))
+    if regressions is not None:
+        print("-" * 50)
+        if regressions:
+            print("與基準相比出現退步:")
+            for r in regressions:
+                print(f"- {r['stage']} {r['metric']}: {r['baseline'] * 1000:.1f}ms -> {r['current'] * 1000:.1f}ms")
+        else:
+            print("與基準相比沒有退步")
+
+def run_benchmark(args):
+    model = args.model or DEFAULT_MODELS[args.provider]
+    queries = args.queries or DEFAULT_QUERIES
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        config = StubConfig(args.latency, parse_model_latency(args.model_latency), args.error_rate, seed=args.seed)
+        server, base_url = start_stub(config=config)
+
+    saved_env = dict(os.environ)
+    try:
+        with tempfile.TemporaryDirectory() as state_dir:
+            # 所有狀態寫入暫存目錄，每次基準測試都從空的快取與統計開始
+            env = isolated_env(state_dir)
+            env["GEMINI_API_BASE_URL"] = base_url
+            env.setdefault("NEXT_PUBLIC_GEMINI_API_KEY", "stub")
+            if args.mode == "inprocess":
+                os.environ.update(env)
+
+            # 預熱一次，避免第一次的檔案快取影響結果
+            for n in range(args.warmup):
+                run_iteration(args.mode, args.provider, model, unique_query(queries[0], f"warmup-{n}"), base_url, env)
+
+            jobs = list(itertools.islice(itertools.cycle(queries), args.iterations))
+            if not args.cache_hits:
+                jobs = [unique_query(query, n) for n, query in enumerate(jobs)]
+            start = time.monotonic()
+            with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+                samples = list(pool.map(lambda q: run_iteration(args.mode, args.provider, model, q, base_url, env), jobs))
+            wall_time = time.monotonic() - start
+            if args.mode == "inprocess" and args.provider == "gemini":
+                # 累積的合併計數在暫存目錄刪除前寫入
+                from singleflight import get_default_singleflight
+                get_default_singleflight().flush_stats()
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        if server is not None:
+            server.shutdown()
+
+    summary = summarize(samples, wall_time)
+    summary.update({
+        "provider": args.provider,
+        "model": model,
+        "mode": args.mode,
+        "concurrency": args.concurrency,
+        "cache_hits": args.cache_hits,
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+    })
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="搜尋路徑的離線延遲基準測試")
+    parser.add_argument("--provider", choices=["gemini", "perplexity"], default="gemini")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--mode", choices=["process", "inprocess"], default="process",
+                        help="process: 每次查詢啟動新程序 (與目前 route 相同)；inprocess: 模擬常駐模式")
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--query", dest="queries", action="append", help="查詢內容，可重複指定")
+    parser.add_argument("--cache-hits", action="store_true",
+                        help="重複使用相同的查詢 (之後的迭代命中快取)；預設每次迭代使用不同的查詢")
+    parser.add_argument("--base-url", default=None, help="使用現有的上游伺服器，而非內建的假伺服器")
+    parser.add_argument("--latency", default="fixed:0.05", help="假伺服器的延遲分佈，例如 lognormal:0.3,0.4")
+    parser.add_argument("--model-latency", action="append", metavar="MODEL=DIST")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=None, help="將結果寫入 JSON 檔案")
+    parser.add_argument("--baseline", default=None, help="與此基準結果比較，退步時以代碼 1 結束")
+    parser.add_argument("--save-baseline", default=None, help="將本次結果存為基準")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允許的相對退步比例")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="忽略小於此秒數的差異")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.worker:
+        # 子程序：執行一次 Perplexity 查詢並輸出各階段耗時
+        query = args.queries[0] if args.queries else DEFAULT_QUERIES[0]
+        try:
+            timings = run_stages(args.model or DEFAULT_MODELS[args.provider], query, args.base_url)
+        except Exception as e:
+            timings = {"error": str(e)}
+        print(json.dumps(timings))
+        return 0
+
+    summary = run_benchmark(args)
+
+    regressions = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_with_baseline(summary, json.load(f), args.tolerance, args.min_delta)
+        summary["regressions"] = regressions
+
+    print_summary(summary, regressions)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+            print(f"\n結果已保存到文件: {path}")
+
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
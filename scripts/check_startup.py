@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+from hedging import percentile
+from state_paths import isolated_env
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SEARCH_SCRIPT = os.path.join(SCRIPT_DIR, "gemini_search.py")
+
+# 冷啟動時間預算 (毫秒)：參數錯誤與快取命中都不應該匯入 SDK
+DEFAULT_BUDGET_MS = 250
+
+# 這些路徑上不允許出現的重量級模組
+HEAVY_MODULES = ("google.genai", "httpx", "asyncio")
+
+CHECK_QUERY = "startup budget check"
+
+def seed_cache(cache_path):
+    """
+    預先寫入一筆快取，讓快取命中的情境不需要網路
+    """
+    sys.path.insert(0, SCRIPT_DIR)
+    from search_cache import SearchCache, make_cache_key
+    import gemini_search
+
+    cache = SearchCache(cache_path)
+    cache.set(make_cache_key(CHECK_QUERY, gemini_search.DEFAULT_MODEL, gemini_search.PROMPT_TEMPLATE), {
+        "answer": "cached",
+        "citations": [],
+        "images": [],
+        "search_entry_point": None
+    }, ttl=3600)
+    cache.close()
+
+def scenarios():
+    return {
+        "no_args": [SEARCH_SCRIPT],
+        "cache_hit": [SEARCH_SCRIPT, CHECK_QUERY],
+    }
+
+def time_run(argv, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + argv, env=env, capture_output=True)
+    return (time.perf_counter() - start) * 1000
+
+def heavy_imports(argv, env):
+    """
+    以 -X importtime 執行一次，找出被匯入的重量級模組
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime"] + argv, env=env, capture_output=True, text=True)
+    found = set()
+    for line in completed.stderr.splitlines():
+        name = line.rsplit("|", 1)[-1].strip()
+        if name in HEAVY_MODULES:
+            found.add(name)
+    return sorted(found)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="檢查 gemini_search.py 的冷啟動時間是否超出預算")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        # 快取命中的情境也會寫入指標、路由與限流等儲存，全部指向暫存目錄
+        env = isolated_env(tmp)
+        env.pop("SEARCH_CASSETTE_MODE", None)
+        seed_cache(env["GEMINI_SEARCH_CACHE_PATH"])
+
+        for name, scenario in scenarios().items():
+            timings = sorted(time_run(scenario, env) for _ in range(max(1, args.runs)))
+            p50 = percentile(timings, 50)
+            heavy = heavy_imports(scenario, env)
+            ok = p50 <= args.budget_ms and not heavy
+            failed = failed or not ok
+            print(json.dumps({
+                "scenario": name,
+                "p50_ms": round(p50, 1),
+                "max_ms": round(timings[-1], 1),
+                "budget_ms": args.budget_ms,
+                "heavy_imports": heavy,
+                "ok": ok
+            }, ensure_ascii=False))
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
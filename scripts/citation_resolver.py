@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from search_logging import get_logger
+
+log = get_logger(__name__)
+
+# 預設的轉址快取位置與存活時間
+DEFAULT_REDIRECT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "redirect_cache.sqlite3")
+DEFAULT_REDIRECT_TTL = 7 * 24 * 3600
+
+# 整個解析階段的時間預算與單一請求的逾時 (秒)
+DEFAULT_BUDGET = 1.5
+DEFAULT_REQUEST_TIMEOUT = 1.0
+DEFAULT_MAX_WORKERS = 8
+
+class RedirectCache:
+    """
+    以 SQLite 儲存 grounding 轉址 URL 對應的最終網址
+    """
+
+    def __init__(self, path=DEFAULT_REDIRECT_CACHE_PATH, ttl=DEFAULT_REDIRECT_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS redirects (
+                url TEXT PRIMARY KEY,
+                final_url TEXT NOT NULL,
+                resolved_at REAL NOT NULL
+            )
+            """
+        )
+
+    def get_many(self, urls):
+        if not urls:
+            return {}
+        cutoff = time.time() - self.ttl
+        placeholders = ",".join("?" for _ in urls)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT url, final_url FROM redirects WHERE resolved_at > ? AND url IN ({placeholders})",
+                [cutoff] + list(urls),
+            ).fetchall()
+        return dict(rows)
+
+    def set_many(self, mapping):
+        if not mapping:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO redirects (url, final_url, resolved_at) VALUES (?, ?, ?)",
+                [(url, final_url, now) for url, final_url in mapping.items()],
+            )
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session(pool_size=DEFAULT_MAX_WORKERS):
+    """
+    取得共用的 keep-alive HTTP session，連線池大小與並行數一致
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = "Mozilla/5.0 (compatible; InteviaCitationResolver/1.0)"
+            _session = session
+        return _session
+
+def resolve_url(url, timeout=DEFAULT_REQUEST_TIMEOUT, session=None):
+    """
+    追蹤轉址並返回最終網址；部分網站不接受 HEAD，失敗時改用 GET (不下載內容)
+    """
+    session = session or get_session()
+    response = session.head(url, allow_redirects=True, timeout=timeout)
+    if response.status_code in (403, 405, 501):
+        response = session.get(url, allow_redirects=True, timeout=timeout, stream=True)
+        response.close()
+    return response.url
+
+def resolve_citations(citations, budget=DEFAULT_BUDGET, request_timeout=DEFAULT_REQUEST_TIMEOUT,
+                      max_workers=DEFAULT_MAX_WORKERS, cache=None):
+    """
+    並行解析引用中的轉址 URL，並依最終網址去除重複的引用。
+    超出時間預算仍未解析的 URL 保留原樣。
+
+    返回 (citations, stats)
+    """
+    start = time.monotonic()
+    urls = list(dict.fromkeys(c["url"] for c in citations if c.get("url")))
+
+    cache = cache or get_default_redirect_cache()
+    try:
+        resolved = cache.get_many(urls)
+    except sqlite3.Error as e:
+        log.warning(f"讀取轉址快取失敗: {e}")
+        resolved = {}
+    cache_hits = len(resolved)
+
+    pending = [url for url in urls if url not in resolved]
+    fresh = {}
+    if pending:
+        deadline = start + budget
+        session = get_session(max_workers)
+        pool = ThreadPoolExecutor(max_workers=min(max_workers, len(pending)), thread_name_prefix="citation-resolver")
+
+        def resolve(url):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            return resolve_url(url, min(request_timeout, remaining), session)
+
+        futures = {pool.submit(resolve, url): url for url in pending}
+        done, _ = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        # 不等待逾時的請求結束，讓呼叫端可以立即返回
+        pool.shutdown(wait=False, cancel_futures=True)
+        for future in done:
+            try:
+                final_url = future.result()
+            except Exception as e:
+                log.info(f"解析失敗 {futures[future]}: {e}")
+                continue
+            if final_url:
+                fresh[futures[future]] = final_url
+        try:
+            cache.set_many(fresh)
+        except sqlite3.Error as e:
+            log.warning(f"寫入轉址快取失敗: {e}")
+        resolved.update(fresh)
+
+    # 依最終網址去除重複，保留第一個出現的標題
+    merged = []
+    seen = set()
+    for citation in citations:
+        url = citation.get("url")
+        final_url = resolved.get(url, url)
+        if final_url in seen:
+            continue
+        seen.add(final_url)
+        item = dict(citation)
+        item["url"] = final_url
+        if final_url != url:
+            item["redirect_url"] = url
+        merged.append(item)
+
+    stats = {
+        "total": len(urls),
+        "cache_hits": cache_hits,
+        "resolved": len(fresh),
+        "unresolved": len(urls) - len(resolved),
+        "duplicates_removed": len(citations) - len(merged),
+        "elapsed": time.monotonic() - start,
+    }
+    return merged, stats
+
+_default_redirect_cache = None
+_default_redirect_cache_lock = threading.Lock()
+
+def get_default_redirect_cache():
+    """
+    取得共用的轉址快取實例
+    """
+    global _default_redirect_cache
+    with _default_redirect_cache_lock:
+        if _default_redirect_cache is None:
+            _default_redirect_cache = RedirectCache(os.environ.get("GEMINI_REDIRECT_CACHE_PATH", DEFAULT_REDIRECT_CACHE_PATH))
+        return _default_redirect_cache
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="解析 gemini_search.py 結果中的引用轉址")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_REQUEST_TIMEOUT)
+    args = parser.parse_args(argv)
+
+    # 從 stdin 讀取 gemini_search.py 的 JSON 結果
+    result = json.load(sys.stdin)
+    result["citations"], result["citation_resolution"] = resolve_citations(result.get("citations", []), args.budget, args.timeout)
+    print(json.dumps(result, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from rate_limiter import wait_for_slot, report_if_throttled
+from search_metrics import record_response
+
+# 與測試腳本相同的查詢
+DEFAULT_QUERIES = [
+    "今天的新聞頭條是什麼？",
+    "NVIDIA 股票的當前價格是多少？",
+    "最新的 AI 技術發展有哪些？",
+]
+
+# 各 provider 要比較的模型
+DEFAULT_MODELS = {
+    "gemini": ["gemini-2.0-flash", "gemini-1.5-pro", "gemini-1.5-flash"],
+    "perplexity": ["sonar"],
+}
+
+# 各 provider 同時進行的請求上限
+DEFAULT_CAPS = {
+    "gemini": 4,
+    "perplexity": 2,
+}
+
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
+
+PERPLEXITY_SYSTEM_PROMPT = (
+    "Please provide a concise answer to the question. Keep your answer brief and to the point. "
+    "Add relevant source links at the end in a new line, formatted as [Source name](URL)."
+)
+
+_perplexity_client = None
+_perplexity_client_lock = threading.Lock()
+
+def get_perplexity_client():
+    """
+    OpenAI 相容的 Perplexity 客戶端，所有執行緒共用；PERPLEXITY_API_BASE_URL 可指向本機的假上游伺服器
+    """
+    global _perplexity_client
+    with _perplexity_client_lock:
+        if _perplexity_client is None:
+            from openai import OpenAI
+            _perplexity_client = OpenAI(
+                api_key=os.environ.get("PERPLEXITY_API_KEY", "your_perplexity_api_key_here"),
+                base_url=os.environ.get("PERPLEXITY_API_BASE_URL", PERPLEXITY_BASE_URL),
+            )
+        return _perplexity_client
+
+def get_gemini_client():
+    """
+    每個執行緒各自的 google.genai 客戶端 (與 gemini_search.py 相同，GEMINI_API_BASE_URL 也適用)
+    """
+    import gemini_search
+    return gemini_search.get_client()
+
+def search_gemini(client, query, model):
+    """
+    以 google.genai 呼叫 Gemini (與 gemini_search.py 相同的提示詞與解析)，返回 (answer, links, response)
+    """
+    import gemini_search
+    prompt, config = gemini_search.build_request(query)
+    response = client.models.generate_content(model=model, contents=prompt, config=config)
+    result = gemini_search.parse_response(response)
+    return result["answer"], [(c["title"], c["url"]) for c in result["citations"]], response
+
+def search_perplexity(client, query, model):
+    """
+    以 OpenAI 相容客戶端呼叫 Perplexity，返回 (answer, links, response)
+    """
+    response = client.chat.completions.create(
+        model=model,
+        messages=[
+            {"role": "system", "content": PERPLEXITY_SYSTEM_PROMPT},
+            {"role": "user", "content": query},
+        ],
+        max_tokens=1024,
+        temperature=0.2,
+        extra_body={"return_related_questions": True},
+    )
+    answer = response.choices[0].message.content if response.choices else ""
+    citations = getattr(response, "citations", None) or []
+    return answer, [(url, url) for url in citations], response
+
+# 各 provider 的 (取得客戶端, 搜尋) 函式；建立客戶端的時間不計入該格的延遲
+PROVIDERS = {
+    "gemini": (get_gemini_client, search_gemini),
+    "perplexity": (get_perplexity_client, search_perplexity),
+}
+
+def run_cell(provider, model, query, semaphore):
+    """
+    執行矩陣中的一格：在 provider 的並行上限與共用限流額度內送出請求。
+    返回與測試腳本相同格式的結果字典，另外記錄排隊與限流等待的時間
+    """
+    get_client, search = PROVIDERS[provider]
+    queued = time.monotonic()
+    with semaphore:
+        acquired = time.monotonic()
+        waited = wait_for_slot(provider, model)
+        started = time.monotonic()
+        try:
+            client = get_client()
+            started = time.monotonic()
+            answer, links, response = search(client, query, model)
+            elapsed = time.monotonic() - started
+            record_response(provider, model, elapsed * 1000, response, mode="compare")
+            error = None
+        except Exception as e:
+            elapsed = time.monotonic() - started
+            report_if_throttled(provider, model, e)
+            record_response(provider, model, None, outcome="error", mode="compare")
+            answer, links, error = f"錯誤: {e}", [], str(e)
+    return {
+        "model": provider,
+        "model_name": model,
+        "query": query,
+        "response": answer or "未收到有效回答",
+        "elapsed_time": 0 if error else elapsed,
+        "links": links,
+        "error": error,
+        "queued_time": acquired - queued,
+        "rate_limit_wait": waited,
+    }
+
+def run_matrix(queries, models, caps=None, on_result=None):
+    """
+    以執行緒池並行執行 查詢 × provider × 模型 的矩陣，每個 provider 有各自的並行上限。
+    每完成一格就呼叫 on_result(result)；返回 (results, wall_time)。
+    queued_time 為等待並行上限的時間，不包含限流等待 (rate_limit_wait) 與建立客戶端
+    """
+    caps = dict(DEFAULT_CAPS, **(caps or {}))
+    semaphores = {provider: threading.BoundedSemaphore(max(1, caps.get(provider, 1))) for provider in models}
+    cells = [(provider, model, query) for query in queries for provider, names in models.items() for model in names]
+    workers = max(1, min(len(cells), sum(caps.get(provider, 1) for provider in models)))
+
+    started = time.monotonic()
+    results = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compare") as pool:
+        futures = [pool.submit(run_cell, provider, model, query, semaphores[provider])
+                   for provider, model, query in cells]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+    return results, time.monotonic() - started
+
+def print_result(result):
+    status = "錯誤" if result["error"] else f"{result['elapsed_time']:.2f} 秒"
+    print(f"[{result['model']}/{result['model_name']}] {result['query']} -> {status}, "
+          f"{len(result['links'])} 個來源, {len(result['response'])} 字符", flush=True)
+
+def summarize(results, queries, wall_time):
+    """
+    每個查詢比較各格的響應時間、來源數量與回答長度；並分開列出牆鐘時間與各格延遲總和
+    """
+    by_query = {query: [] for query in queries}
+    for result in results:
+        by_query[result["query"]].append(result)
+
+    summary = {"queries": [], "wall_time": wall_time,
+               "cell_time_total": sum(r["elapsed_time"] for r in results),
+               "cells": len(results), "errors": sum(1 for r in results if r["error"])}
+    for query, cells in by_query.items():
+        cells.sort(key=lambda r: (r["model"], r["model_name"]))
+        ok = [r for r in cells if not r["error"]]
+        fastest = min(ok, key=lambda r: r["elapsed_time"]) if ok else None
+        summary["queries"].append({
+            "query": query,
+            "fastest": None if fastest is None else f"{fastest['model']}/{fastest['model_name']}",
+            "cells": [
+                {"provider": r["model"], "model": r["model_name"], "elapsed_time": r["elapsed_time"],
+                 "queued_time": r["queued_time"], "rate_limit_wait": r["rate_limit_wait"],
+                 "sources": len(r["links"]), "answer_chars": len(r["response"]), "error": r["error"]}
+                for r in cells
+            ],
+        })
+    return summary
+
+def print_summary(summary):
+    for entry in summary["queries"]:
+        print("\n" + "=" * 50)
+        print(f"查詢: {entry['query']}")
+        print("=" * 50)
+        for cell in entry["cells"]:
+            name = f"{cell['provider']}/{cell['model']}"
+            if cell["error"]:
+                print(f"{name:<32} 錯誤: {cell['error']}")
+                continue
+            print(f"{name:<32} 響應時間 {cell['elapsed_time']:6.2f} 秒  排隊 {cell['queued_time']:5.2f} 秒  "
+                  f"限流等待 {cell['rate_limit_wait']:5.2f} 秒  "
+                  f"來源 {cell['sources']:2d}  回答長度 {cell['answer_chars']:5d} 字符")
+        if entry["fastest"]:
+            print(f"更快的模型: {entry['fastest']}")
+    print("\n" + "-" * 50)
+    print(f"共 {summary['cells']} 格, {summary['errors']} 個錯誤")
+    print(f"牆鐘時間: {summary['wall_time']:.2f} 秒  各格延遲總和: {summary['cell_time_total']:.2f} 秒")
+
+def parse_caps(items):
+    caps = {}
+    for item in items or []:
+        provider, _, value = item.partition("=")
+        caps[provider] = int(value)
+    return caps
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="並行比較多個 provider 與模型的網路搜尋結果")
+    parser.add_argument("queries", nargs="*", help="查詢，預設使用測試腳本的三個查詢")
+    parser.add_argument("--gemini-models", default=",".join(DEFAULT_MODELS["gemini"]), help="逗號分隔，空字串代表略過")
+    parser.add_argument("--perplexity-models", default=",".join(DEFAULT_MODELS["perplexity"]), help="逗號分隔，空字串代表略過")
+    parser.add_argument("--cap", action="append", metavar="PROVIDER=N", help="provider 的並行上限，例如 gemini=4")
+    parser.add_argument("--json", action="store_true", help="以 JSON 行串流輸出各格結果，最後輸出摘要")
+    parser.add_argument("--no-store", action="store_true", help="不寫入結果資料庫")
+    args = parser.parse_args(argv)
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv(".env.local")
+    except ImportError:
+        pass
+
+    queries = args.queries or DEFAULT_QUERIES
+    models = {provider: [m for m in names.split(",") if m]
+              for provider, names in (("gemini", args.gemini_models), ("perplexity", args.perplexity_models))}
+    models = {provider: names for provider, names in models.items() if names}
+
+    def emit(result):
+        if args.json:
+            print(json.dumps({"type": "result", **result}, ensure_ascii=False), flush=True)
+        else:
+            print_result(result)
+
+    results, wall_time = run_matrix(queries, models, parse_caps(args.cap), emit)
+    summary = summarize(results, queries, wall_time)
+    if not args.no_store:
+        from results_store import record_results
+        summary["run_id"] = record_results(results)
+
+    if args.json:
+        print(json.dumps({"type": "summary", **summary}, ensure_ascii=False))
+    else:
+        print_summary(summary)
+        if summary.get("run_id"):
+            print(f"結果已保存到結果資料庫 (run_id: {summary['run_id']})")
+    return 0 if summary["errors"] < summary["cells"] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import json
+import time
+import zlib
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+from search_logging import get_logger
+
+log = get_logger(__name__)
+
+# 預設的 search_entry_point 共用片段存放位置
+DEFAULT_ENTRY_POINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "entry_points.sqlite3")
+
+# 每次搜尋幾乎都相同的片段：<style> 區塊與內嵌的 SVG 圖示
+SHARED_PART = re.compile(r"<style\b[^>]*>.*?</style>|<svg\b[^>]*>.*?</svg>", re.IGNORECASE | re.DOTALL)
+
+# 短於此長度的片段直接保留在每次的內容中，換成參照反而不划算 (字元)
+MIN_SHARED_CHARS = 256
+
+# 共用片段在回應中的參照，內容為片段的 SHA-256 前 32 個十六進位字元
+PLACEHOLDER = re.compile(r"<!--ep:([0-9a-f]{32})-->")
+
+# 超過此大小的片段以 zlib 壓縮後存放 (位元組)
+COMPRESS_MIN_BYTES = 512
+
+def content_hash(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+def placeholder(digest):
+    return f"<!--ep:{digest}-->"
+
+def references(html):
+    """
+    返回 HTML 中參照的共用片段雜湊
+    """
+    return PLACEHOLDER.findall(html or "")
+
+class EntryPointStore:
+    """
+    以內容雜湊存放 search_entry_point 的共用片段 (CSS 與圖示)。
+    compact 將 HTML 中的共用片段換成參照，只保留每次查詢不同的部分；inline 將參照還原為完整 HTML
+    """
+
+    def __init__(self, path=DEFAULT_ENTRY_POINT_PATH, compress=True):
+        self.compress = compress
+        self._lock = threading.Lock()
+        # 本程序已寫入或讀取過的片段，避免每次搜尋都重複寫入與解壓縮
+        self._parts = {}
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS parts (
+                hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                encoding TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+
+    def put(self, content):
+        """
+        存放一個片段並返回它的雜湊；相同內容只會存放一次
+        """
+        digest = content_hash(content)
+        with self._lock:
+            if digest in self._parts:
+                return digest
+            raw = content.encode("utf-8")
+            data, encoding = raw, "identity"
+            if self.compress and len(raw) >= COMPRESS_MIN_BYTES:
+                data, encoding = zlib.compress(raw, 6), "zlib"
+            self._conn.execute(
+                "INSERT OR IGNORE INTO parts (hash, data, encoding, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                (digest, data, encoding, len(raw), time.time()),
+            )
+            self._parts[digest] = content
+        return digest
+
+    def get(self, digest):
+        """
+        以雜湊取得片段內容，不存在時返回 None
+        """
+        with self._lock:
+            content = self._parts.get(digest)
+            if content is not None:
+                return content
+            row = self._conn.execute("SELECT data, encoding FROM parts WHERE hash = ?", (digest,)).fetchone()
+            if row is None:
+                return None
+            data, encoding = row
+            content = (zlib.decompress(data) if encoding == "zlib" else bytes(data)).decode("utf-8")
+            self._parts[digest] = content
+            return content
+
+    def compact(self, html):
+        """
+        將 HTML 中的共用片段存入資料庫並換成參照，返回精簡後的 HTML
+        """
+        if not html:
+            return html
+
+        def replace(match):
+            part = match.group(0)
+            if len(part) < MIN_SHARED_CHARS:
+                return part
+            return placeholder(self.put(part))
+
+        return SHARED_PART.sub(replace, html)
+
+    def inline(self, html):
+        """
+        將參照還原為完整的 HTML；有片段找不到時返回 None
+        """
+        if not html or "<!--ep:" not in html:
+            return html
+        missing = []
+
+        def replace(match):
+            content = self.get(match.group(1))
+            if content is None:
+                missing.append(match.group(1))
+                return ""
+            return content
+
+        inlined = PLACEHOLDER.sub(replace, html)
+        if missing:
+            log.warning(f"找不到共用片段: {', '.join(missing)}")
+            return None
+        return inlined
+
+    def stats(self):
+        with self._lock:
+            count, size, stored = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM parts"
+            ).fetchone()
+        return {"parts": count, "bytes": size, "stored_bytes": stored}
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_default_entry_points():
+    """
+    取得共用的片段資料庫；GEMINI_ENTRY_POINT_COMPRESS=0 時不壓縮
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = EntryPointStore(
+                os.environ.get("GEMINI_ENTRY_POINT_PATH", DEFAULT_ENTRY_POINT_PATH),
+                os.environ.get("GEMINI_ENTRY_POINT_COMPRESS", "1") != "0",
+            )
+        return _default_store
+
+def compact_entry_point(html):
+    """
+    給搜尋路徑使用：資料庫無法使用時保留完整的 HTML
+    """
+    if not html:
+        return html
+    try:
+        return get_default_entry_points().compact(html)
+    except sqlite3.Error as e:
+        log.warning(f"寫入共用片段失敗: {e}")
+        return html
+
+def inline_result(result):
+    """
+    返回 search_entry_point 還原為完整 HTML 的結果副本 (結果可能與其他呼叫者共用，不就地修改)；
+    無法還原時保留參照
+    """
+    html = result.get("search_entry_point")
+    if not html or "<!--ep:" not in html:
+        return result
+    try:
+        inlined = get_default_entry_points().inline(html)
+    except sqlite3.Error as e:
+        log.warning(f"讀取共用片段失敗: {e}")
+        inlined = None
+    return result if inlined is None else dict(result, search_entry_point=inlined)
+
+def get_part(digest):
+    """
+    給常駐程序與 route 使用：以雜湊取得片段內容，雜湊格式不正確、不存在或讀取失敗時返回 None
+    """
+    if not PLACEHOLDER.fullmatch(placeholder(digest)):
+        return None
+    try:
+        return get_default_entry_points().get(digest)
+    except sqlite3.Error as e:
+        log.warning(f"讀取共用片段失敗: {e}")
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查詢 search_entry_point 的共用片段")
+    sub = parser.add_subparsers(dest="command", required=True)
+    get = sub.add_parser("get", help="印出指定雜湊的片段內容")
+    get.add_argument("hash")
+    sub.add_parser("stats", help="片段數量與壓縮前後的大小")
+    args = parser.parse_args(argv)
+
+    if args.command == "get":
+        content = get_part(args.hash)
+        if content is None:
+            print(f"找不到片段: {args.hash}", file=sys.stderr)
+            return 1
+        sys.stdout.write(content)
+        return 0
+
+    print(json.dumps(get_default_entry_points().stats()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+from collections import deque, OrderedDict
+
+import numpy as np
+
+# 預設的雜湊演算法、判定為不同畫面的漢明距離門檻，以及比對的最近畫面數量
+DEFAULT_ALGORITHM = "dhash"
+DEFAULT_THRESHOLD = 6
+DEFAULT_WINDOW = 4
+
+# 64 位元雜湊：dHash 使用 9x8 灰階縮圖，pHash 使用 32x32 縮圖的 DCT 左上角 8x8
+HASH_SIZE = 8
+PHASH_SIZE = 32
+
+# 常駐模式下保留的 session 數上限，以及閒置多久 (秒) 後丟棄該 session 的比較緩衝區
+MAX_SESSIONS = 64
+SESSION_IDLE_TTL = 30 * 60
+
+# 批次評估時讀取的圖片副檔名
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+def load_gray(data, size):
+    """
+    將 JPEG/PNG 位元組解碼為指定大小 (寬, 高) 的灰階陣列。
+    JPEG 會先以 draft 在解碼時直接縮小 (DCT 縮放)，不需要解碼完整解析度
+    """
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    image.draft("L", (size[0] * 4, size[1] * 4))
+    return np.asarray(image.convert("L").resize(size, Image.BILINEAR), dtype=np.float32)
+
+def _pack(bits):
+    # 將 64 個布林值組成一個整數雜湊
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+def dhash(gray):
+    """
+    差異雜湊：比較 (HASH_SIZE, HASH_SIZE + 1) 縮圖中每一列相鄰像素的亮度
+    """
+    return _pack(gray[:, 1:] > gray[:, :-1])
+
+_dct_matrix = None
+
+def _dct():
+    global _dct_matrix
+    if _dct_matrix is None:
+        n = np.arange(PHASH_SIZE)
+        matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * PHASH_SIZE)) * np.sqrt(2 / PHASH_SIZE)
+        matrix[0] /= np.sqrt(2)
+        _dct_matrix = matrix.astype(np.float32)
+    return _dct_matrix
+
+def phash(gray):
+    """
+    感知雜湊：對 32x32 縮圖做二維 DCT (兩次矩陣乘法)，低頻 8x8 係數與中位數比較
+    """
+    matrix = _dct()
+    low = (matrix @ gray @ matrix.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # 直流分量只反映整體亮度，不參與中位數
+    return _pack(low > np.median(low[1:]))
+
+# 各演算法的 (縮圖大小 (寬, 高), 雜湊函式)
+ALGORITHMS = {
+    "dhash": ((HASH_SIZE + 1, HASH_SIZE), dhash),
+    "phash": ((PHASH_SIZE, PHASH_SIZE), phash),
+}
+
+def frame_hash(data, algorithm=DEFAULT_ALGORITHM):
+    size, fn = ALGORITHMS[algorithm]
+    return fn(load_gray(data, size))
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+class FrameDeduper:
+    """
+    判斷畫面是否需要送往上游：與最近送出的 window 個畫面比較雜湊，
+    最小的漢明距離不超過 threshold 時視為重複而略過。
+
+    比較對象是已送出的畫面 (上游已看過的內容)，因此緩慢的捲動累積到門檻時仍會送出；
+    force 的畫面 (例如回應 [SCREEN_REQUEST] 的截圖) 一律送出，並加入比較緩衝區
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, window=DEFAULT_WINDOW, algorithm=DEFAULT_ALGORITHM):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown hash algorithm: {algorithm}")
+        self.threshold = threshold
+        self.algorithm = algorithm
+        self.recent = deque(maxlen=max(1, window))
+        self.frames = 0
+        self.forwarded = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_skipped = 0
+        self.hash_ms = 0.0
+
+    def check(self, data, force=False):
+        """
+        返回 {"forward", "distance", "hash", "hash_ms"}；distance 為與最近送出畫面的最小漢明距離 (沒有可比較的畫面時為 None)
+        """
+        started = time.perf_counter()
+        value = frame_hash(data, self.algorithm)
+        hash_ms = (time.perf_counter() - started) * 1000
+        distance = min((hamming(value, h) for h in self.recent), default=None)
+        forward = force or distance is None or distance > self.threshold
+
+        self.frames += 1
+        self.bytes_in += len(data)
+        self.hash_ms += hash_ms
+        if forward:
+            self.forwarded += 1
+            self.recent.append(value)
+        else:
+            self.skipped += 1
+            self.bytes_skipped += len(data)
+        return {"forward": forward, "distance": distance, "hash": f"{value:016x}", "hash_ms": round(hash_ms, 3)}
+
+    def stats(self):
+        return {
+            "algorithm": self.algorithm,
+            "threshold": self.threshold,
+            "window": self.recent.maxlen,
+            "frames": self.frames,
+            "forwarded": self.forwarded,
+            "skipped": self.skipped,
+            "skip_ratio": round(self.skipped / self.frames, 4) if self.frames else 0.0,
+            "bytes_in": self.bytes_in,
+            "bytes_skipped": self.bytes_skipped,
+            "avg_hash_ms": round(self.hash_ms / self.frames, 3) if self.frames else None,
+        }
+
+def serve(threshold=DEFAULT_THRESHOLD, window=DEFAULT_WINDOW, algorithm=DEFAULT_ALGORITHM, stdin=None, stdout=None,
+          max_sessions=MAX_SESSIONS, idle_ttl=SESSION_IDLE_TTL):
+    """
+    常駐模式：從 stdin 逐行讀取 JSON 請求，結果以 JSON 行寫回 stdout。每個 session 有各自的比較緩衝區；
+    閒置超過 idle_ttl 秒的 session 會被丟棄，數量超過 max_sessions 時丟棄最久沒有使用的
+
+    請求格式: {"id": ..., "session": "...", "data": "<base64 JPEG>", "force": false}
+              {"id": ..., "session": "...", "stats": true}
+              {"id": ..., "session": "...", "reset": true}
+    回應格式: {"id": ..., "result": {"forward": true, "distance": 12, ..., "stats": {...}}}
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    # session -> (FrameDeduper, 最後使用時間)，依最後使用的順序排列
+    sessions = OrderedDict()
+
+    def evict(now):
+        while sessions:
+            name, (_, last_used) = next(iter(sessions.items()))
+            if len(sessions) <= max_sessions and now - last_used <= idle_ttl:
+                break
+            del sessions[name]
+
+    def write(message):
+        stdout.write(json.dumps(message) + "\n")
+        stdout.flush()
+
+    # 預先載入影像解碼器，避免第一個畫面多花時間
+    from PIL import Image  # noqa: F401
+    write({"ready": True})
+
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            write({"id": None, "result": {"error": f"Invalid request: {e}"}})
+            continue
+
+        request_id = request.get("id")
+        session = str(request.get("session") or "default")
+        if request.get("reset"):
+            sessions.pop(session, None)
+        now = time.monotonic()
+        deduper = sessions.pop(session, (None, None))[0] or FrameDeduper(threshold, window, algorithm)
+        sessions[session] = (deduper, now)
+        evict(now)
+
+        if not request.get("data"):
+            write({"id": request_id, "result": {"stats": deduper.stats()}})
+            continue
+        try:
+            result = deduper.check(base64.b64decode(request["data"]), bool(request.get("force")))
+        except Exception as e:
+            # 無法解碼的畫面照常送出，由上游決定如何處理
+            print(f"[frame_dedup] 無法計算畫面雜湊: {e}", file=sys.stderr)
+            result = {"forward": True, "distance": None, "error": str(e)}
+        result["stats"] = deduper.stats()
+        write({"id": request_id, "result": result})
+
+def list_frames(paths):
+    """
+    展開目錄為其中的圖片 (依檔名排序)，作為錄製的畫面序列
+    """
+    frames = []
+    for path in paths:
+        if os.path.isdir(path):
+            frames.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                 if name.lower().endswith(IMAGE_EXTENSIONS)))
+        else:
+            frames.append(path)
+    return frames
+
+def evaluate(frames, thresholds, window=DEFAULT_WINDOW, algorithm=DEFAULT_ALGORITHM):
+    """
+    以錄製的畫面序列評估各門檻：每張圖只計算一次雜湊，再對每個門檻重播序列。
+    同時返回相鄰畫面距離的分佈，協助挑選門檻
+    """
+    hashes = []
+    sizes = []
+    started = time.perf_counter()
+    for path in frames:
+        with open(path, "rb") as f:
+            data = f.read()
+        hashes.append(frame_hash(data, algorithm))
+        sizes.append(len(data))
+    hash_ms = (time.perf_counter() - started) * 1000
+
+    report = []
+    for threshold in thresholds:
+        recent = deque(maxlen=max(1, window))
+        forwarded = []
+        for index, value in enumerate(hashes):
+            distance = min((hamming(value, h) for h in recent), default=None)
+            if distance is None or distance > threshold:
+                recent.append(value)
+                forwarded.append(index)
+        skipped = len(hashes) - len(forwarded)
+        report.append({
+            "threshold": threshold,
+            "frames": len(hashes),
+            "forwarded": len(forwarded),
+            "skipped": skipped,
+            "skip_ratio": round(skipped / len(hashes), 4) if hashes else 0.0,
+            "bytes_skipped": sum(sizes) - sum(sizes[i] for i in forwarded),
+            "forwarded_frames": [os.path.basename(frames[i]) for i in forwarded],
+        })
+
+    adjacent = [hamming(a, b) for a, b in zip(hashes, hashes[1:])]
+    histogram = {}
+    for distance in adjacent:
+        histogram[distance] = histogram.get(distance, 0) + 1
+    return {
+        "algorithm": algorithm,
+        "window": window,
+        "avg_hash_ms": round(hash_ms / len(hashes), 3) if hashes else None,
+        "adjacent_distance": dict(sorted(histogram.items())),
+        "thresholds": report,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以感知雜湊略過與最近送出畫面幾乎相同的截圖")
+    parser.add_argument("--algorithm", choices=sorted(ALGORITHMS), default=DEFAULT_ALGORITHM)
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="比較最近送出的幾個畫面")
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD, help="漢明距離不超過此值視為重複")
+    parser.add_argument("--server", action="store_true", help="以常駐模式執行，透過 stdin/stdout 交換 JSON 行")
+    parser.add_argument("--eval", nargs="+", metavar="PATH", help="評估錄製的畫面序列 (圖片檔或目錄)")
+    parser.add_argument("--thresholds", default="0,2,4,6,8,10,12,16", help="--eval 時要比較的門檻，逗號分隔")
+    parser.add_argument("--json", action="store_true", help="--eval 時以 JSON 輸出")
+    args = parser.parse_args(argv)
+
+    if args.server:
+        serve(args.threshold, args.window, args.algorithm)
+        return 0
+
+    if not args.eval:
+        parser.error("either --server or --eval is required")
+    frames = list_frames(args.eval)
+    if not frames:
+        print("找不到任何畫面", file=sys.stderr)
+        return 1
+    thresholds = [int(t) for t in args.thresholds.split(",") if t.strip()]
+    report = evaluate(frames, thresholds, args.window, args.algorithm)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"{len(frames)} 個畫面, {report['algorithm']}, window={report['window']}, "
+          f"平均雜湊時間 {report['avg_hash_ms']} ms")
+    print("相鄰畫面距離分佈: " + ", ".join(f"{d}:{n}" for d, n in report["adjacent_distance"].items()))
+    for entry in report["thresholds"]:
+        print(f"門檻 {entry['threshold']:3d}: 送出 {entry['forwarded']:5d}  略過 {entry['skipped']:5d} "
+              f"({entry['skip_ratio']:.1%})  節省 {entry['bytes_skipped']} 位元組")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
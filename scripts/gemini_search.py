@@ -1,109 +1,1331 @@
 #!/usr/bin/env python3
+import time
+
+_MODULE_START = time.perf_counter()
+
+# 這裡只匯入輕量的標準函式庫；google.genai、dotenv 與 asyncio 等較重的模組
+# 延遲到真正需要時才匯入，讓參數錯誤與快取命中不必負擔匯入成本
 import os
 import json
 import sys
-from google import genai
-from google.genai.types import Tool, GenerateContentConfig, GoogleSearch
-from dotenv import load_dotenv
+import argparse
+import threading
+from search_cache import get_default_cache, make_cache_key
+from hedging import get_default_history, resolve_hedge_delay, hedged_call
+from singleflight import get_default_singleflight
+from rate_limiter import get_default_limiter, estimate_tokens, report_if_throttled
+from resilience import call_with_retries, call_with_retries_async, is_transient_error
+from tracing import add_timing, trace, configure_trace_file
+from search_logging import get_logger, log_payload
+from search_metrics import record_result
+from prefetch import note_cache_hit
+from model_router import get_default_router, record_outcome
+from entry_point_store import compact_entry_point, inline_result, get_part
+from answer_index import get_default_index, index_enabled
+
+log = get_logger("gemini_search")
+
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+# 常駐模式下預設的 worker 數量
+DEFAULT_WORKERS = 4
+
+# 批次模式下預設的並行查詢數量
+DEFAULT_CONCURRENCY = 8
+
+# 上游失敗或逾時時，依序在這些模型的快取中尋找過期的回答
+STALE_FALLBACK_MODELS = ("gemini-2.0-flash", "gemini-1.5-flash", "gemini-1.5-pro")
+
+# 指定此模型名稱時由路由器依各模型最近的延遲與錯誤率選擇模型
+AUTO_MODEL = "auto"
+
+# 每個執行緒各自持有一個已初始化的客戶端
+_thread_local = threading.local()
 
-# 加載 .env.local 文件
-load_dotenv('.env.local')
+# 常駐模式下共用的事件迴圈 (對沖請求使用)
+_background_loop = None
 
-# 設置 API 金鑰
-GEMINI_API_KEY = os.environ.get("NEXT_PUBLIC_GEMINI_API_KEY", "your_gemini_api_key_here")
+# 非同步模式下正在進行中的請求，相同鍵的呼叫者共用同一個 future
+_inflight_async = {}
 
-# 配置 Gemini
-os.environ["GOOGLE_API_KEY"] = GEMINI_API_KEY
+# 已載入的設定，只在第一次呼叫 load_config 時讀取
+_config = None
+_config_lock = threading.Lock()
+
+# 提示詞模板，也是快取鍵的一部分
+PROMPT_TEMPLATE = """
+        請提供關於以下問題的簡潔回答。保持回答簡短且切中要點。
+
+        問題: {query}
+        """
+
+# 產生後續問題的提示詞 (不使用搜尋工具)，結果用於背景預取
+FOLLOW_UP_PROMPT = """
+        以下是使用者的問題與得到的回答。請列出使用者接下來最可能提出的 {limit} 個問題，
+        每行一個，使用與原問題相同的語言，不要編號或其他說明。
+
+        問題: {query}
+        回答: {answer}
+        """
 
-def gemini_web_search(query, model_id="gemini-2.0-flash"):
+# 回答只取前面這些字元放進產生後續問題的提示詞
+FOLLOW_UP_ANSWER_CHARS = 1500
+
+def load_config():
+    """
+    加載 .env.local 並設定 API 金鑰，結果會被快取，之後的呼叫直接返回
     """
-    使用 Gemini 的網路搜尋功能
+    global _config
+    with _config_lock:
+        if _config is not None:
+            return _config
+
+        # 加載 .env.local 文件
+        try:
+            from dotenv import load_dotenv
+            load_dotenv('.env.local')
+        except ImportError:
+            pass
+
+        # 設定 SEARCH_CASSETTE_MODE 時改用錄製/重播的傳輸層 (scripts/replay_transport.py)
+        if os.environ.get("SEARCH_CASSETTE_MODE"):
+            import replay_transport
+            replay_transport.install_from_env()
+
+        # 設置 API 金鑰
+        api_key = os.environ.get("NEXT_PUBLIC_GEMINI_API_KEY", "your_gemini_api_key_here")
+
+        # 配置 Gemini
+        os.environ["GOOGLE_API_KEY"] = api_key
+
+        _config = {
+            "api_key": api_key,
+            # GEMINI_API_BASE_URL 可指向本機的假上游伺服器 (scripts/upstream_stub.py)
+            "base_url": os.environ.get("GEMINI_API_BASE_URL"),
+        }
+        return _config
+
+def get_client():
+    """
+    取得目前執行緒的 Gemini 客戶端，第一次呼叫時才建立
+    """
+    client = getattr(_thread_local, "client", None)
+    if client is None:
+        config = load_config()
+        from google import genai
+        base_url = config["base_url"]
+        client = genai.Client(http_options={"base_url": base_url}) if base_url else genai.Client()
+        _thread_local.client = client
+    return client
+
+def run_async(coro):
+    """
+    在同步程式中執行 coroutine：常駐模式下交給共用的事件迴圈，否則直接 asyncio.run
+    """
+    import asyncio
+    if _background_loop is not None:
+        return asyncio.run_coroutine_threadsafe(coro, _background_loop).result()
+    return asyncio.run(coro)
+
+def start_background_loop():
+    """
+    啟動一個在背景執行緒中運行的事件迴圈，讓多個 worker 共用 client.aio
+    """
+    global _background_loop
+    import asyncio
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="gemini-search-loop", daemon=True).start()
+    _background_loop = loop
+    return loop
+
+def read_cache(key):
+    """
+    讀取快取，失敗時視為未命中
     """
     try:
-        # 初始化 Gemini 客戶端
-        client = genai.Client()
-        
-        # 設置 Google 搜尋工具
-        google_search_tool = Tool(
-            google_search = GoogleSearch()
+        return get_default_cache().get(key)
+    except Exception as e:
+        log.warning(f"讀取快取失敗: {e}")
+        return None
+
+def write_cache(key, result, ttl=None):
+    """
+    寫入快取，錯誤結果不寫入
+    """
+    if result.get("error"):
+        return
+    try:
+        get_default_cache().set(key, result, ttl)
+    except Exception as e:
+        log.warning(f"寫入快取失敗: {e}")
+
+def lookup_index(query):
+    """
+    在過去回答的索引中尋找可以直接使用的回答，沒有或失敗時返回 None
+    """
+    try:
+        result, match = get_default_index().lookup(query)
+    except Exception as e:
+        log.warning(f"查詢回答索引失敗: {e}")
+        return None
+    if result is None:
+        return None
+    result["cache"] = "index"
+    result["index"] = match
+    return result
+
+def index_answer(query, model_id, result):
+    """
+    將上游的回答加入索引，錯誤結果不加入
+    """
+    if not index_enabled() or result.get("error"):
+        return
+    try:
+        get_default_index().add(query, model_id, strip_meta(result), (result.get("timings") or {}).get("upstream"))
+    except Exception as e:
+        log.warning(f"寫入回答索引失敗: {e}")
+
+def record_latency(model_id, latency):
+    """
+    記錄成功請求的延遲，供對沖延遲的百分位數計算使用
+    """
+    try:
+        get_default_history().record(model_id, latency)
+    except Exception as e:
+        log.warning(f"記錄延遲失敗: {e}")
+
+def gemini_web_search(query, model_id=DEFAULT_MODEL, client=None, use_cache=True, cache_ttl=None,
+                      hedge_model=None, hedge_delay=None, hedge_percentile=None, deadline=None):
+    """
+    使用 Gemini 的網路搜尋功能，先查詢快取，未命中時才呼叫 API；
+    相同查詢的並行請求 (包含其他程序) 只會送出一次。
+    GEMINI_ANSWER_INDEX=1 時，快取未命中會再查詢過去回答的索引，有高度相似且仍有效的回答就直接返回
+
+    指定 deadline (秒) 時整個呼叫不會超過這個時間：期限內會重試暫時性錯誤，
+    期限到了或上游失敗時改為返回最新的過期快取，並標記為 degraded
+
+    結果中的 timings 記錄各階段耗時 (毫秒)；model_id 為 auto 時結果中的 route 記錄實際使用的模型
+    """
+    if model_id == AUTO_MODEL:
+        routed = time.monotonic()
+        model_id, route = route_model(query, use_cache)
+        route_ms = (time.monotonic() - routed) * 1000
+        result = gemini_web_search(query, model_id, client, use_cache, cache_ttl,
+                                   hedge_model, hedge_delay, hedge_percentile, deadline)
+        return attach_route(result, route, route_ms)
+
+    started = time.monotonic()
+    timings = {}
+    key = make_cache_key(query, model_id, PROMPT_TEMPLATE)
+    if use_cache:
+        cached = read_cache(key)
+        waited_from = add_timing(timings, "cache_lookup", started)
+        if cached is not None:
+            cached["cache"] = "hit"
+            if note_cache_hit(key):
+                cached["prefetched"] = True
+            cached["timings"] = finish_timings(timings, started)
+            return cached
+        if index_enabled():
+            indexed = lookup_index(query)
+            waited_from = add_timing(timings, "index_lookup", waited_from)
+            if indexed is not None:
+                indexed["timings"] = finish_timings(timings, started)
+                return indexed
+    else:
+        waited_from = started
+
+    deadline_at = None if deadline is None else time.monotonic() + deadline
+
+    def attempt(remaining):
+        if hedge_model:
+            # 對沖請求需要可取消的非同步呼叫
+            return run_async(call_upstream_async(query, model_id, client, hedge_model, hedge_delay, hedge_percentile, remaining))
+        return search_upstream(query, model_id, client, remaining)
+
+    def call_upstream():
+        result = call_with_retries(attempt, model_id, deadline_at, make_error=error_result)
+        if use_cache:
+            store_answer(query, model_id, key, result, cache_ttl)
+        return result
+
+    def coalesced_call():
+        try:
+            return get_default_singleflight().do(key, call_upstream)
+        except OSError as e:
+            log.warning(f"請求合併失敗: {e}")
+            return call_upstream(), False
+
+    if deadline_at is None:
+        result, shared = coalesced_call()
+    else:
+        # 逾時後上游請求仍在背景完成並寫入快取，這次呼叫則立即返回
+        outcome = run_with_deadline(coalesced_call, deadline)
+        result, shared = outcome if outcome is not None else (error_result("Deadline exceeded"), False)
+
+    return finish_result(query, model_id, result, shared, use_cache, timings, started, waited_from)
+
+def answered_by(model_id, result):
+    """
+    實際產生回答的模型：對沖請求由備用模型勝出時是備用模型
+    """
+    return (result.get("hedge") or {}).get("winner") or model_id
+
+def store_answer(query, model_id, key, result, cache_ttl=None):
+    """
+    將上游的結果寫入快取與回答索引；對沖由備用模型勝出時寫在備用模型的快取鍵下，
+    之後指定主要模型的請求不會拿到另一個模型的回答
+    """
+    answered = answered_by(model_id, result)
+    if answered != model_id:
+        key = make_cache_key(query, answered, PROMPT_TEMPLATE)
+    write_cache(key, strip_meta(result), cache_ttl)
+    index_answer(query, answered, result)
+
+def route_model(query, use_cache=True):
+    """
+    auto 模式下選擇模型，返回 (model_id, route)；
+    任一候選模型已有這個查詢的快取時直接使用，不必再呼叫上游
+    """
+    router = get_default_router()
+    try:
+        if use_cache:
+            for candidate in router.eligible():
+                if read_cache(make_cache_key(query, candidate, PROMPT_TEMPLATE)) is not None:
+                    return candidate, {"model": candidate, "reason": "cached", "score": None}
+        return router.choose()
+    except Exception as e:
+        log.warning(f"模型路由失敗: {e}")
+        return DEFAULT_MODEL, {"model": DEFAULT_MODEL, "reason": "fallback", "score": None}
+
+def attach_route(result, route, route_ms):
+    """
+    記錄 auto 模式選擇的模型，並將選擇模型的耗時計入 timings
+    """
+    result["route"] = route
+    timings = result.get("timings")
+    if timings is not None:
+        timings["route"] = round(route_ms, 2)
+        timings["total"] = round(timings.get("total", 0.0) + route_ms, 2)
+    return result
+
+def finish_result(query, model_id, result, shared, use_cache, timings, started, waited_from):
+    """
+    整理上游返回的結果：標記快取與合併狀態、合併各階段耗時，失敗時改用過期快取
+    """
+    result = dict(result)
+    upstream_timings = result.pop("timings", None) or {}
+    # 等待上游 (包含合併請求、重試與期限) 的整段時間
+    add_timing(timings, "upstream_wait", waited_from)
+    if not shared:
+        # 合併的請求由其他呼叫者送出，細部耗時只屬於那次呼叫
+        for stage, value in upstream_timings.items():
+            timings[stage] = timings.get(stage, 0.0) + value
+
+    result["coalesced"] = shared
+    result["cache"] = "miss" if use_cache else "bypass"
+    if result.get("error") and use_cache:
+        result = stale_fallback(query, model_id, result["error"]) or result
+    result["timings"] = finish_timings(timings, started)
+    return result
+
+def finish_timings(timings, started):
+    """
+    加上總耗時並四捨五入到 0.01 毫秒
+    """
+    add_timing(timings, "total", started)
+    return {stage: round(value, 2) for stage, value in timings.items()}
+
+def run_with_deadline(fn, timeout):
+    """
+    在背景執行緒中執行 fn，最多等待 timeout 秒；逾時返回 None
+    """
+    done = threading.Event()
+    outcome = {}
+
+    def run():
+        try:
+            outcome["value"] = fn()
+        except Exception as e:
+            outcome["value"] = (error_result(str(e)), False)
+        finally:
+            done.set()
+
+    threading.Thread(target=run, name="gemini-search-deadline", daemon=True).start()
+    if not done.wait(max(0.0, timeout)):
+        return None
+    return outcome["value"]
+
+def stale_fallback(query, model_id, reason):
+    """
+    在快取中尋找這個查詢最新的回答 (包含已過期的項目)，找到時標記為 degraded 返回
+    """
+    models = [model_id] + [m for m in STALE_FALLBACK_MODELS if m != model_id]
+    try:
+        result, age = get_default_cache().get_stale([make_cache_key(query, m, PROMPT_TEMPLATE) for m in models])
+    except Exception as e:
+        log.warning(f"讀取過期快取失敗: {e}")
+        return None
+    if result is None:
+        return None
+    result["cache"] = "stale"
+    result["degraded"] = {"reason": reason, "age": age}
+    return result
+
+def resolve_result_citations(result, budget=None):
+    """
+    後處理：解析引用的 grounding 轉址網址並依最終網址去除重複
+    """
+    from citation_resolver import resolve_citations, DEFAULT_BUDGET
+    started = time.monotonic()
+    try:
+        result["citations"], result["citation_resolution"] = resolve_citations(
+            result.get("citations") or [], DEFAULT_BUDGET if budget is None else budget
         )
-        
-        # 構建提示詞
-        prompt = f"""
-        請提供關於以下問題的簡潔回答。保持回答簡短且切中要點。
-        
-        問題: {query}
-        """
-        
+    except Exception as e:
+        log.warning(f"解析引用轉址失敗: {e}")
+    if "timings" in result:
+        elapsed = (time.monotonic() - started) * 1000
+        result["timings"]["citation_resolution"] = round(elapsed, 2)
+        result["timings"]["total"] = round(result["timings"].get("total", 0.0) + elapsed, 2)
+    return result
+
+def reserve_slot(model_id, prompt):
+    """
+    向共用限流器預扣額度，返回 (需要等待的秒數, 預估 token 數)
+    """
+    estimated = estimate_tokens(prompt)
+    limiter = get_default_limiter()
+    if limiter is None:
+        return 0.0, estimated
+    try:
+        return limiter.acquire("gemini", model_id, estimated), estimated
+    except Exception as e:
+        log.warning(f"限流器讀寫失敗: {e}")
+        return 0.0, estimated
+
+def settle_slot(model_id, estimated, response):
+    """
+    依回應中的實際 token 用量修正限流額度
+    """
+    limiter = get_default_limiter()
+    if limiter is None:
+        return
+    usage = getattr(response, "usage_metadata", None)
+    try:
+        limiter.settle("gemini", model_id, estimated, getattr(usage, "total_token_count", None))
+        limiter.report_success("gemini", model_id)
+    except Exception as e:
+        log.warning(f"限流器讀寫失敗: {e}")
+
+def strip_meta(result):
+    """
+    移除只屬於單次呼叫的欄位，避免寫入快取
+    """
+    return {k: v for k, v in result.items()
+            if k not in ("cache", "hedge", "coalesced", "attempts", "timings", "prefetched", "index")}
+
+def search_upstream(query, model_id=DEFAULT_MODEL, client=None, timeout=None):
+    """
+    直接呼叫 Gemini API 進行網路搜尋，timeout (秒) 限制單次請求的時間
+    """
+    timings = {}
+    mark = time.monotonic()
+    try:
+        # 初始化 Gemini 客戶端
+        if client is None:
+            client = get_client()
+        mark = add_timing(timings, "client_init", mark)
+
+        # 構建提示詞與搜尋工具設定
+        prompt, config = build_request(query, timeout)
+        mark = add_timing(timings, "build_request", mark)
+
+        # 依共用額度等待，避免觸發 API 限制
+        delay, estimated = reserve_slot(model_id, prompt)
+        if delay > 0:
+            time.sleep(delay)
+        mark = add_timing(timings, "rate_limit_wait", mark)
+
         # 發送請求
+        start = mark
         response = client.models.generate_content(
             model=model_id,
             contents=prompt,
-            config=GenerateContentConfig(
-                tools=[google_search_tool],
-                response_modalities=["TEXT"],
-            )
+            config=config
         )
-        
-        # 印出 Gemini 回應對象到 stderr
-        print(json.dumps(response, default=lambda o: str(o)), file=sys.stderr)
-        
-        # 提取回答
-        answer = ""
-        if response and response.candidates and len(response.candidates) > 0:
-            for part in response.candidates[0].content.parts:
-                answer += part.text
-        
-        # 提取引用
-        citations = []
-        if response and response.candidates and len(response.candidates) > 0:
-            candidate = response.candidates[0]
-            if candidate.grounding_metadata and candidate.grounding_metadata.grounding_chunks:
-                for chunk in candidate.grounding_metadata.grounding_chunks:
-                    if chunk.web:
-                        citations.append({
-                            "title": chunk.web.title,
-                            "url": chunk.web.uri
-                        })
-        
-        # 提取 search_entry_point
-        search_entry_point = None
-        if response and response.candidates and len(response.candidates) > 0:
-            candidate = response.candidates[0]
-            if candidate.grounding_metadata and candidate.grounding_metadata.search_entry_point:
-                search_entry_point = candidate.grounding_metadata.search_entry_point.rendered_content
-        
-        # 返回結果
-        result = {
-            "answer": answer,
-            "citations": citations,
-            "images": [],
-            "search_entry_point": search_entry_point
-        }
-        
-        return result
+        record_latency(model_id, time.monotonic() - start)
+        mark = add_timing(timings, "upstream", mark)
+        settle_slot(model_id, estimated, response)
+
+        # 完整回應只在 DEBUG 等級且被取樣時才序列化
+        log_payload(log, f"Gemini 回應 ({model_id})", lambda: response.model_dump_json(exclude_none=True))
+
+        mark = time.monotonic()
+        result = parse_response(response)
+        add_timing(timings, "parse", mark)
     except Exception as e:
-        return {
-            "error": str(e),
-            "answer": "",
-            "citations": [],
-            "images": [],
-            "search_entry_point": None
-        }
+        report_if_throttled("gemini", model_id, e)
+        result = error_result(str(e), is_transient_error(e))
+    result["timings"] = timings
+    return result
+
+def parse_response(response):
+    """
+    將 Gemini 回應轉換為結果字典
+    """
+    # 提取回答
+    answer = ""
+    candidate = None
+    if response and response.candidates and len(response.candidates) > 0:
+        candidate = response.candidates[0]
+        answer = extract_text(candidate)
+
+    # 提取引用
+    citations = extract_citations(candidate)
+
+    # 提取 search_entry_point
+    search_entry_point = extract_search_entry_point(candidate)
+
+    # 返回結果
+    return {
+        "answer": answer,
+        "citations": citations,
+        "images": [],
+        "search_entry_point": search_entry_point,
+        "usage": extract_usage(response)
+    }
+
+def extract_usage(response):
+    """
+    從 usage_metadata 提取 token 用量，沒有時返回 None
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": usage.prompt_token_count,
+        "completion_tokens": usage.candidates_token_count,
+        "total_tokens": usage.total_token_count,
+    }
+
+def is_cached(query, model_id=DEFAULT_MODEL):
+    """
+    這個查詢目前是否有未過期的快取 (auto 模式下任一候選模型有快取即可)
+    """
+    if model_id == AUTO_MODEL:
+        return route_model(query)[1]["reason"] == "cached"
+    return read_cache(make_cache_key(query, model_id, PROMPT_TEMPLATE)) is not None
+
+def suggest_follow_ups(query, answer, model_id=DEFAULT_MODEL, limit=3, client=None):
+    """
+    以一次不使用搜尋工具的呼叫，依問題與回答產生使用者可能接著問的問題 (供預取使用)；失敗時返回空串列
+    """
+    if model_id == AUTO_MODEL:
+        model_id = DEFAULT_MODEL
+    prompt = FOLLOW_UP_PROMPT.format(limit=limit, query=query, answer=(answer or "")[:FOLLOW_UP_ANSWER_CHARS])
+    try:
+        if client is None:
+            client = get_client()
+        delay, estimated = reserve_slot(model_id, prompt)
+        if delay > 0:
+            time.sleep(delay)
+        response = client.models.generate_content(model=model_id, contents=prompt)
+        settle_slot(model_id, estimated, response)
+        text = response.text or ""
+    except Exception as e:
+        report_if_throttled("gemini", model_id, e)
+        log.warning(f"產生後續問題失敗 ({model_id}): {e}")
+        return []
+    lines = (line.strip().lstrip("-*•0123456789.、)） ").strip() for line in text.splitlines())
+    return [line for line in lines if line][:limit]
+
+def prefetch_search(query, model_id=DEFAULT_MODEL, deadline=None):
+    """
+    預取後續問題使用的搜尋，結果寫入快取並記錄為 prefetch 指標
+    """
+    result = gemini_web_search(query, model_id, deadline=deadline)
+    record_call(query, model_id, result, "prefetch")
+    return result
+
+def record_call(query, model_id, result, mode):
+    """
+    每次搜尋結束時寫入追蹤紀錄、指標與模型路由統計
+    """
+    model_id = answered_by((result.get("route") or {}).get("model") or model_id, result)
+    trace(query, model_id, result, mode)
+    record_result("gemini", model_id, result, mode)
+    record_outcome(model_id, result)
+
+async def search_upstream_async(query, model_id=DEFAULT_MODEL, client=None, timeout=None):
+    """
+    使用非同步客戶端 (client.aio) 呼叫 Gemini API
+    """
+    timings = {}
+    mark = time.monotonic()
+    try:
+        if client is None:
+            client = get_client()
+        mark = add_timing(timings, "client_init", mark)
+
+        prompt, config = build_request(query, timeout)
+        mark = add_timing(timings, "build_request", mark)
+        delay, estimated = reserve_slot(model_id, prompt)
+        if delay > 0:
+            import asyncio
+            await asyncio.sleep(delay)
+        mark = add_timing(timings, "rate_limit_wait", mark)
+
+        start = mark
+        response = await client.aio.models.generate_content(
+            model=model_id,
+            contents=prompt,
+            config=config
+        )
+        record_latency(model_id, time.monotonic() - start)
+        mark = add_timing(timings, "upstream", mark)
+        settle_slot(model_id, estimated, response)
+        result = parse_response(response)
+        add_timing(timings, "parse", mark)
+    except Exception as e:
+        report_if_throttled("gemini", model_id, e)
+        result = error_result(str(e), is_transient_error(e))
+    result["timings"] = timings
+    return result
+
+async def call_upstream_async(query, model_id=DEFAULT_MODEL, client=None,
+                              hedge_model=None, hedge_delay=None, hedge_percentile=None, timeout=None):
+    """
+    非同步呼叫 API；指定 hedge_model 時會在延遲過長時對備用模型送出對沖請求
+    """
+    if not hedge_model:
+        return await search_upstream_async(query, model_id, client, timeout)
+    delay = resolve_hedge_delay(model_id, hedge_delay, hedge_percentile)
+    return await hedged_call(
+        lambda model: search_upstream_async(query, model, client, timeout),
+        model_id, hedge_model, delay,
+    )
+
+async def gemini_web_search_async(query, model_id=DEFAULT_MODEL, client=None, use_cache=True, cache_ttl=None,
+                                  hedge_model=None, hedge_delay=None, hedge_percentile=None, deadline=None):
+    """
+    gemini_web_search 的非同步版本，同樣會先查詢快取；
+    同一事件迴圈內相同查詢的並行請求只會送出一次
+    """
+    import asyncio
+    if model_id == AUTO_MODEL:
+        routed = time.monotonic()
+        model_id, route = route_model(query, use_cache)
+        route_ms = (time.monotonic() - routed) * 1000
+        result = await gemini_web_search_async(query, model_id, client, use_cache, cache_ttl,
+                                               hedge_model, hedge_delay, hedge_percentile, deadline)
+        return attach_route(result, route, route_ms)
+
+    started = time.monotonic()
+    timings = {}
+    key = make_cache_key(query, model_id, PROMPT_TEMPLATE)
+    if use_cache:
+        cached = read_cache(key)
+        waited_from = add_timing(timings, "cache_lookup", started)
+        if cached is not None:
+            cached["cache"] = "hit"
+            if note_cache_hit(key):
+                cached["prefetched"] = True
+            cached["timings"] = finish_timings(timings, started)
+            return cached
+        if index_enabled():
+            indexed = lookup_index(query)
+            waited_from = add_timing(timings, "index_lookup", waited_from)
+            if indexed is not None:
+                indexed["timings"] = finish_timings(timings, started)
+                return indexed
+    else:
+        waited_from = started
+
+    deadline_at = None if deadline is None else time.monotonic() + deadline
+
+    async def attempt(remaining):
+        return await call_upstream_async(query, model_id, client, hedge_model, hedge_delay, hedge_percentile, remaining)
+
+    async def call_upstream():
+        try:
+            result = await call_with_retries_async(attempt, model_id, deadline_at, make_error=error_result)
+        finally:
+            _inflight_async.pop(key, None)
+        if use_cache:
+            store_answer(query, model_id, key, result, cache_ttl)
+        return result
+
+    future = _inflight_async.get(key)
+    shared = future is not None
+    if not shared:
+        future = asyncio.ensure_future(call_upstream())
+        _inflight_async[key] = future
+
+    try:
+        # shield 讓逾時的呼叫者返回後，上游請求仍能完成並寫入快取
+        result = await asyncio.wait_for(asyncio.shield(future), deadline)
+    except asyncio.TimeoutError:
+        result = error_result("Deadline exceeded")
+
+    return finish_result(query, model_id, result, shared, use_cache, timings, started, waited_from)
+
+def gemini_decomposed_search(query, model_id=DEFAULT_MODEL, client=None, use_cache=True, cache_ttl=None,
+                             deadline=None, **hedge):
+    """
+    將包含多個獨立問題的查詢拆成子問題並行搜尋，再合併成一個結果；
+    無法拆分時等同 gemini_web_search
+    """
+    from query_decomposer import split_query
+    if len(split_query(query)) < 2:
+        return gemini_web_search(query, model_id, client, use_cache, cache_ttl, deadline=deadline, **hedge)
+    return run_async(gemini_decomposed_search_async(query, model_id, client, use_cache, cache_ttl, deadline, **hedge))
+
+async def gemini_decomposed_search_async(query, model_id=DEFAULT_MODEL, client=None, use_cache=True, cache_ttl=None,
+                                         deadline=None, **hedge):
+    """
+    gemini_decomposed_search 的非同步版本；各子問題共用同一個期限，
+    合併結果的 sub_queries 記錄每個子問題的快取狀態與耗時
+    """
+    import asyncio
+    from query_decomposer import split_query, merge_results
+    started = time.monotonic()
+    timings = {}
+    parts = split_query(query)
+    mark = add_timing(timings, "decompose", started)
+    if len(parts) < 2:
+        return await gemini_web_search_async(query, model_id, client, use_cache, cache_ttl, deadline=deadline, **hedge)
+
+    async def run_part(part):
+        try:
+            return await gemini_web_search_async(part, model_id, client, use_cache, cache_ttl, deadline=deadline, **hedge)
+        except Exception as e:
+            return error_result(str(e))
+
+    results = await asyncio.gather(*(run_part(part) for part in parts))
+    mark = add_timing(timings, "sub_searches", mark)
+    result = merge_results(parts, results)
+    add_timing(timings, "merge", mark)
+    result["timings"] = finish_timings(timings, started)
+    return result
+
+def read_batch(stream, default_model=DEFAULT_MODEL):
+    """
+    讀取批次查詢：每行一個問題，或是 {"query": ..., "model": ...} 形式的 JSON
+    """
+    requests = []
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = {"query": line}
+        else:
+            request = {"query": line}
+        request.setdefault("model", default_model)
+        requests.append(request)
+    return requests
+
+async def run_batch(requests, concurrency=DEFAULT_CONCURRENCY, use_cache=True, cache_ttl=None, stdout=None, hedge=None,
+                    resolve_citations=False, resolve_budget=None, deadline=None, decompose=False,
+                    inline_entry_point=False):
+    """
+    以有限的並行數同時執行多個查詢，並依輸入順序輸出 JSON 行
+    """
+    import asyncio
+    stdout = stdout or sys.stdout
+    hedge = hedge or {}
+    client = get_client()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(request):
+        async with semaphore:
+            try:
+                search = gemini_decomposed_search_async if request.get("decompose", decompose) else gemini_web_search_async
+                result = await search(
+                    request.get("query") or "",
+                    request.get("model") or DEFAULT_MODEL,
+                    client,
+                    use_cache=use_cache,
+                    cache_ttl=cache_ttl,
+                    deadline=request.get("deadline", deadline),
+                    **hedge,
+                )
+                if resolve_citations:
+                    result = await asyncio.to_thread(resolve_result_citations, result, resolve_budget)
+                record_call(request.get("query"), request.get("model") or DEFAULT_MODEL, result, "batch")
+                return inline_result(result) if inline_entry_point else result
+            except Exception as e:
+                # 單一查詢的錯誤不影響其他查詢
+                return error_result(str(e))
+
+    tasks = [asyncio.ensure_future(run_one(request)) for request in requests]
+
+    # 依輸入順序等待，前面的結果完成後就立即輸出
+    for index, (request, task) in enumerate(zip(requests, tasks)):
+        result = await task
+        stdout.write(json.dumps({
+            "index": index,
+            "query": request.get("query"),
+            "model": request.get("model"),
+            "result": result
+        }, ensure_ascii=False) + "\n")
+        stdout.flush()
+
+def build_request(query, timeout=None):
+    """
+    構建送往 Gemini 的提示詞與設定，timeout (秒) 會成為這次 HTTP 請求的逾時
+    """
+    from google.genai.types import Tool, GenerateContentConfig, GoogleSearch, HttpOptions
+
+    # 設置 Google 搜尋工具
+    google_search_tool = Tool(
+        google_search = GoogleSearch()
+    )
+    config = GenerateContentConfig(
+        tools=[google_search_tool],
+        response_modalities=["TEXT"],
+    )
+    if timeout is not None:
+        # HttpOptions 的逾時單位是毫秒
+        config.http_options = HttpOptions(timeout=max(1, int(timeout * 1000)))
+    return PROMPT_TEMPLATE.format(query=query), config
+
+def extract_text(candidate):
+    """
+    從候選回應中提取文字
+    """
+    text = ""
+    if candidate is not None and candidate.content and candidate.content.parts:
+        for part in candidate.content.parts:
+            if part.text:
+                text += part.text
+    return text
+
+def extract_citations(candidate):
+    """
+    從 grounding metadata 中提取引用
+    """
+    citations = []
+    if candidate is not None and candidate.grounding_metadata and candidate.grounding_metadata.grounding_chunks:
+        for chunk in candidate.grounding_metadata.grounding_chunks:
+            if chunk.web:
+                citations.append({
+                    "title": chunk.web.title,
+                    "url": chunk.web.uri
+                })
+    return citations
+
+def extract_search_entry_point(candidate):
+    """
+    從 grounding metadata 中提取 search_entry_point 的 HTML；
+    每次都相同的 CSS 與圖示存入 entry_point_store，HTML 中只留下參照 (inline_result 可還原)
+    """
+    if candidate is not None and candidate.grounding_metadata and candidate.grounding_metadata.search_entry_point:
+        return compact_entry_point(candidate.grounding_metadata.search_entry_point.rendered_content)
+    return None
+
+class UpstreamStream:
+    """
+    在背景執行緒中讀取一個模型的串流回應，讓呼叫端可以在等待片段時套用期限與對沖。
+    讀到的片段以 (stream, chunk) 放入共用的 events 佇列，正常結束時放入 (stream, None)，
+    失敗時放入 (stream, 例外)；cancel 之後不再讀取
+    """
+
+    def __init__(self, query, model_id, client, timeout, events):
+        self.model = model_id
+        self.timings = {}
+        self.last_chunk = None
+        self._events = events
+        self._cancelled = threading.Event()
+        threading.Thread(target=self._run, args=(query, client, timeout),
+                         name="gemini-search-stream", daemon=True).start()
+
+    def _run(self, query, client, timeout):
+        mark = time.monotonic()
+        try:
+            if client is None:
+                client = get_client()
+            mark = add_timing(self.timings, "client_init", mark)
+            prompt, config = build_request(query, timeout)
+            mark = add_timing(self.timings, "build_request", mark)
+            delay, estimated = reserve_slot(self.model, prompt)
+            if delay > 0:
+                time.sleep(delay)
+            add_timing(self.timings, "rate_limit_wait", mark)
+            for chunk in client.models.generate_content_stream(model=self.model, contents=prompt, config=config):
+                if self._cancelled.is_set():
+                    return
+                self.last_chunk = chunk
+                self._events.put((self, chunk))
+            # 用量資訊附在最後一個片段
+            settle_slot(self.model, estimated, self.last_chunk)
+            self._events.put((self, None))
+        except Exception as e:
+            report_if_throttled("gemini", self.model, e)
+            self._events.put((self, e))
+
+    def cancel(self):
+        self._cancelled.set()
+
+def next_stream_item(events, stream, deadline_at=None):
+    """
+    取出 stream 的下一個項目 (片段、None 或例外)，略過其他串流的項目；超過期限時拋出 TimeoutError
+    """
+    import queue
+    while True:
+        timeout = None if deadline_at is None else max(0.0, deadline_at - time.monotonic())
+        try:
+            owner, item = events.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("Deadline exceeded")
+        if owner is stream:
+            return item
+
+def open_stream(query, model_id=DEFAULT_MODEL, client=None, timeout=None,
+                hedge_model=None, hedge_delay=None, hedge_percentile=None):
+    """
+    開始串流並等待第一個片段，返回 {"stream", "first", "events", "hedge"}；
+    第一個片段之前失敗或超過 timeout 秒時返回錯誤結果，可交給 call_with_retries 重試。
+
+    指定 hedge_model 時，主要模型超過對沖延遲仍沒有片段就同時向備用模型串流，
+    採用先送出片段的一方並停止另一方
+    """
+    import queue
+    events = queue.Queue()
+    started = time.monotonic()
+    deadline_at = None if timeout is None else started + timeout
+    # 讀取串流的執行緒是臨時的，使用呼叫端執行緒的客戶端，避免每次串流都重新建立
+    if client is None:
+        client = get_client()
+    streams = [UpstreamStream(query, model_id, client, timeout, events)]
+    delay = None
+    hedge_at = None
+    if hedge_model and hedge_model != model_id:
+        delay = resolve_hedge_delay(model_id, hedge_delay, hedge_percentile)
+        hedge_at = started + delay
+    running = 1
+    error = None
+    failed = []
+    while True:
+        wake_at = min([t for t in (deadline_at, hedge_at) if t is not None], default=None)
+        try:
+            stream, item = events.get(timeout=None if wake_at is None else max(0.0, wake_at - time.monotonic()))
+        except queue.Empty:
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                remaining = None if deadline_at is None else deadline_at - time.monotonic()
+                streams.append(UpstreamStream(query, hedge_model, client, remaining, events))
+                hedge_at = None
+                running += 1
+                continue
+            for stream in streams:
+                stream.cancel()
+            return error_result("Deadline exceeded")
+        if isinstance(item, Exception):
+            error = error or item
+            if is_transient_error(item):
+                failed.append(stream.model)
+            running -= 1
+            # 對沖請求還沒送出時不必再等，直接交給重試
+            if running == 0:
+                for stream in streams:
+                    stream.cancel()
+                return error_result(str(error), is_transient_error(error))
+            continue
+        for other in streams:
+            if other is not stream:
+                other.cancel()
+        opened = {"stream": stream, "first": item, "events": events}
+        if delay is not None:
+            opened["hedge"] = {"winner": stream.model, "failed": failed, "hedged": len(streams) > 1, "delay": delay,
+                               "elapsed": time.monotonic() - started}
+        return opened
+
+def gemini_web_search_stream(query, model_id=DEFAULT_MODEL, client=None, use_cache=True, cache_ttl=None,
+                             resolve_citations=False, resolve_budget=None, inline_entry_point=False, deadline=None,
+                             hedge_model=None, hedge_delay=None, hedge_percentile=None):
+    """
+    以串流方式進行網路搜尋，依序產生事件：
+    answer 文字片段 (delta)、citations、search_entry_point，最後是帶有 timings 的 done
+
+    deadline、重試、斷路器與對沖只作用在第一個片段之前：期限內沒有任何片段或上游失敗時，
+    改為一次送出最新的過期快取 (done 的 cache 為 stale，並帶有 degraded)；
+    已經送出片段後才逾時或失敗，則送出 error 事件結束
+    """
+    def entry_point_event(html):
+        event = {"type": "search_entry_point", "search_entry_point": html}
+        return inline_result(event) if inline_entry_point else event
+
+    def replay(result, done):
+        # 快取或過期快取直接一次送出完整回答
+        yield {"type": "delta", "text": result["answer"]}
+        if resolve_citations:
+            resolve_result_citations(result, resolve_budget)
+        yield {"type": "citations", "citations": result["citations"]}
+        yield entry_point_event(result["search_entry_point"])
+        done["timings"] = finish_timings(timings, started)
+        record_call(query, model_id, dict(result, **done), "stream")
+        yield done
+
+    def fail(message, answer=""):
+        yield {"type": "error", "error": message}
+        done = {"type": "done", "cache": "miss" if use_cache else "bypass", "route": route,
+                "timings": finish_timings(timings, started)}
+        record_call(query, model_id, dict(error_result(message), answer=answer, **done), "stream")
+        yield done
+
+    started = time.monotonic()
+    timings = {}
+    route = None
+    if model_id == AUTO_MODEL:
+        model_id, route = route_model(query, use_cache)
+        add_timing(timings, "route", started)
+    key = None
+    if use_cache:
+        key = make_cache_key(query, model_id, PROMPT_TEMPLATE)
+        cached = read_cache(key)
+        add_timing(timings, "cache_lookup", started)
+        if cached is not None:
+            done = {"type": "done", "cache": "hit", "route": route}
+            if note_cache_hit(key):
+                done["prefetched"] = True
+            yield from replay(cached, done)
+            return
+
+    deadline_at = None if deadline is None else time.monotonic() + deadline
+    mark = time.monotonic()
+    opened = call_with_retries(
+        lambda remaining: open_stream(query, model_id, client, remaining, hedge_model, hedge_delay, hedge_percentile),
+        model_id, deadline_at, make_error=error_result,
+    )
+    add_timing(timings, "first_chunk", mark)
+    if opened.get("error"):
+        stale = stale_fallback(query, model_id, opened["error"]) if use_cache else None
+        if stale is not None:
+            yield from replay(stale, {"type": "done", "cache": "stale", "degraded": stale["degraded"], "route": route})
+        else:
+            yield from fail(opened["error"])
+        return
+
+    stream, chunk, events = opened["stream"], opened["first"], opened["events"]
+    for stage, value in stream.timings.items():
+        timings[stage] = timings.get(stage, 0.0) + value
+
+    answer = ""
+    citations = []
+    search_entry_point = None
+    # grounding metadata 通常只出現在最後幾個片段，所以逐片累積
+    while chunk is not None:
+        if chunk.candidates:
+            candidate = chunk.candidates[0]
+            text = extract_text(candidate)
+            if text:
+                answer += text
+                yield {"type": "delta", "text": text}
+            citations.extend(extract_citations(candidate))
+            search_entry_point = extract_search_entry_point(candidate) or search_entry_point
+        try:
+            chunk = next_stream_item(events, stream, deadline_at)
+        except TimeoutError as e:
+            stream.cancel()
+            chunk = e
+        if isinstance(chunk, Exception):
+            add_timing(timings, "upstream", mark)
+            yield from fail(str(chunk), answer)
+            return
+    add_timing(timings, "upstream", mark)
+
+    # 快取保存原始的引用，轉址解析只影響這次輸出
+    shown_citations = citations
+    if resolve_citations:
+        shown_citations = resolve_result_citations({"citations": citations}, resolve_budget)["citations"]
+    yield {"type": "citations", "citations": shown_citations}
+    yield entry_point_event(search_entry_point)
+
+    result = {
+        "answer": answer,
+        "citations": citations,
+        "images": [],
+        "search_entry_point": search_entry_point,
+        "usage": extract_usage(stream.last_chunk)
+    }
+    if key is not None:
+        store_answer(query, model_id, key, dict(result, hedge=opened.get("hedge")), cache_ttl)
+
+    done = {"type": "done", "cache": "miss" if use_cache else "bypass", "route": route,
+            "timings": finish_timings(timings, started)}
+    if "hedge" in opened:
+        done["hedge"] = opened["hedge"]
+    if opened.get("attempts", 1) > 1:
+        done["attempts"] = opened["attempts"]
+    record_call(query, model_id, dict(result, **done), "stream")
+    yield done
+
+def error_result(message, retryable=False):
+    """
+    構建錯誤時的結果格式；retryable 表示是可以重試的暫時性錯誤
+    """
+    result = {
+        "error": message,
+        "answer": "",
+        "citations": [],
+        "images": [],
+        "search_entry_point": None
+    }
+    if retryable:
+        result["retryable"] = True
+    return result
+
+def serve(workers=DEFAULT_WORKERS, stdin=None, stdout=None, hedge=None, resolve_citations=False, deadline=None,
+          prefetch=False, decompose=False, inline_entry_point=False):
+    """
+    常駐模式：從 stdin 逐行讀取 JSON 請求，結果以 JSON 行寫回 stdout
+
+    請求格式: {"id": ..., "query": "...", "model": "...", "deadline": 8, "hedge_model": "...", "resolve_citations": true,
+              "decompose": true, "inline_entry_point": false, "stream": false}
+    回應格式: {"id": ..., "result": {...}}
+    stream 為 true 時改為逐一寫回串流事件 {"id": ..., "event": {...}}，type 為 done 的事件代表結束
+
+    {"id": ..., "entry_point_part": "<雜湊>"} 取得 search_entry_point 的共用片段，回應為 {"id": ..., "result": {"content": "..."}}；
+    片段在本程序中已解壓縮並保留在記憶體，不必為每個片段啟動程序
+
+    prefetch 為 True 時，閒置期間會在背景預取結果中的後續問題
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    hedge = hedge or {}
+    prefetcher = None
+    if prefetch:
+        from prefetch import Prefetcher
+        prefetcher = Prefetcher(prefetch_search, is_cached, suggest=suggest_follow_ups)
+    start_background_loop()
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    write_lock = threading.Lock()
+
+    def write(message):
+        line = json.dumps(message, ensure_ascii=False)
+        with write_lock:
+            stdout.write(line + "\n")
+            stdout.flush()
+
+    def handle(request):
+        if prefetcher is None:
+            return handle_request(request)
+        prefetcher.foreground_started()
+        try:
+            handle_request(request)
+        finally:
+            prefetcher.foreground_finished()
+
+    def handle_request(request):
+        request_id = request.get("id")
+        if "entry_point_part" in request:
+            content = get_part(str(request["entry_point_part"]))
+            write({"id": request_id, "result": {"content": content} if content is not None else {"error": "Not found"}})
+            return
+        query = request.get("query")
+        if not query:
+            write({"id": request_id, "result": error_result("No query provided")})
+            return
+        if request.get("stream"):
+            stream_request(request_id, request, query)
+            return
+        try:
+            result = search_request(request, query)
+        except Exception as e:
+            # 每個請求都必須有回應，否則呼叫端會一直等到逾時
+            log.error(f"處理請求失敗 ({request_id}): {e}")
+            result = error_result(str(e))
+        write({"id": request_id, "result": result})
+        if prefetcher is not None and not result.get("error"):
+            prefetcher.submit(query, request.get("model") or DEFAULT_MODEL, result)
+
+    def stream_request(request_id, request, query):
+        done = False
+        try:
+            for event in gemini_web_search_stream(
+                query,
+                request.get("model") or DEFAULT_MODEL,
+                use_cache=not request.get("no_cache", False),
+                resolve_citations=request.get("resolve_citations", resolve_citations),
+                resolve_budget=request.get("resolve_budget"),
+                inline_entry_point=request.get("inline_entry_point", inline_entry_point),
+                deadline=request.get("deadline", deadline),
+                hedge_model=request.get("hedge_model", hedge.get("hedge_model")),
+                hedge_delay=request.get("hedge_delay", hedge.get("hedge_delay")),
+                hedge_percentile=request.get("hedge_percentile", hedge.get("hedge_percentile")),
+            ):
+                done = event["type"] == "done"
+                write({"id": request_id, "event": event})
+        except Exception as e:
+            log.error(f"處理串流請求失敗 ({request_id}): {e}")
+            if not done:
+                write({"id": request_id, "event": {"type": "error", "error": str(e)}})
+                write({"id": request_id, "event": {"type": "done", "cache": "miss", "timings": {}}})
+
+    def search_request(request, query):
+        search = gemini_decomposed_search if request.get("decompose", decompose) else gemini_web_search
+        result = search(
+            query,
+            request.get("model") or DEFAULT_MODEL,
+            use_cache=not request.get("no_cache", False),
+            hedge_model=request.get("hedge_model", hedge.get("hedge_model")),
+            hedge_delay=request.get("hedge_delay", hedge.get("hedge_delay")),
+            hedge_percentile=request.get("hedge_percentile", hedge.get("hedge_percentile")),
+            deadline=request.get("deadline", deadline),
+        )
+        if request.get("resolve_citations", resolve_citations):
+            resolve_result_citations(result, request.get("resolve_budget"))
+        record_call(query, request.get("model") or DEFAULT_MODEL, result, "server")
+        if request.get("inline_entry_point", inline_entry_point):
+            result = inline_result(result)
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gemini-search") as pool:
+        # 預熱：讓每個 worker 先建立好客戶端
+        for future in [pool.submit(get_client) for _ in range(workers)]:
+            try:
+                future.result()
+            except Exception as e:
+                log.warning(f"客戶端預熱失敗: {e}")
+
+        # 通知呼叫端已經可以接受請求
+        write({"ready": True, "workers": workers})
+
+        for line in stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                write({"id": None, "result": error_result(f"Invalid request: {e}")})
+                continue
+            pool.submit(handle, request)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini 網路搜尋")
+    parser.add_argument("query", nargs="?", help="搜尋問題")
+    parser.add_argument("model", nargs="?", default=DEFAULT_MODEL, help="使用的模型，auto 代表依最近的延遲與錯誤率自動選擇")
+    parser.add_argument("--server", action="store_true", help="以常駐模式執行，透過 stdin/stdout 交換 JSON 行")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="常駐模式下預熱的 worker 數量")
+    parser.add_argument("--batch", metavar="FILE", help="從檔案讀取多個查詢並行執行，'-' 代表 stdin")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="批次模式下的最大並行數")
+    parser.add_argument("--stream", action="store_true", help="以 NDJSON 事件串流輸出回答")
+    parser.add_argument("--no-cache", action="store_true", help="略過快取，直接呼叫 API")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="本次結果在快取中的存活秒數")
+    parser.add_argument("--deadline", type=float, default=None, help="整個搜尋的時間上限 (秒)，逾時改回傳過期快取")
+    parser.add_argument("--hedge-model", default=None, help="主要模型回應過慢時，對此模型送出對沖請求")
+    parser.add_argument("--hedge-delay", type=float, default=None, help="送出對沖請求前等待的秒數")
+    parser.add_argument("--hedge-percentile", type=float, default=None, help="以主要模型最近延遲的百分位數作為對沖延遲，例如 95")
+    parser.add_argument("--resolve-citations", action="store_true", help="解析引用的轉址網址並去除重複")
+    parser.add_argument("--resolve-budget", type=float, default=None, help="引用轉址解析的時間預算 (秒)")
+    parser.add_argument("--startup-report", action="store_true", help="印出各階段的冷啟動匯入時間 (毫秒)")
+    parser.add_argument("--trace-file", default=None, help="每次搜尋附加一行 JSON 追蹤紀錄到此檔案")
+    parser.add_argument("--prefetch", action="store_true", help="在背景預取結果中的後續問題，寫入快取")
+    parser.add_argument("--decompose", action="store_true", help="將包含多個問題的查詢拆成子問題並行搜尋後合併")
+    parser.add_argument("--answer-index", action="store_true",
+                        help="查詢過去回答的索引，相似問題直接使用舊的回答 (等同 GEMINI_ANSWER_INDEX=1)")
+    parser.add_argument("--inline-entry-point", action="store_true",
+                        help="輸出完整的 search_entry_point HTML，而不是共用片段的參照")
+    return parser.parse_args(argv)
+
+def startup_report():
+    """
+    依序載入各個延遲匯入的模組並計時，返回冷啟動的時間分佈 (毫秒)
+    """
+    import importlib
+    report = {"module": (_MODULE_END - _MODULE_START) * 1000}
+    stages = [
+        ("config", load_config),
+        ("asyncio", lambda: importlib.import_module("asyncio")),
+        ("google.genai", lambda: importlib.import_module("google.genai")),
+        ("google.genai.types", lambda: importlib.import_module("google.genai.types")),
+        ("client_init", get_client),
+    ]
+    for name, load in stages:
+        start = time.perf_counter()
+        load()
+        report[name] = (time.perf_counter() - start) * 1000
+    report["total"] = sum(report.values())
+    return report
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.startup_report:
+        print(json.dumps(startup_report()))
+        return 0
+
+    if not (args.query or args.server or args.batch):
+        print(json.dumps(error_result("No query provided")))
+        return 1
+
+    if args.trace_file:
+        configure_trace_file(args.trace_file)
+
+    if args.answer_index:
+        os.environ["GEMINI_ANSWER_INDEX"] = "1"
+
+    config_start = time.perf_counter()
+    load_config()
+    startup = {
+        "import": round((_MODULE_END - _MODULE_START) * 1000, 2),
+        "config": round((time.perf_counter() - config_start) * 1000, 2),
+    }
+    hedge = {
+        "hedge_model": args.hedge_model,
+        "hedge_delay": args.hedge_delay,
+        "hedge_percentile": args.hedge_percentile
+    }
+
+    if args.server:
+        serve(max(1, args.workers), hedge=hedge, resolve_citations=args.resolve_citations, deadline=args.deadline,
+              prefetch=args.prefetch, decompose=args.decompose, inline_entry_point=args.inline_entry_point)
+        return 0
+
+    if args.batch:
+        import asyncio
+        if args.batch == "-":
+            batch_requests = read_batch(sys.stdin, args.model)
+        else:
+            with open(args.batch, encoding="utf-8") as f:
+                batch_requests = read_batch(f, args.model)
+        asyncio.run(run_batch(batch_requests, args.concurrency, use_cache=not args.no_cache, cache_ttl=args.cache_ttl, hedge=hedge,
+                              resolve_citations=args.resolve_citations, resolve_budget=args.resolve_budget,
+                              deadline=args.deadline, decompose=args.decompose,
+                              inline_entry_point=args.inline_entry_point))
+        return 0
+
+    if args.stream:
+        for event in gemini_web_search_stream(args.query, args.model, use_cache=not args.no_cache, cache_ttl=args.cache_ttl,
+                                              resolve_citations=args.resolve_citations, resolve_budget=args.resolve_budget,
+                                              inline_entry_point=args.inline_entry_point, deadline=args.deadline,
+                                              **hedge):
+            print(json.dumps(event, ensure_ascii=False), flush=True)
+        return 0
+
+    search = gemini_decomposed_search if args.decompose else gemini_web_search
+    result = search(args.query, args.model, use_cache=not args.no_cache, cache_ttl=args.cache_ttl,
+                    deadline=args.deadline, **hedge)
+    if args.resolve_citations:
+        resolve_result_citations(result, args.resolve_budget)
+    # 一次性執行時，冷啟動的成本也屬於這次搜尋
+    result["timings"].update(startup)
+    record_call(args.query, args.model, result, "search")
+    if args.inline_entry_point:
+        result = inline_result(result)
+    print(json.dumps(result))
+    if args.prefetch and not result.get("error"):
+        sys.stdout.flush()
+        from prefetch import spawn_background
+        spawn_background(args.query, args.model, result)
+    return 0
+
+_MODULE_END = time.perf_counter()
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print(json.dumps({
-            "error": "No query provided",
-            "answer": "",
-            "citations": [],
-            "images": [],
-            "search_entry_point": None
-        }))
-        sys.exit(1)
-    
-    query = sys.argv[1]
-    model = sys.argv[2] if len(sys.argv) > 2 else "gemini-2.0-flash"
-    
-    result = gemini_web_search(query, model)
-    print(json.dumps(result)) 
\ No newline at end of file
+    sys.exit(main())
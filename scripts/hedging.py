@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+import os
+import time
+import math
+import sqlite3
+import threading
+
+# 預設的延遲記錄位置與每個模型保留的樣本數
+DEFAULT_HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "latency_history.sqlite3")
+DEFAULT_MAX_SAMPLES = 200
+
+# 樣本數不足時，改用固定的對沖延遲 (秒)
+DEFAULT_HEDGE_DELAY = 2.0
+MIN_SAMPLES_FOR_PERCENTILE = 10
+
+class LatencyHistory:
+    """
+    記錄各模型最近的回應延遲，跨程序共用 (SQLite)
+    """
+
+    def __init__(self, path=DEFAULT_HISTORY_PATH, max_samples=DEFAULT_MAX_SAMPLES):
+        self.path = path
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS latency_samples (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                model TEXT NOT NULL,
+                latency REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_latency_samples_model ON latency_samples (model, id)")
+
+    def record(self, model, latency):
+        """
+        寫入一筆延遲樣本，並只保留最近 max_samples 筆
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO latency_samples (model, latency, created_at) VALUES (?, ?, ?)",
+                (model, latency, time.time()),
+            )
+            self._conn.execute(
+                """
+                DELETE FROM latency_samples WHERE model = ? AND id NOT IN (
+                    SELECT id FROM latency_samples WHERE model = ? ORDER BY id DESC LIMIT ?
+                )
+                """,
+                (model, model, self.max_samples),
+            )
+
+    def samples(self, model):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT latency FROM latency_samples WHERE model = ? ORDER BY id DESC LIMIT ?",
+                (model, self.max_samples),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def percentile(self, model, p):
+        """
+        計算某模型延遲的第 p 百分位數，樣本不足時返回 None
+        """
+        values = sorted(self.samples(model))
+        if len(values) < MIN_SAMPLES_FOR_PERCENTILE:
+            return None
+        return percentile(values, p)
+
+def percentile(sorted_values, p):
+    """
+    以最近排名法計算已排序數列的第 p 百分位數
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, int(math.ceil(p / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+_default_history = None
+_default_history_lock = threading.Lock()
+
+def get_default_history():
+    """
+    取得共用的延遲記錄實例
+    """
+    global _default_history
+    with _default_history_lock:
+        if _default_history is None:
+            _default_history = LatencyHistory(os.environ.get("GEMINI_LATENCY_HISTORY_PATH", DEFAULT_HISTORY_PATH))
+        return _default_history
+
+def resolve_hedge_delay(model, delay=None, hedge_percentile=None, history=None):
+    """
+    決定送出對沖請求前要等待多久：
+    指定百分位數時依最近延遲計算，否則使用固定延遲
+    """
+    if hedge_percentile is not None:
+        history = history or get_default_history()
+        value = history.percentile(model, hedge_percentile)
+        if value is not None:
+            return value
+    return DEFAULT_HEDGE_DELAY if delay is None else delay
+
+async def hedged_call(call, primary_model, hedge_model, delay):
+    """
+    先以主要模型送出請求；若超過 delay 秒仍未完成，再以備用模型送出同一請求。
+    返回最先成功的結果，並取消另一個請求；結果的 hedge.winner 是實際回答的模型。
+
+    call 為 async 函式，接受模型名稱並返回結果字典 (失敗時帶有 "error")
+    """
+    import asyncio
+    start = time.monotonic()
+    tasks = {asyncio.ensure_future(call(primary_model)): primary_model}
+    hedged = False
+
+    done, _ = await asyncio.wait(tasks.keys(), timeout=delay)
+    if not done and hedge_model and hedge_model != primary_model:
+        tasks[asyncio.ensure_future(call(hedge_model))] = hedge_model
+        hedged = True
+
+    winner = None
+    result = None
+    failed = []
+    pending = set(tasks.keys())
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task_result = task.result()
+                if task_result.get("error") and task_result.get("retryable"):
+                    failed.append(tasks[task])
+                # 第一個完成的若是錯誤，繼續等待另一個請求
+                if result is None or (result.get("error") and not task_result.get("error")):
+                    result = task_result
+                    winner = tasks[task]
+            if result is not None and not result.get("error"):
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+
+    result["hedge"] = {
+        "winner": winner,
+        # 以暫時性錯誤結束、但沒有被採用的模型，由呼叫端計入各自的斷路器
+        "failed": [model for model in failed if model != winner],
+        "hedged": hedged,
+        "delay": delay,
+        "elapsed": time.monotonic() - start
+    }
+    return result
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime
+
+from hedging import percentile
+from state_paths import isolated_env
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SEARCH_SCRIPT = os.path.join(SCRIPT_DIR, "gemini_search.py")
+
+DEFAULT_URL = "http://localhost:3000/api/gemini-search"
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+# 查詢組合：會議中常見的問題模板 × 主題，依 Zipf 分佈抽樣，少數熱門問題重複出現 (快取命中)，其餘多為新問題
+QUERY_TEMPLATES = [
+    "{topic} 的最新消息是什麼？",
+    "{topic} 目前的市場狀況如何？",
+    "{topic} 和競爭對手相比有什麼優勢？",
+    "請簡單介紹 {topic}",
+    "What is the latest news about {topic}?",
+]
+QUERY_TOPICS = [
+    "NVIDIA", "台積電", "聯發科", "Apple", "Microsoft", "OpenAI", "Google Gemini", "AMD", "Intel", "Tesla",
+    "比特幣", "美元匯率", "台灣半導體產業", "生成式 AI", "電動車市場", "量子電腦", "5G 網路", "雲端運算",
+    "資安威脅", "Kubernetes",
+]
+DEFAULT_ZIPF = 1.1
+
+# 同時進行中的請求上限 (產生器本身的上限，超過時到達的請求會排隊，lag 會變大)
+DEFAULT_MAX_INFLIGHT = 512
+
+# 資源取樣間隔 (秒)
+DEFAULT_SAMPLE_INTERVAL = 0.5
+
+def build_query_mix(size=None, seed=None, zipf=DEFAULT_ZIPF):
+    """
+    返回 (queries, weights)：依 Zipf 分佈排序的查詢與抽樣權重
+    """
+    queries = [template.format(topic=topic) for topic in QUERY_TOPICS for template in QUERY_TEMPLATES]
+    random.Random(seed).shuffle(queries)
+    if size:
+        queries = queries[:size]
+    weights = [1.0 / (rank ** zipf) for rank in range(1, len(queries) + 1)]
+    return queries, weights
+
+def parse_steps(rate=None, duration=None, ramp=None):
+    """
+    返回 [(每秒請求數, 秒數)]；ramp 格式為 "1:10,5:10,10:10" (速率:持續秒數)
+    """
+    if ramp:
+        steps = []
+        for item in ramp.split(","):
+            value, _, seconds = item.partition(":")
+            steps.append((float(value), float(seconds or duration or 10)))
+        return steps
+    return [(float(rate or 1), float(duration or 30))]
+
+def arrival_schedule(steps, arrival="poisson", seed=None):
+    """
+    開放式負載的到達時間表 [(時間偏移, 階段索引)]：到達時間只由速率決定，不受回應速度影響。
+    poisson 的間隔為指數分佈，uniform 為固定間隔
+    """
+    rng = random.Random(seed)
+    schedule = []
+    start = 0.0
+    for index, (rate, duration) in enumerate(steps):
+        end = start + duration
+        t = start
+        while rate > 0:
+            t += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+            if t >= end:
+                break
+            schedule.append((t, index))
+        start = end
+    return schedule
+
+class HttpTarget:
+    """
+    對 Next.js route 送出 POST 請求 (與前端相同的請求格式)
+    """
+
+    name = "route"
+
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+
+    def request(self, query, model):
+        body = json.dumps({"query": query, "model": model}).encode("utf-8")
+        req = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return f"HTTP {e.code}"
+        return result.get("error")
+
+    def close(self):
+        pass
+
+class ScriptTarget:
+    """
+    每個請求啟動一次 gemini_search.py，與 route 的一次性執行 (execAsync) 相同
+    """
+
+    name = "script"
+
+    def __init__(self, env, timeout, no_cache=False):
+        self.env = env
+        self.timeout = timeout
+        self.no_cache = no_cache
+
+    def request(self, query, model):
+        args = [sys.executable, SEARCH_SCRIPT] + (["--no-cache"] if self.no_cache else []) + ["--", query, model]
+        try:
+            completed = subprocess.run(args, capture_output=True, text=True, env=self.env, timeout=self.timeout,
+                                       cwd=SCRIPT_DIR)
+        except subprocess.TimeoutExpired:
+            return f"timed out after {self.timeout:g}s"
+        try:
+            result = json.loads(completed.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            return completed.stderr.strip()[-200:] or f"exit code {completed.returncode}"
+        return result.get("error")
+
+    def close(self):
+        pass
+
+class ServerTarget:
+    """
+    常駐的 gemini_search.py --server 程序，與 route 的 SearchServer 相同，透過 stdin/stdout 交換 JSON 行
+    """
+
+    name = "server"
+
+    def __init__(self, env, timeout, workers=4, no_cache=False):
+        self.timeout = timeout
+        self.no_cache = no_cache
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._child = subprocess.Popen(
+            [sys.executable, SEARCH_SCRIPT, "--server", "--workers", str(workers)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, env=env, cwd=SCRIPT_DIR, bufsize=1,
+        )
+        self._ready = threading.Event()
+        threading.Thread(target=self._read, daemon=True).start()
+        if not self._ready.wait(60):
+            raise RuntimeError("search server did not become ready")
+
+    def _read(self):
+        for line in self._child.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if message.get("ready"):
+                self._ready.set()
+                continue
+            with self._lock:
+                future = self._pending.pop(message.get("id"), None)
+            if future is not None:
+                future.set_result(message.get("result") or {})
+        # 程序結束時讓等待中的請求失敗
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_result({"error": "search server exited"})
+
+    def request(self, query, model):
+        future = Future()
+        with self._lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._pending[request_id] = future
+            self._child.stdin.write(json.dumps({"id": request_id, "query": query, "model": model,
+                                                "no_cache": self.no_cache}, ensure_ascii=False) + "\n")
+            self._child.stdin.flush()
+        try:
+            return future.result(self.timeout).get("error")
+        except TimeoutError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            return f"timed out after {self.timeout:g}s"
+
+    def close(self):
+        try:
+            self._child.stdin.close()
+        except OSError:
+            pass
+        self._child.terminate()
+        self._child.wait(10)
+
+def read_process_table():
+    """
+    從 /proc 讀取 {pid: (ppid, rss_bytes, cmdline)}
+    """
+    page = os.sysconf("SC_PAGE_SIZE")
+    table = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                stat = f.read()
+            with open(f"/proc/{name}/statm") as f:
+                rss = int(f.read().split()[1]) * page
+            with open(f"/proc/{name}/cmdline", "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode("utf-8", "replace").strip()
+        except (OSError, IndexError, ValueError):
+            continue
+        # comm 可能包含空白與括號，ppid 在最後一個 ")" 之後的第二個欄位
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        table[int(name)] = (ppid, rss, cmdline)
+    return table
+
+def process_tree(table, roots, exclude=()):
+    """
+    返回 roots 及其所有子孫程序的 pid 集合；exclude 中的程序與其子孫不計入
+    """
+    children = {}
+    for pid, (ppid, _, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+    found = set()
+    stack = [pid for pid in roots if pid in table]
+    while stack:
+        pid = stack.pop()
+        if pid in found or pid in exclude:
+            continue
+        found.add(pid)
+        stack.extend(children.get(pid, []))
+    return found
+
+class ResourceSampler(threading.Thread):
+    """
+    測試期間定期記錄受測程序樹的程序數與 RSS 總和，以及產生器端進行中的請求數
+    """
+
+    def __init__(self, roots=(), match=None, parent=None, exclude=(), interval=DEFAULT_SAMPLE_INTERVAL, inflight=None):
+        super().__init__(daemon=True)
+        self.roots = list(roots)
+        self.parent = parent
+        self.match = match
+        self.exclude = set(exclude)
+        self.interval = interval
+        self.inflight = inflight or (lambda: 0)
+        self.samples = []
+        self.started_at = time.monotonic()
+        self._stopped = threading.Event()
+
+    def sample(self):
+        table = read_process_table()
+        roots = list(self.roots)
+        if self.match:
+            roots += [pid for pid, (_, _, cmdline) in table.items() if self.match in cmdline and pid != os.getpid()]
+        if self.parent is not None:
+            # parent 本身 (負載產生器) 不計入，只計入它啟動的受測程序
+            roots += [pid for pid, (ppid, _, _) in table.items() if ppid == self.parent]
+        pids = process_tree(table, roots, self.exclude)
+        return {
+            "t": time.monotonic() - self.started_at,
+            "processes": len(pids),
+            "rss_mb": sum(table[pid][1] for pid in pids) / (1024 * 1024),
+            "inflight": self.inflight(),
+        }
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.samples.append(self.sample())
+            except OSError as e:
+                print(f"[load_test] 讀取程序資訊失敗: {e}", file=sys.stderr)
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_stub_process(latency, model_latency=None, error_rate=0.0, seed=None):
+    """
+    以獨立程序啟動假上游伺服器 (不與產生器爭用 GIL，也不計入受測程序)，返回 (process, base_url)
+    """
+    port = free_port()
+    args = [sys.executable, os.path.join(SCRIPT_DIR, "upstream_stub.py"), "--port", str(port),
+            "--latency", latency, "--error-rate", str(error_rate)]
+    for item in model_latency or []:
+        args += ["--model-latency", item]
+    if seed is not None:
+        args += ["--seed", str(seed)]
+    process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("upstream stub did not start")
+
+def target_env(base_url, state_dir, keep_rate_limit=False):
+    # 所有狀態都指向暫存目錄，讓每次測試從相同的空狀態開始
+    env = isolated_env(state_dir)
+    env["GEMINI_API_BASE_URL"] = base_url
+    env["PERPLEXITY_API_BASE_URL"] = base_url
+    env.setdefault("GEMINI_API_KEY", "stub")
+    if not keep_rate_limit:
+        # 用戶端限流會讓結果反映的是設定的額度，而不是架構本身的瓶頸
+        env["SEARCH_RATE_LIMIT"] = "0"
+    return env
+
+def run_load(target, schedule, queries, weights, model=DEFAULT_MODEL, max_inflight=DEFAULT_MAX_INFLIGHT,
+             seed=None, sampler=None):
+    """
+    依到達時間表送出請求，返回每個請求的紀錄 {"step", "scheduled", "lag", "latency", "error"}。
+    延遲從排定的到達時間起算，產生器來不及送出造成的延誤也計入 (避免協同遺漏)
+    """
+    rng = random.Random(seed)
+    picks = rng.choices(queries, weights, k=len(schedule))
+    records = []
+    records_lock = threading.Lock()
+    inflight = [0]
+
+    def one(step, scheduled_at, offset, query):
+        sent = time.monotonic()
+        with records_lock:
+            inflight[0] += 1
+        error = None
+        try:
+            error = target.request(query, model)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finished = time.monotonic()
+        with records_lock:
+            inflight[0] -= 1
+            records.append({
+                "step": step,
+                "scheduled": offset,
+                "lag": sent - scheduled_at,
+                "latency": finished - scheduled_at,
+                "error": str(error)[:200] if error else None,
+            })
+
+    if sampler is not None:
+        sampler.inflight = lambda: inflight[0]
+        sampler.start()
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="load") as pool:
+        for (offset, step), query in zip(schedule, picks):
+            scheduled_at = started + offset
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(one, step, scheduled_at, offset, query)
+    wall_time = time.monotonic() - started
+    if sampler is not None:
+        sampler.stop()
+    return records, wall_time
+
+def summarize(records, steps, samples=None):
+    """
+    逐階段統計吞吐量、延遲百分位數、錯誤率與資源使用。
+    queue_growth 為階段後三分之一與前三分之一的平均延遲比，持續大於 1 代表請求在排隊、系統已經飽和
+    """
+    summary = []
+    start = 0.0
+    finished = [r["scheduled"] + r["latency"] for r in records if not r["error"]]
+    for index, (rate, duration) in enumerate(steps):
+        end = start + duration
+        items = [r for r in records if r["step"] == index]
+        ok = sorted(r["latency"] for r in items if not r["error"])
+        errors = [r["error"] for r in items if r["error"]]
+        window = [s for s in samples or [] if start <= s["t"] < end]
+        # 吞吐量以這段時間內完成的成功請求計算；最後一個階段延長到最後一個請求完成
+        window_end = max([end] + finished) if index == len(steps) - 1 else end
+        completed = sum(1 for t in finished if start <= t < window_end) if index else \
+            sum(1 for t in finished if t < window_end)
+        first = [r["latency"] for r in items if not r["error"] and r["scheduled"] < start + duration / 3]
+        last = [r["latency"] for r in items if not r["error"] and r["scheduled"] >= end - duration / 3]
+        entry = {
+            "step": index,
+            "offered_rps": rate,
+            "duration": duration,
+            "requests": len(items),
+            # Poisson 到達的實際速率會在設定值附近波動
+            "arrival_rps": round(len(items) / duration, 3),
+            "ok": len(ok),
+            "error_rate": round(len(errors) / len(items), 4) if items else 0.0,
+            "throughput_rps": round(completed / (window_end - start), 3),
+            "queue_growth": round((sum(last) / len(last)) / (sum(first) / len(first)), 2) if first and last else None,
+            "latency_ms": {
+                name: None if percentile(ok, p) is None else round(percentile(ok, p) * 1000, 1)
+                for name, p in (("p50", 50), ("p90", 90), ("p99", 99))
+            },
+            "max_lag_ms": round(max((r["lag"] for r in items), default=0.0) * 1000, 1),
+            "max_processes": max((s["processes"] for s in window), default=None),
+            "max_rss_mb": round(max((s["rss_mb"] for s in window), default=0.0), 1) if window else None,
+            "max_inflight": max((s["inflight"] for s in window), default=None),
+            "top_errors": {},
+        }
+        for error in errors:
+            entry["top_errors"][error] = entry["top_errors"].get(error, 0) + 1
+        entry["top_errors"] = dict(sorted(entry["top_errors"].items(), key=lambda kv: -kv[1])[:3])
+        summary.append(entry)
+        start = end
+    return summary
+
+def find_knee(summary, max_error_rate=0.01, p99_factor=3.0, max_queue_growth=2.0):
+    """
+    第一個無法承受的階段：錯誤率超過門檻、階段內延遲持續上升 (排隊)，或 p99 超過第一階段的 p99_factor 倍
+    """
+    base_p99 = next((s["latency_ms"]["p99"] for s in summary if s["latency_ms"]["p99"] is not None), None)
+    for entry in summary:
+        p99 = entry["latency_ms"]["p99"]
+        growth = entry["queue_growth"]
+        if (entry["error_rate"] > max_error_rate
+                or (growth is not None and growth > max_queue_growth)
+                or (base_p99 and p99 is not None and p99 > base_p99 * p99_factor)):
+            return entry["step"]
+    return None
+
+def print_summary(summary, knee, meta):
+    print(f"目標: {meta['target']}  到達模式: {meta['arrival']}  查詢數: {meta['distinct_queries']}  "
+          f"CPU: {meta['cpus']}  總耗時: {meta['wall_time']:.1f} 秒")
+    print(f"{'速率':>6} {'請求':>6} {'吞吐量':>8} {'錯誤率':>7} {'p50':>8} {'p90':>8} {'p99':>8} "
+          f"{'排隊':>6} {'最大延誤':>8} {'程序數':>6} {'RSS MB':>8} {'進行中':>6}")
+    for entry in summary:
+        latency = entry["latency_ms"]
+        fmt = lambda v: "-" if v is None else f"{v:.0f}"
+        print(f"{entry['offered_rps']:>6g} {entry['requests']:>6} {entry['throughput_rps']:>8.2f} "
+              f"{entry['error_rate']:>7.1%} {fmt(latency['p50']):>8} {fmt(latency['p90']):>8} {fmt(latency['p99']):>8} "
+              f"{'-' if entry['queue_growth'] is None else format(entry['queue_growth'], '.2f'):>6} "
+              f"{entry['max_lag_ms']:>8.0f} {fmt(entry['max_processes']):>6} {fmt(entry['max_rss_mb']):>8} "
+              f"{fmt(entry['max_inflight']):>6}")
+        for error, count in entry["top_errors"].items():
+            print(f"       錯誤 x{count}: {error}")
+    if knee is None:
+        print("所有階段都在負載範圍內")
+    else:
+        print(f"飽和點: 每秒 {summary[knee]['offered_rps']:g} 個請求 (第 {knee + 1} 階段)")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="以開放式到達速率 (Poisson 或階梯) 對搜尋路徑進行負載測試")
+    parser.add_argument("--target", choices=["route", "script", "server"], default="script",
+                        help="route: 對 Next.js route 送出 HTTP 請求；script: 每個請求啟動一次 gemini_search.py；"
+                             "server: 常駐的 gemini_search.py --server")
+    parser.add_argument("--url", default=DEFAULT_URL, help="route 目標的網址")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--rate", type=float, default=2.0, help="每秒請求數 (未指定 --ramp 時)")
+    parser.add_argument("--duration", type=float, default=30.0, help="持續秒數 (未指定 --ramp 時)")
+    parser.add_argument("--ramp", default=None, help="階梯速率，例如 1:20,2:20,4:20,8:20 (每秒請求數:秒數)")
+    parser.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--queries", type=int, default=None, help="查詢組合中不同查詢的數量")
+    parser.add_argument("--zipf", type=float, default=DEFAULT_ZIPF, help="查詢熱門程度的 Zipf 指數，0 代表均勻")
+    parser.add_argument("--no-cache", action="store_true", help="script/server 目標略過快取，每個請求都呼叫上游")
+    parser.add_argument("--workers", type=int, default=4, help="server 目標的 worker 數量")
+    parser.add_argument("--timeout", type=float, default=60.0, help="單一請求的逾時秒數")
+    parser.add_argument("--max-inflight", type=int, default=DEFAULT_MAX_INFLIGHT)
+    parser.add_argument("--seed", type=int, default=0, help="到達時間與查詢抽樣的亂數種子")
+    parser.add_argument("--base-url", default=None, help="script/server 目標使用現有的上游，而非自動啟動假伺服器")
+    parser.add_argument("--latency", default="lognormal:0.8,0.4", help="假伺服器的延遲分佈")
+    parser.add_argument("--model-latency", action="append", metavar="MODEL=DIST")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="假伺服器回傳 429 的機率")
+    parser.add_argument("--keep-rate-limit", action="store_true", help="保留用戶端限流 (預設停用)")
+    parser.add_argument("--pid", type=int, action="append", default=[], help="route 目標：要監控的程序 (例如 next-server)")
+    parser.add_argument("--match", default=None, help="route 目標：監控命令列包含此字串的程序，例如 next-server")
+    parser.add_argument("--sample-interval", type=float, default=DEFAULT_SAMPLE_INTERVAL)
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出結果")
+    parser.add_argument("--output", default=None, help="將結果 (含每個請求的紀錄) 寫入 JSON 檔案")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    steps = parse_steps(args.rate, args.duration, args.ramp)
+    schedule = arrival_schedule(steps, args.arrival, args.seed)
+    queries, weights = build_query_mix(args.queries, args.seed, args.zipf)
+
+    stub = None
+    state_dir = tempfile.TemporaryDirectory(prefix="load_test_")
+    target = None
+    try:
+        if args.target == "route":
+            # route 的上游由 Next.js 程序的環境變數決定，啟動時需設定 GEMINI_API_BASE_URL 指向假伺服器
+            target = HttpTarget(args.url, args.timeout)
+            sampler = ResourceSampler(args.pid, args.match, interval=args.sample_interval)
+        else:
+            base_url = args.base_url
+            if not base_url:
+                stub, base_url = start_stub_process(args.latency, args.model_latency, args.error_rate, args.seed)
+            env = target_env(base_url, state_dir.name, args.keep_rate_limit)
+            if args.target == "server":
+                target = ServerTarget(env, args.timeout, args.workers, args.no_cache)
+            else:
+                target = ScriptTarget(env, args.timeout, args.no_cache)
+            sampler = ResourceSampler(parent=os.getpid(), exclude={stub.pid} if stub else (),
+                                      interval=args.sample_interval)
+
+        records, wall_time = run_load(target, schedule, queries, weights, args.model, args.max_inflight,
+                                      args.seed, sampler)
+    finally:
+        if target is not None:
+            target.close()
+        if stub is not None:
+            stub.terminate()
+            stub.wait(10)
+        state_dir.cleanup()
+
+    summary = summarize(records, steps, sampler.samples)
+    knee = find_knee(summary)
+    meta = {
+        "target": args.target if args.target != "route" else args.url,
+        "arrival": args.arrival,
+        "distinct_queries": len(queries),
+        "wall_time": wall_time,
+        "cpus": os.cpu_count(),
+        "latency": None if args.target == "route" or args.base_url else args.latency,
+        "seed": args.seed,
+        "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+    }
+    report = {"meta": meta, "steps": summary, "knee_step": knee}
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_summary(summary, knee, meta)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(dict(report, records=records, samples=sampler.samples), f, ensure_ascii=False, indent=2)
+        print(f"\n結果已保存到文件: {args.output}", file=sys.stderr if args.json else sys.stdout)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
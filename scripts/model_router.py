@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import threading
+
+from hedging import get_default_history
+from resilience import get_default_breaker
+from search_logging import get_logger
+
+log = get_logger(__name__)
+
+# 預設的路由統計位置
+DEFAULT_ROUTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "model_router.sqlite3")
+
+# 候選模型與品質等級 (數字越大越好)，可用 GEMINI_ROUTER_MODELS 以 JSON 覆寫
+DEFAULT_CANDIDATES = {
+    "gemini-2.0-flash": 3,
+    "gemini-1.5-pro": 3,
+    "gemini-1.5-flash": 2,
+    "gemini-1.5-flash-8b": 1,
+}
+
+# 品質等級低於此值的模型不會被選用
+DEFAULT_QUALITY_FLOOR = 2
+
+# 隨機嘗試其他模型的機率，以及 EWMA 的平滑係數
+DEFAULT_EXPLORE_RATE = 0.05
+DEFAULT_ALPHA = 0.2
+
+# 樣本數 (成功與失敗的呼叫都算) 不足的模型會優先被選用，直到累積足夠的樣本
+MIN_SAMPLES = 3
+
+# 累積足夠樣本後錯誤率達到此值、或從未成功 (沒有延遲) 的模型排在其他可用模型之後，只在探索時被選用
+FAILING_ERROR_RATE = 0.5
+
+# 尾端延遲在分數中的權重
+TAIL_WEIGHT = 0.5
+
+# 沒有候選模型可用時的退路
+FALLBACK_MODEL = "gemini-2.0-flash"
+
+class ModelRouter:
+    """
+    依各模型的延遲 EWMA、尾端延遲 (p95) 與錯誤率選擇最快的模型，統計存放於 SQLite 讓所有程序共用。
+
+    分數為預期的延遲 (毫秒)：(EWMA + TAIL_WEIGHT * (p95 - EWMA)) / (1 - 錯誤率)，越小越好。
+    斷路器斷開或品質低於門檻的模型不會被選用
+    """
+
+    def __init__(self, path=DEFAULT_ROUTER_PATH, candidates=None, quality_floor=DEFAULT_QUALITY_FLOOR,
+                 explore_rate=DEFAULT_EXPLORE_RATE, alpha=DEFAULT_ALPHA, history=None, breaker=None):
+        self.candidates = dict(candidates or DEFAULT_CANDIDATES)
+        self.quality_floor = quality_floor
+        self.explore_rate = explore_rate
+        self.alpha = alpha
+        self.history = history
+        self.breaker = breaker
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS model_stats (
+                model TEXT PRIMARY KEY,
+                samples INTEGER NOT NULL,
+                ewma_latency REAL,
+                ewma_error REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    def record(self, model, latency_ms=None, error=False):
+        """
+        記錄一次上游呼叫；失敗的呼叫只更新錯誤率
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT samples, ewma_latency, ewma_error FROM model_stats WHERE model = ?", (model,)
+                ).fetchone()
+                samples, ewma_latency, ewma_error = row if row is not None else (0, None, 0.0)
+                if latency_ms is not None and not error:
+                    ewma_latency = latency_ms if ewma_latency is None else \
+                        ewma_latency + self.alpha * (latency_ms - ewma_latency)
+                ewma_error = float(error) if samples == 0 else ewma_error + self.alpha * (float(error) - ewma_error)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO model_stats (model, samples, ewma_latency, ewma_error, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (model, samples + 1, ewma_latency, ewma_error, time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _open_circuits(self):
+        try:
+            return {s["model"] for s in (self.breaker or get_default_breaker()).state() if s["open"]}
+        except sqlite3.Error as e:
+            log.warning(f"讀取斷路器狀態失敗: {e}")
+            return set()
+
+    def _tail(self, model):
+        try:
+            p95 = (self.history or get_default_history()).percentile(model, 95)
+        except sqlite3.Error as e:
+            log.warning(f"讀取延遲記錄失敗: {e}")
+            return None
+        return None if p95 is None else p95 * 1000
+
+    def scores(self):
+        """
+        返回各候選模型目前的統計與分數，依分數排序 (未累積足夠樣本的模型排在前面，持續失敗的模型排在其後，
+        不可用的模型排在最後)
+        """
+        with self._lock:
+            rows = {
+                row[0]: row[1:]
+                for row in self._conn.execute("SELECT model, samples, ewma_latency, ewma_error FROM model_stats")
+            }
+        open_circuits = self._open_circuits()
+        entries = []
+        for model, quality in self.candidates.items():
+            samples, ewma_latency, ewma_error = rows.get(model, (0, None, 0.0))
+            p95 = self._tail(model)
+            score = None
+            if ewma_latency is not None:
+                tail = max(0.0, p95 - ewma_latency) if p95 is not None else 0.0
+                score = (ewma_latency + TAIL_WEIGHT * tail) / max(0.05, 1.0 - ewma_error)
+            entries.append({
+                "model": model,
+                "quality": quality,
+                "samples": samples,
+                "ewma_ms": None if ewma_latency is None else round(ewma_latency, 2),
+                "p95_ms": None if p95 is None else round(p95, 2),
+                "error_rate": round(ewma_error, 4),
+                "score": None if score is None else round(score, 2),
+                "circuit_open": model in open_circuits,
+                "eligible": quality >= self.quality_floor and model not in open_circuits,
+                "failing": samples >= MIN_SAMPLES and (score is None or ewma_error >= FAILING_ERROR_RATE),
+            })
+        entries.sort(key=lambda e: (not e["eligible"], e["samples"] >= MIN_SAMPLES, e["failing"],
+                                    e["score"] if e["score"] is not None else 0.0))
+        return entries
+
+    def eligible(self):
+        return [e["model"] for e in self.scores() if e["eligible"]]
+
+    def choose(self):
+        """
+        選擇這次要使用的模型，返回 (model, route)；route 說明選擇的原因與分數
+        """
+        eligible = [e for e in self.scores() if e["eligible"]]
+        if not eligible:
+            return FALLBACK_MODEL, {"model": FALLBACK_MODEL, "reason": "fallback", "score": None}
+        best = eligible[0]
+        if best["samples"] < MIN_SAMPLES:
+            reason = "warmup"
+        else:
+            reason = "failing" if best["failing"] else "fastest"
+        if reason != "warmup" and len(eligible) > 1 and random.random() < self.explore_rate:
+            best = random.choice(eligible[1:])
+            reason = "explore"
+        return best["model"], {"model": best["model"], "reason": reason, "score": best["score"]}
+
+_default_router = None
+_default_router_lock = threading.Lock()
+
+def get_default_router():
+    """
+    取得共用的路由器；候選模型、品質門檻與探索機率可由環境變數設定
+    """
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            candidates = os.environ.get("GEMINI_ROUTER_MODELS")
+            _default_router = ModelRouter(
+                os.environ.get("GEMINI_ROUTER_PATH", DEFAULT_ROUTER_PATH),
+                json.loads(candidates) if candidates else None,
+                float(os.environ.get("GEMINI_ROUTER_QUALITY_FLOOR", DEFAULT_QUALITY_FLOOR)),
+                float(os.environ.get("GEMINI_ROUTER_EXPLORE_RATE", DEFAULT_EXPLORE_RATE)),
+            )
+        return _default_router
+
+def record_outcome(model, result):
+    """
+    由搜尋結果更新路由統計；快取或回答索引命中與合併的請求沒有實際呼叫上游，拆分查詢的合併結果也不列入。
+    改用過期快取的結果代表上游失敗
+    """
+    if result.get("coalesced") or result.get("cache") in ("hit", "index") or "sub_queries" in result:
+        return
+    # 對沖請求的結果屬於勝出的模型
+    model = (result.get("hedge") or {}).get("winner") or model
+    error = bool(result.get("error") or result.get("degraded"))
+    try:
+        get_default_router().record(model, (result.get("timings") or {}).get("upstream"), error)
+    except sqlite3.Error as e:
+        log.warning(f"寫入路由統計失敗: {e}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查看 auto 模型路由的各模型分數")
+    parser.add_argument("--choose", action="store_true", help="另外印出這次會選擇的模型")
+    args = parser.parse_args(argv)
+
+    router = get_default_router()
+    output = {"quality_floor": router.quality_floor, "explore_rate": router.explore_rate, "models": router.scores()}
+    if args.choose:
+        output["choice"] = router.choose()[1]
+    print(json.dumps(output, ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from collections import deque
+
+from search_cache import normalize_query
+from search_logging import get_logger
+
+log = get_logger(__name__)
+
+# 預設的預取紀錄位置
+DEFAULT_PREFETCH_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "prefetch.sqlite3")
+
+# 每個查詢最多預取幾個後續問題，以及每分鐘最多預取幾次
+DEFAULT_MAX_PER_QUERY = 3
+DEFAULT_BUDGET_PER_MINUTE = 12
+
+# 預取請求的時間上限 (秒)，避免佔用資源太久
+PREFETCH_DEADLINE = 20.0
+
+# 前景請求結束後，至少閒置多久才開始預取 (秒)
+IDLE_GRACE = 0.2
+
+class PrefetchLog:
+    """
+    記錄哪些快取項目是預取寫入的，以及之後是否被前景查詢命中
+    """
+
+    def __init__(self, path=DEFAULT_PREFETCH_PATH):
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS prefetched (
+                key TEXT PRIMARY KEY,
+                query TEXT NOT NULL,
+                model TEXT NOT NULL,
+                source TEXT,
+                created_at REAL NOT NULL,
+                hit_at REAL
+            )
+            """
+        )
+
+    def mark_prefetched(self, key, query, model, source=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prefetched (key, query, model, source, created_at, hit_at) VALUES (?, ?, ?, ?, ?, NULL)",
+                (key, query, model, source, time.time()),
+            )
+
+    def mark_hit(self, key):
+        """
+        前景查詢命中快取時呼叫；是第一次命中預取的項目時返回 True
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE prefetched SET hit_at = ? WHERE key = ? AND hit_at IS NULL", (time.time(), key)
+            )
+        return cursor.rowcount > 0
+
+    def stats(self, window=None):
+        since = 0 if window is None else time.time() - window
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT source, COUNT(*), COUNT(hit_at) FROM prefetched WHERE created_at >= ? GROUP BY source", (since,)
+            ).fetchall()
+        prefetched = sum(r[1] for r in rows)
+        hits = sum(r[2] for r in rows)
+        return {
+            "prefetched": prefetched,
+            "hits": hits,
+            "hit_rate": hits / prefetched if prefetched else None,
+            "by_source": {source or "unknown": {"prefetched": n, "hits": h} for source, n, h in rows},
+        }
+
+_default_log = None
+_default_log_lock = threading.Lock()
+
+def prefetch_log_path():
+    return os.environ.get("GEMINI_PREFETCH_PATH", DEFAULT_PREFETCH_PATH)
+
+def get_default_log():
+    global _default_log
+    with _default_log_lock:
+        if _default_log is None:
+            _default_log = PrefetchLog(prefetch_log_path())
+        return _default_log
+
+def note_cache_hit(key):
+    """
+    前景查詢命中快取時檢查是否為預取的項目；從未啟用預取時不開啟資料庫
+    """
+    if _default_log is None and not os.path.exists(prefetch_log_path()):
+        return False
+    try:
+        return get_default_log().mark_hit(key)
+    except sqlite3.Error as e:
+        log.warning(f"記錄預取命中失敗: {e}")
+        return False
+
+def follow_up_queries(query, result, limit=DEFAULT_MAX_PER_QUERY, candidates=None):
+    """
+    取出可能的後續問題：預設為結果中的 related_questions (Perplexity)，或使用 candidates (模型產生的問題)。
+    Gemini grounding 的 web_search_queries 只是目前問題的改寫，不是後續問題，不使用
+    """
+    source = "related_questions" if candidates is None else "generated"
+    seen = {normalize_query(query)}
+    follow_ups = []
+    for candidate in (result.get("related_questions") if candidates is None else candidates) or []:
+        normalized = normalize_query(candidate or "")
+        if not normalized or normalized in seen:
+            continue
+        seen.add(normalized)
+        follow_ups.append((candidate, source))
+        if len(follow_ups) >= limit:
+            break
+    return follow_ups
+
+class Prefetcher:
+    """
+    常駐模式使用的背景預取器：前景請求進行中時暫停，並受每分鐘預算限制。
+
+    search 為 (query, model, deadline) -> result 的函式，is_cached 為 (query, model) -> bool。
+    結果沒有 related_questions 時，以 suggest (query, answer, model, limit) -> [問題] 在背景產生後續問題，
+    產生問題的呼叫同樣佔用預算
+    """
+
+    def __init__(self, search, is_cached, max_per_query=DEFAULT_MAX_PER_QUERY, budget_per_minute=DEFAULT_BUDGET_PER_MINUTE,
+                 suggest=None):
+        self.search = search
+        self.is_cached = is_cached
+        self.suggest = suggest
+        self.max_per_query = max_per_query
+        self.budget_per_minute = budget_per_minute
+        self._pending = deque(maxlen=max_per_query * 4)
+        self._expand = deque(maxlen=4)
+        self._recent = deque()
+        self._foreground = 0
+        self._last_foreground = 0.0
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, name="gemini-search-prefetch", daemon=True).start()
+
+    def foreground_started(self):
+        with self._cond:
+            self._foreground += 1
+
+    def foreground_finished(self):
+        with self._cond:
+            self._foreground -= 1
+            self._last_foreground = time.monotonic()
+            self._cond.notify_all()
+
+    def submit(self, query, model, result):
+        """
+        排入這次結果的後續問題；佇列滿時捨棄最舊的項目
+        """
+        follow_ups = follow_up_queries(query, result, self.max_per_query)
+        with self._cond:
+            for follow_up, source in follow_ups:
+                self._pending.append((follow_up, model, source))
+            if not follow_ups and self.suggest is not None and result.get("answer"):
+                self._expand.append((query, model, result["answer"]))
+            self._cond.notify_all()
+
+    def _ready(self):
+        idle = self._foreground == 0 and time.monotonic() - self._last_foreground >= IDLE_GRACE
+        return bool(self._pending or self._expand) and idle
+
+    def _take_budget(self):
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > 60:
+            self._recent.popleft()
+        if len(self._recent) >= self.budget_per_minute:
+            return 60 - (now - self._recent[0])
+        self._recent.append(now)
+        return 0
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # 有前景請求時讓路，直到閒置一小段時間
+                while not self._ready():
+                    self._cond.wait(IDLE_GRACE)
+                wait = self._take_budget()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                if not self._pending:
+                    query, model, answer = self._expand.pop()
+                    source = None
+                else:
+                    query, model, source = self._pending.pop()
+            if source is not None:
+                prefetch_one(query, model, source, self.search, self.is_cached)
+                continue
+            candidates = self.suggest(query, answer, model, self.max_per_query)
+            with self._cond:
+                for follow_up, source in follow_up_queries(query, {}, self.max_per_query, candidates):
+                    self._pending.append((follow_up, model, source))
+
+def prefetch_one(query, model, source, search, is_cached):
+    """
+    預取單一問題：已有快取時略過，否則搜尋並記錄為預取項目
+    """
+    from search_cache import make_cache_key
+    import gemini_search
+    if is_cached(query, model):
+        return False
+    result = search(query, model, PREFETCH_DEADLINE)
+    if result.get("error") or result.get("degraded"):
+        return False
+    # 回答索引或快取直接返回的結果沒有寫入這個快取鍵，不算預取
+    if result.get("cache") in ("hit", "index"):
+        return False
+    # auto 模式下快取寫在實際使用的模型之下
+    model = (result.get("route") or {}).get("model") or model
+    try:
+        get_default_log().mark_prefetched(make_cache_key(query, model, gemini_search.PROMPT_TEMPLATE), query, model, source)
+    except sqlite3.Error as e:
+        log.warning(f"記錄預取失敗: {e}")
+    return True
+
+def spawn_background(query, model, result, max_per_query=DEFAULT_MAX_PER_QUERY):
+    """
+    一次性執行時，以低優先權的獨立程序預取後續問題，不延後目前查詢的輸出
+    """
+    follow_ups = follow_up_queries(query, result, max_per_query)
+    if follow_ups:
+        items = [{"query": q, "model": model, "source": source} for q, source in follow_ups]
+    elif result.get("answer"):
+        # 沒有 related_questions 時，由背景程序產生後續問題
+        items = [{"query": query, "model": model, "answer": result["answer"], "limit": max_per_query}]
+    else:
+        return None
+    import subprocess
+    payload = json.dumps(items, ensure_ascii=False)
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--items", payload],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="預取後續問題並寫入搜尋快取，或查看預取命中率")
+    parser.add_argument("--items", default=None,
+                        help='JSON 陣列: [{"query": ..., "model": ..., "source": ...}]；'
+                             '帶有 "answer" 的項目改為先產生該問題的後續問題再預取')
+    parser.add_argument("--stats", action="store_true", help="印出預取命中率")
+    parser.add_argument("--window", type=float, default=None, help="統計最近幾秒內的預取")
+    args = parser.parse_args(argv)
+
+    if args.stats or not args.items:
+        print(json.dumps(get_default_log().stats(args.window), ensure_ascii=False, indent=2))
+        return 0
+
+    # 以較低的排程優先權執行，讓前景查詢優先
+    if hasattr(os, "nice"):
+        os.nice(10)
+    import gemini_search
+    gemini_search.load_config()
+    for item in json.loads(args.items):
+        model = item.get("model") or gemini_search.DEFAULT_MODEL
+        if "answer" in item:
+            limit = item.get("limit") or DEFAULT_MAX_PER_QUERY
+            candidates = gemini_search.suggest_follow_ups(item["query"], item["answer"], model, limit)
+            follow_ups = follow_up_queries(item["query"], {}, limit, candidates)
+        else:
+            follow_ups = [(item["query"], item.get("source"))]
+        for query, source in follow_ups:
+            prefetch_one(query, model, source, gemini_search.prefetch_search, gemini_search.is_cached)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import re
+import sys
+import json
+
+from search_cache import normalize_query
+
+# 最多拆成幾個子問題，以及子問題的最短長度 (字元)
+MAX_SUB_QUERIES = 4
+MIN_PART_CHARS = 6
+
+# 子問題之間的分隔：問號、分號，以及常見的並列連接詞。中文連接詞也常出現在單一問題中
+# (「如何同時使用兩個螢幕」、「台北還有哪些景點」)，只在子句開頭 (標點之後) 才切分
+SEPARATORS = re.compile(
+    r"[?？;；]+\s*(?:以及|另外|此外|還有|同時)?"
+    r"|[,，、。!！]\s*(?:以及|另外|此外|還有|同時)"
+    r"|,?\s+(?:and also|and then)\s+",
+    re.IGNORECASE,
+)
+
+# 以這些詞開頭的片段依賴前一個子問題 (例如「和聯發科相比呢」)，需要帶上前文
+DEPENDENT_PREFIXES = ("和", "跟", "與", "相比", "比較", "那", "它", "其", "他們",
+                      "compare", "compared", "vs", "versus", "how about", "what about",
+                      "and ", "or ", "it ", "its ", "they ", "their ", "that ")
+
+# 片段前後要去除的標點與空白
+STRIP_CHARS = " \t\r\n,，、。.!！:："
+
+def split_query(query, max_parts=MAX_SUB_QUERIES):
+    """
+    將包含多個獨立問題的查詢拆成子問題；無法拆分時返回只有原查詢的串列。
+
+    只依標點與連接詞切分，不額外呼叫模型，拆分本身幾乎不花時間
+    """
+    parts = []
+    for piece in SEPARATORS.split(query or ""):
+        piece = piece.strip(STRIP_CHARS)
+        if not piece:
+            continue
+        if parts and (len(piece) < MIN_PART_CHARS or piece.lower().startswith(DEPENDENT_PREFIXES)):
+            # 太短或依賴前文的片段無法獨立搜尋，和前一個子問題一起查
+            parts[-1] = f"{parts[-1]}，{piece}"
+            continue
+        parts.append(piece)
+    if len(parts) > 1 and len(parts[0]) < MIN_PART_CHARS:
+        # 第一個片段太短時併入下一個子問題
+        parts[1] = f"{parts[0]}，{parts[1]}"
+        del parts[0]
+
+    # 去除重複的子問題
+    unique = []
+    seen = set()
+    for part in parts:
+        normalized = normalize_query(part)
+        if normalized not in seen:
+            seen.add(normalized)
+            unique.append(part)
+
+    if len(unique) < 2:
+        return [query]
+    if len(unique) > max_parts:
+        unique = unique[:max_parts - 1] + ["；".join(unique[max_parts - 1:])]
+    return unique
+
+def _dedupe(items, key):
+    merged = []
+    seen = set()
+    for item in items:
+        k = key(item)
+        if k in seen:
+            continue
+        seen.add(k)
+        merged.append(item)
+    return merged
+
+def _spent(result):
+    # 快取或回答索引命中與合併的請求沒有實際消耗 token
+    return not result.get("coalesced") and result.get("cache") not in ("hit", "stale", "index")
+
+def merge_results(parts, results):
+    """
+    將各子問題的結果合併成一個結果，格式與 gemini_web_search 相同：
+    回答依子問題分段，引用依網址去除重複，search_entry_point 取第一個，
+    各子問題的狀態與耗時放在 sub_queries
+    """
+    sub_queries = [
+        {
+            "query": part,
+            "cache": result.get("cache"),
+            "error": result.get("error"),
+            "degraded": result.get("degraded"),
+            "timings": result.get("timings") or {},
+        }
+        for part, result in zip(parts, results)
+    ]
+    answered = [(part, result) for part, result in zip(parts, results) if not result.get("error")]
+    if not answered:
+        merged = dict(results[0])
+        merged["sub_queries"] = sub_queries
+        return merged
+
+    usage = {}
+    for _, result in answered:
+        if not _spent(result):
+            continue
+        for name, value in (result.get("usage") or {}).items():
+            if value is not None:
+                usage[name] = usage.get(name, 0) + value
+
+    merged = {
+        "answer": "\n\n".join(f"**{part}**\n{(result.get('answer') or '').strip()}" for part, result in answered),
+        "citations": _dedupe(
+            [c for _, result in answered for c in result.get("citations") or []],
+            lambda c: c.get("url") or c.get("title"),
+        ),
+        "images": _dedupe([i for _, result in answered for i in result.get("images") or []], json.dumps),
+        "search_entry_point": next((r["search_entry_point"] for _, r in answered if r.get("search_entry_point")), None),
+        "usage": usage or None,
+        "sub_queries": sub_queries,
+    }
+    caches = {result.get("cache") for result in results}
+    merged["cache"] = caches.pop() if len(caches) == 1 else "mixed"
+    merged["coalesced"] = all(result.get("coalesced") for result in results)
+
+    degraded = [result["degraded"] for _, result in answered if result.get("degraded")]
+    if degraded:
+        merged["degraded"] = {
+            "reason": degraded[0].get("reason"),
+            "age": max(d.get("age") or 0 for d in degraded),
+            "sub_queries": len(degraded),
+        }
+    if len(answered) < len(results):
+        merged["partial"] = True
+    return merged
+
+if __name__ == "__main__":
+    # 印出查詢會被拆成哪些子問題
+    print(json.dumps(split_query(" ".join(sys.argv[1:])), ensure_ascii=False, indent=2))
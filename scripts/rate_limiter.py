@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import sqlite3
+import threading
+
+from search_logging import get_logger
+
+log = get_logger(__name__)
+
+# 預設的狀態檔位置
+DEFAULT_RATE_LIMIT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "rate_limits.sqlite3")
+
+# 各服務與模型的限制 (每分鐘請求數 rpm / 每分鐘 token 數 tpm)
+# "*" 是該服務所有模型共用的額度，其餘鍵是個別模型的額度。
+# 限流預設停用：各金鑰的額度不同，需以 SEARCH_RATE_LIMITS 設定 JSON、JSON 檔案路徑或下列組合的名稱
+LIMIT_PRESETS = {}
+
+# Gemini API 免費方案與 Perplexity 的額度 (SEARCH_RATE_LIMITS=free-tier)
+LIMIT_PRESETS["free-tier"] = {
+    "gemini": {
+        "*": {"rpm": 60},
+        "gemini-2.0-flash": {"rpm": 15, "tpm": 1000000},
+        "gemini-2.0-flash-exp": {"rpm": 10, "tpm": 4000000},
+        "gemini-1.5-flash": {"rpm": 15, "tpm": 1000000},
+        "gemini-1.5-pro": {"rpm": 2, "tpm": 32000},
+        "gemini-1.0-pro": {"rpm": 15, "tpm": 32000},
+    },
+    "perplexity": {
+        "*": {"rpm": 50},
+    },
+}
+
+# 收到 429 時額度乘上的比例，與每次成功後恢復的比例
+BACKOFF_FACTOR = 0.5
+RECOVERY_STEP = 0.05
+MIN_RATE_FRACTION = 0.1
+
+# 沒有 Retry-After 時，收到 429 後暫停的秒數
+DEFAULT_PENALTY = 5.0
+
+def estimate_tokens(text, max_output_tokens=1024):
+    """
+    粗略估計一次請求會用掉的 token 數 (約 4 個字元一個 token，再加上輸出上限)
+    """
+    return len(text or "") // 4 + max_output_tokens
+
+def is_rate_limit_error(error):
+    """
+    判斷例外是否為服務端的 429 限流錯誤
+    """
+    for attr in ("code", "status_code", "status"):
+        if getattr(error, attr, None) in (429, "429", "RESOURCE_EXHAUSTED"):
+            return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    return "RESOURCE_EXHAUSTED" in str(error)
+
+def retry_after_seconds(error):
+    """
+    從錯誤的回應標頭取出 Retry-After 秒數，沒有時返回 None
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+class RateLimiter:
+    """
+    跨程序共用的 token bucket 限流器，狀態存放於 SQLite。
+
+    acquire() 會先預扣額度並返回需要等待的秒數 (額度允許為負，代表已排隊的請求)，
+    呼叫端只需等待剛好足夠的時間。收到 429 時會自動降低該模型的速率並暫停一段時間，
+    之後每次成功再逐步恢復。
+    """
+
+    def __init__(self, path=DEFAULT_RATE_LIMIT_PATH, limits=None):
+        self.path = path
+        self.limits = limits or {}
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                capacity REAL NOT NULL,
+                rate_fraction REAL NOT NULL,
+                blocked_until REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+
+    def _buckets(self, provider, model, tokens):
+        """
+        返回這次請求要扣除的 (bucket 名稱, 每分鐘額度, 扣除量)
+        """
+        provider_limits = self.limits.get(provider, {})
+        buckets = []
+        for scope in ("*", model):
+            limits = provider_limits.get(scope)
+            if not limits:
+                continue
+            if limits.get("rpm"):
+                buckets.append((f"{provider}:{scope}:rpm", limits["rpm"], 1))
+            if limits.get("tpm") and tokens:
+                buckets.append((f"{provider}:{scope}:tpm", limits["tpm"], tokens))
+        return buckets
+
+    def _load(self, name, per_minute, now):
+        row = self._conn.execute(
+            "SELECT tokens, capacity, rate_fraction, blocked_until, updated_at FROM buckets WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return {"tokens": per_minute, "capacity": per_minute, "rate_fraction": 1.0, "blocked_until": 0.0, "updated_at": now}
+        state = dict(zip(("tokens", "capacity", "rate_fraction", "blocked_until", "updated_at"), row))
+        state["capacity"] = per_minute
+        # 依經過的時間補充額度
+        refill_from = max(state["updated_at"], state["blocked_until"])
+        if now > refill_from:
+            rate = per_minute * state["rate_fraction"] / 60.0
+            state["tokens"] = min(per_minute, state["tokens"] + (now - refill_from) * rate)
+        state["updated_at"] = now
+        return state
+
+    def _save(self, name, state):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, capacity, rate_fraction, blocked_until, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, state["tokens"], state["capacity"], state["rate_fraction"], state["blocked_until"], state["updated_at"]),
+        )
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(time.time())
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def acquire(self, provider, model, tokens=0):
+        """
+        預扣一次請求 (與預估的 token 數) 的額度，返回需要等待的秒數
+        """
+        buckets = self._buckets(provider, model, tokens)
+        if not buckets:
+            return 0.0
+
+        def reserve(now):
+            wait = 0.0
+            for name, per_minute, amount in buckets:
+                state = self._load(name, per_minute, now)
+                # 額度不足的部分要等多久才能補滿
+                state["tokens"] -= min(amount, per_minute)
+                rate = per_minute * state["rate_fraction"] / 60.0
+                needed = max(0.0, state["blocked_until"] - now)
+                if state["tokens"] < 0:
+                    needed += -state["tokens"] / rate
+                wait = max(wait, needed)
+                self._save(name, state)
+            return wait
+
+        return self._transaction(reserve)
+
+    def wait(self, provider, model, tokens=0):
+        """
+        取得額度，並在需要時同步等待
+        """
+        delay = self.acquire(provider, model, tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def settle(self, provider, model, estimated_tokens, actual_tokens):
+        """
+        以實際用掉的 token 數修正預扣的量
+        """
+        if actual_tokens is None or actual_tokens == estimated_tokens:
+            return
+        buckets = [b for b in self._buckets(provider, model, 1) if b[0].endswith(":tpm")]
+
+        def adjust(now):
+            for name, per_minute, _ in buckets:
+                state = self._load(name, per_minute, now)
+                state["tokens"] = min(per_minute, state["tokens"] + estimated_tokens - actual_tokens)
+                self._save(name, state)
+
+        self._transaction(adjust)
+
+    def report_throttled(self, provider, model, retry_after=None):
+        """
+        收到 429：降低該模型的速率，並暫停到 retry_after (或預設秒數) 之後
+        """
+        buckets = [b for b in self._buckets(provider, model, 1) if b[0].startswith(f"{provider}:{model}:")] \
+            or self._buckets(provider, model, 1)
+        penalty = DEFAULT_PENALTY if retry_after is None else retry_after
+
+        def backoff(now):
+            for name, per_minute, _ in buckets:
+                state = self._load(name, per_minute, now)
+                state["rate_fraction"] = max(MIN_RATE_FRACTION, state["rate_fraction"] * BACKOFF_FACTOR)
+                state["tokens"] = min(state["tokens"], 0.0)
+                state["blocked_until"] = max(state["blocked_until"], now + penalty)
+                self._save(name, state)
+
+        self._transaction(backoff)
+
+    def report_success(self, provider, model):
+        """
+        成功的請求讓先前被降低的速率逐步恢復
+        """
+        buckets = self._buckets(provider, model, 1)
+
+        def recover(now):
+            for name, per_minute, _ in buckets:
+                row = self._conn.execute("SELECT rate_fraction FROM buckets WHERE name = ?", (name,)).fetchone()
+                if row is None or row[0] >= 1.0:
+                    continue
+                state = self._load(name, per_minute, now)
+                state["rate_fraction"] = min(1.0, state["rate_fraction"] + RECOVERY_STEP)
+                self._save(name, state)
+
+        self._transaction(recover)
+
+    def snapshot(self):
+        """
+        返回所有 bucket 目前的狀態
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name, tokens, capacity, rate_fraction, blocked_until FROM buckets ORDER BY name"
+            ).fetchall()
+        now = time.time()
+        return [
+            {"name": name, "tokens": tokens, "capacity": capacity, "rate_fraction": rate_fraction,
+             "blocked_for": max(0.0, blocked_until - now)}
+            for name, tokens, capacity, rate_fraction, blocked_until in rows
+        ]
+
+_default_limiter = None
+_default_limiter_loaded = False
+_default_limiter_lock = threading.Lock()
+
+def load_limits(value=None):
+    """
+    解析 SEARCH_RATE_LIMITS：組合名稱 (例如 free-tier)、JSON 字串或 JSON 檔案路徑；未設定時返回 None
+    """
+    value = (os.environ.get("SEARCH_RATE_LIMITS", "") if value is None else value).strip()
+    if not value:
+        return None
+    if value in LIMIT_PRESETS:
+        return LIMIT_PRESETS[value]
+    if value.startswith("{"):
+        return json.loads(value)
+    with open(value, encoding="utf-8") as f:
+        return json.load(f)
+
+def get_default_limiter():
+    """
+    取得共用的限流器；沒有設定 SEARCH_RATE_LIMITS 或設定 SEARCH_RATE_LIMIT=0 時返回 None (不限流)
+    """
+    global _default_limiter, _default_limiter_loaded
+    if os.environ.get("SEARCH_RATE_LIMIT") == "0":
+        return None
+    with _default_limiter_lock:
+        if not _default_limiter_loaded:
+            _default_limiter_loaded = True
+            try:
+                limits = load_limits()
+            except (OSError, ValueError) as e:
+                log.error(f"無法讀取 SEARCH_RATE_LIMITS，停用限流: {e}")
+                limits = None
+            if limits:
+                _default_limiter = RateLimiter(os.environ.get("SEARCH_RATE_LIMIT_PATH", DEFAULT_RATE_LIMIT_PATH), limits)
+        return _default_limiter
+
+def wait_for_slot(provider, model, tokens=0):
+    """
+    給測試腳本使用的簡便函式：等待到可以送出請求為止，返回實際等待的秒數
+    """
+    limiter = get_default_limiter()
+    if limiter is None:
+        return 0.0
+    try:
+        return limiter.wait(provider, model, tokens)
+    except sqlite3.Error as e:
+        log.warning(f"限流狀態讀寫失敗: {e}")
+        return 0.0
+
+def report_if_throttled(provider, model, error):
+    """
+    若錯誤是 429，通知限流器降低該模型的速率；返回是否為限流錯誤
+    """
+    limiter = get_default_limiter()
+    if limiter is None or not is_rate_limit_error(error):
+        return False
+    try:
+        limiter.report_throttled(provider, model, retry_after_seconds(error))
+    except sqlite3.Error as e:
+        log.warning(f"限流狀態讀寫失敗: {e}")
+    return True
+
+if __name__ == "__main__":
+    # 印出目前各 bucket 的狀態
+    limiter = get_default_limiter()
+    print(json.dumps(limiter.snapshot() if limiter else [], indent=2))
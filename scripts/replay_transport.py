@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import runpy
+import argparse
+import asyncio
+import importlib
+import threading
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+# 以環境變數啟用，呼叫端不需修改
+MODE_ENV = "SEARCH_CASSETTE_MODE"
+PATH_ENV = "SEARCH_CASSETTE_PATH"
+SCALE_ENV = "SEARCH_CASSETTE_LATENCY_SCALE"
+
+DEFAULT_CASSETTE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "cassettes", "search.jsonl")
+
+# 會被替換傳輸層的 HTTP 客戶端套件
+HTTPX_MODULES = ("httpx", "httpx2")
+
+# 不寫入 cassette 的敏感資訊
+SECRET_HEADERS = {"authorization", "x-goog-api-key", "api-key", "cookie", "set-cookie"}
+SECRET_PARAMS = {"key", "api_key"}
+
+# 重播時由 httpx 重新計算的標頭
+DROPPED_RESPONSE_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+class CassetteMissError(Exception):
+    pass
+
+def _clean_url(url):
+    parts = urlsplit(str(url))
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if k not in SECRET_PARAMS])
+    return f"{parts.path}?{query}" if query else parts.path
+
+def request_key(method, url, body):
+    """
+    以方法、路徑 (去除金鑰參數) 與請求內容產生比對用的鍵
+    """
+    digest = hashlib.sha256(body or b"").hexdigest()
+    return f"{method.upper()} {_clean_url(url)} {digest}"
+
+class Cassette:
+    """
+    JSON 行格式的錄製檔，每行是一組請求/回應與其時間資訊
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._interactions = {}
+        self._cursor = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entry = json.loads(line)
+                        self._interactions.setdefault(entry["key"], []).append(entry)
+
+    def next(self, key):
+        """
+        取出下一筆符合的錄製內容；相同請求錄了多次時依序輪流使用
+        """
+        with self._lock:
+            entries = self._interactions.get(key)
+            if not entries:
+                raise CassetteMissError(f"No recorded interaction for {key}")
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            return entries[index % len(entries)]
+
+    def append(self, entry):
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._interactions.setdefault(entry["key"], []).append(entry)
+
+def _build_entry(request, response, chunks, started):
+    return {
+        "key": request_key(request.method, request.url, request.content),
+        "method": request.method,
+        "url": _clean_url(request.url),
+        "request_body": request.content.decode("utf-8", errors="replace"),
+        "status": response.status_code,
+        "headers": [[k, v] for k, v in response.headers.items()
+                    if k.lower() not in SECRET_HEADERS | DROPPED_RESPONSE_HEADERS],
+        # 每個片段相對於請求開始的時間，重播時用來還原延遲與串流節奏
+        "chunks": [{"offset": offset, "data": base64.b64encode(data).decode("ascii")} for offset, data in chunks],
+        "elapsed": time.monotonic() - started,
+        "recorded_at": time.time(),
+    }
+
+def _make_streams(httpx_module):
+    """
+    建立會依錄製時間逐段送出內容的回應串流類別
+    """
+    class ReplayStream(httpx_module.SyncByteStream):
+        def __init__(self, chunks, scale, started):
+            self.chunks = chunks
+            self.scale = scale
+            self.started = started
+
+        def __iter__(self):
+            for chunk in self.chunks:
+                delay = self.started + chunk["offset"] * self.scale - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                yield base64.b64decode(chunk["data"])
+
+    class AsyncReplayStream(httpx_module.AsyncByteStream):
+        def __init__(self, chunks, scale, started):
+            self.chunks = chunks
+            self.scale = scale
+            self.started = started
+
+        async def __aiter__(self):
+            for chunk in self.chunks:
+                delay = self.started + chunk["offset"] * self.scale - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield base64.b64decode(chunk["data"])
+
+    return ReplayStream, AsyncReplayStream
+
+def _patch(httpx_module, mode, cassette, latency_scale):
+    """
+    替換某個 httpx 模組的同步與非同步傳輸層
+    """
+    ReplayStream, AsyncReplayStream = _make_streams(httpx_module)
+    original_sync = httpx_module.HTTPTransport.handle_request
+    original_async = httpx_module.AsyncHTTPTransport.handle_async_request
+
+    def build_response(request, entry, stream):
+        return httpx_module.Response(
+            status_code=entry["status"],
+            headers=entry["headers"],
+            stream=stream,
+            request=request,
+        )
+
+    def handle_request(transport, request):
+        started = time.monotonic()
+        request.read()
+        if mode == "replay":
+            entry = cassette.next(request_key(request.method, request.url, request.content))
+            return build_response(request, entry, ReplayStream(entry["chunks"], latency_scale, started))
+
+        response = original_sync(transport, request)
+        chunks = []
+        try:
+            for data in response.stream:
+                chunks.append((time.monotonic() - started, data))
+        finally:
+            response.close()
+        entry = _build_entry(request, response, chunks, started)
+        cassette.append(entry)
+        return build_response(request, entry, ReplayStream(entry["chunks"], 0, started))
+
+    async def handle_async_request(transport, request):
+        started = time.monotonic()
+        await request.aread()
+        if mode == "replay":
+            entry = cassette.next(request_key(request.method, request.url, request.content))
+            return build_response(request, entry, AsyncReplayStream(entry["chunks"], latency_scale, started))
+
+        response = await original_async(transport, request)
+        chunks = []
+        try:
+            async for data in response.stream:
+                chunks.append((time.monotonic() - started, data))
+        finally:
+            await response.aclose()
+        entry = _build_entry(request, response, chunks, started)
+        cassette.append(entry)
+        return build_response(request, entry, AsyncReplayStream(entry["chunks"], 0, started))
+
+    httpx_module.HTTPTransport.handle_request = handle_request
+    httpx_module.AsyncHTTPTransport.handle_async_request = handle_async_request
+
+_installed = None
+
+def install(mode, path=None, latency_scale=1.0):
+    """
+    替換 httpx 的傳輸層：record 模式呼叫真實 API 並寫入 cassette，
+    replay 模式直接以 cassette 的內容回應，並依 latency_scale 還原原本的延遲
+    """
+    global _installed
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Unknown cassette mode: {mode}")
+    if _installed is not None:
+        return _installed
+
+    cassette = Cassette(path or DEFAULT_CASSETTE_PATH)
+    # google-genai 與 openai 可能使用不同名稱的 httpx 套件，全部都替換
+    patched = 0
+    for name in HTTPX_MODULES:
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        _patch(module, mode, cassette, latency_scale)
+        patched += 1
+    if not patched:
+        raise ImportError("replay_transport requires httpx")
+
+    _installed = cassette
+    return cassette
+
+def install_from_env():
+    """
+    依 SEARCH_CASSETTE_MODE / SEARCH_CASSETTE_PATH / SEARCH_CASSETTE_LATENCY_SCALE 啟用錄製或重播
+    """
+    mode = os.environ.get(MODE_ENV)
+    if not mode:
+        return None
+    return install(mode, os.environ.get(PATH_ENV), float(os.environ.get(SCALE_ENV, "1.0")))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="以錄製/重播模式執行任意 Python 腳本")
+    parser.add_argument("--mode", choices=["record", "replay"], required=True)
+    parser.add_argument("--cassette", default=None, help="cassette 檔案路徑")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="重播延遲倍率，0 代表不等待")
+    parser.add_argument("script", help="要執行的腳本")
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    # 透過環境變數傳遞，讓腳本啟動的子程序也使用相同設定
+    os.environ[MODE_ENV] = args.mode
+    os.environ[SCALE_ENV] = str(args.latency_scale)
+    if args.cassette:
+        os.environ[PATH_ENV] = os.path.abspath(args.cassette)
+    install_from_env()
+
+    sys.argv = [args.script] + args.args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+    runpy.run_path(args.script, run_name="__main__")
+
+if __name__ == "__main__":
+    main()
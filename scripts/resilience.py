@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import random
+import sqlite3
+import threading
+
+from rate_limiter import is_rate_limit_error
+from search_logging import get_logger
+
+log = get_logger(__name__)
+
+# 預設的斷路器狀態檔位置
+DEFAULT_CIRCUIT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "circuit_breaker.sqlite3")
+
+# 連續失敗幾次後斷開，以及斷開後多久再放行一個試探請求 (秒)
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_COOLDOWN = 30.0
+
+# 重試次數與退避時間 (秒)
+DEFAULT_MAX_ATTEMPTS = 3
+BASE_BACKOFF = 0.25
+MAX_BACKOFF = 4.0
+
+# 視為暫時性錯誤的 HTTP 狀態碼與例外類別名稱 (httpx 等套件不需要在這裡匯入)
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+TRANSIENT_EXCEPTIONS = {"TimeoutException", "TransportError", "NetworkError", "RemoteProtocolError",
+                        "APITimeoutError", "APIConnectionError"}
+
+def is_transient_error(error):
+    """
+    判斷錯誤是否值得重試：限流、逾時、連線錯誤與 5xx
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)) or is_rate_limit_error(error):
+        return True
+    for attr in ("code", "status_code"):
+        if getattr(error, attr, None) in TRANSIENT_STATUS:
+            return True
+    return any(cls.__name__ in TRANSIENT_EXCEPTIONS for cls in type(error).__mro__)
+
+def backoff_delay(attempt, base=BASE_BACKOFF, cap=MAX_BACKOFF):
+    """
+    第 attempt 次重試前的等待時間 (full jitter 的指數退避)
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+class CircuitBreaker:
+    """
+    各模型的斷路器，狀態存放於 SQLite 讓所有程序共用。
+
+    連續的暫時性失敗達到門檻後斷開，冷卻期間直接略過該模型；
+    冷卻結束後只放行一個試探請求，成功才恢復。
+    """
+
+    def __init__(self, path=DEFAULT_CIRCUIT_PATH, failure_threshold=DEFAULT_FAILURE_THRESHOLD, cooldown=DEFAULT_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS circuits (
+                model TEXT PRIMARY KEY,
+                failures INTEGER NOT NULL,
+                opened_until REAL NOT NULL
+            )
+            """
+        )
+
+    def allow(self, model):
+        """
+        是否可以對此模型送出請求；冷卻結束時由第一個呼叫者取得試探資格
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT failures, opened_until FROM circuits WHERE model = ?", (model,)).fetchone()
+                allowed = row is None or row[0] < self.failure_threshold or row[1] <= now
+                if row is not None and row[0] >= self.failure_threshold and allowed:
+                    # 試探期間其他呼叫者仍視為斷開
+                    self._conn.execute("UPDATE circuits SET opened_until = ? WHERE model = ?", (now + self.cooldown, model))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return allowed
+
+    def record_success(self, model):
+        with self._lock:
+            self._conn.execute("DELETE FROM circuits WHERE model = ?", (model,))
+
+    def record_failure(self, model):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO circuits (model, failures, opened_until) VALUES (?, 1, 0)
+                ON CONFLICT(model) DO UPDATE SET failures = failures + 1
+                """,
+                (model,),
+            )
+            self._conn.execute(
+                "UPDATE circuits SET opened_until = ? WHERE model = ? AND failures >= ? AND opened_until <= ?",
+                (now + self.cooldown, model, self.failure_threshold, now),
+            )
+
+    def state(self):
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute("SELECT model, failures, opened_until FROM circuits ORDER BY model").fetchall()
+        return [
+            {"model": model, "failures": failures,
+             "open": failures >= self.failure_threshold and opened_until > now,
+             "open_for": max(0.0, opened_until - now)}
+            for model, failures, opened_until in rows
+        ]
+
+_default_breaker = None
+_default_breaker_lock = threading.Lock()
+
+def get_default_breaker():
+    """
+    取得共用的斷路器實例
+    """
+    global _default_breaker
+    with _default_breaker_lock:
+        if _default_breaker is None:
+            _default_breaker = CircuitBreaker(os.environ.get("GEMINI_CIRCUIT_PATH", DEFAULT_CIRCUIT_PATH))
+        return _default_breaker
+
+def _remaining(deadline_at):
+    return None if deadline_at is None else deadline_at - time.monotonic()
+
+def _expired(deadline_at):
+    return deadline_at is not None and time.monotonic() >= deadline_at
+
+def _check_breaker(breaker, model):
+    try:
+        return breaker.allow(model)
+    except sqlite3.Error as e:
+        log.warning(f"斷路器讀寫失敗: {e}")
+        return True
+
+def _record(breaker, model, result, deadline_at=None):
+    """
+    只有暫時性錯誤 (結果帶有 retryable) 才計入斷路器；請求錯誤、驗證失敗等與上游健康無關，
+    因期限到了而中止的請求 (HTTP 逾時設為剩餘時間) 也不計入。
+    對沖請求的結果計入實際回答的模型，另一個以暫時性錯誤結束的模型另外記為失敗
+    """
+    hedge = result.get("hedge") or {}
+    model = hedge.get("winner") or model
+    try:
+        if not _expired(deadline_at):
+            for failed in hedge.get("failed") or ():
+                breaker.record_failure(failed)
+        if not result.get("error"):
+            breaker.record_success(model)
+        elif result.get("retryable") and not _expired(deadline_at):
+            breaker.record_failure(model)
+    except sqlite3.Error as e:
+        log.warning(f"斷路器讀寫失敗: {e}")
+
+def _next_delay(result, attempt, max_attempts, deadline_at):
+    """
+    返回下次重試前要等待的秒數；不應再重試時返回 None
+    """
+    if not result.get("error") or not result.get("retryable") or attempt + 1 >= max_attempts:
+        return None
+    delay = backoff_delay(attempt)
+    remaining = _remaining(deadline_at)
+    if remaining is not None and remaining <= delay:
+        return None
+    return delay
+
+def call_with_retries(attempt, model, deadline_at=None, max_attempts=DEFAULT_MAX_ATTEMPTS, breaker=None,
+                      make_error=None):
+    """
+    在期限內重試暫時性錯誤，並依斷路器略過持續失敗的模型。
+
+    attempt 接受本次可用的剩餘秒數 (沒有期限時為 None)，返回結果字典；
+    可重試的錯誤結果需帶有 "retryable": True；模型被斷路時以 make_error 建立錯誤結果
+    """
+    breaker = breaker or get_default_breaker()
+    result = None
+    for n in range(max_attempts):
+        if not _check_breaker(breaker, model):
+            if result is None:
+                result = (make_error or (lambda message: {"error": message}))(f"Circuit open for model {model}")
+                result["circuit_open"] = True
+            result["attempts"] = n
+            return result
+        result = attempt(_remaining(deadline_at))
+        _record(breaker, model, result, deadline_at)
+        delay = _next_delay(result, n, max_attempts, deadline_at)
+        if delay is None:
+            break
+        time.sleep(delay)
+    result["attempts"] = n + 1
+    return result
+
+async def call_with_retries_async(attempt, model, deadline_at=None, max_attempts=DEFAULT_MAX_ATTEMPTS, breaker=None,
+                                  make_error=None):
+    """
+    call_with_retries 的非同步版本，attempt 為 async 函式
+    """
+    import asyncio
+    breaker = breaker or get_default_breaker()
+    result = None
+    for n in range(max_attempts):
+        if not _check_breaker(breaker, model):
+            if result is None:
+                result = (make_error or (lambda message: {"error": message}))(f"Circuit open for model {model}")
+                result["circuit_open"] = True
+            result["attempts"] = n
+            return result
+        result = await attempt(_remaining(deadline_at))
+        _record(breaker, model, result, deadline_at)
+        delay = _next_delay(result, n, max_attempts, deadline_at)
+        if delay is None:
+            break
+        await asyncio.sleep(delay)
+    result["attempts"] = n + 1
+    return result
+
+if __name__ == "__main__":
+    # 印出各模型目前的斷路器狀態
+    print(json.dumps(get_default_breaker().state(), indent=2))
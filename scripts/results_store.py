@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+import os
+import sys
+import csv
+import json
+import glob
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+from hedging import percentile
+
+# 預設的測試結果資料庫位置
+DEFAULT_RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "search_results.sqlite3")
+
+# 匯出與統計時每次從資料庫讀取的筆數
+FETCH_SIZE = 500
+
+# 測試腳本以這個前綴表示錯誤的回答
+ERROR_PREFIX = "錯誤:"
+
+COLUMNS = ("id", "run_id", "ts", "query", "provider", "model", "elapsed_ms", "error", "response", "links")
+
+class ResultsStore:
+    """
+    只附加的測試結果資料庫，以 (query, provider, model, ts) 建立索引，
+    取代每次執行各寫一個 JSON 檔案的做法
+    """
+
+    def __init__(self, path=DEFAULT_RESULTS_PATH):
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT NOT NULL,
+                ts REAL NOT NULL,
+                query TEXT NOT NULL,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                elapsed_ms REAL,
+                error TEXT,
+                response TEXT,
+                links TEXT
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_query ON results (query, provider, model, ts)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_provider_ts ON results (provider, ts)")
+
+    def insert_many(self, rows, run_id=None, ts=None):
+        """
+        在同一個交易中寫入多筆結果，返回寫入的筆數
+        """
+        run_id = run_id or new_run_id()
+        ts = time.time() if ts is None else ts
+        values = [
+            (run_id, row.get("ts", ts), row["query"], row["provider"], row["model"], row.get("elapsed_ms"),
+             row.get("error"), row.get("response"), json.dumps(row.get("links") or [], ensure_ascii=False))
+            for row in rows
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO results (run_id, ts, query, provider, model, elapsed_ms, error, response, links) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    values,
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(values)
+
+    def _where(self, query=None, provider=None, model=None, since=None, until=None):
+        clauses, params = [], []
+        for column, value in (("query", query), ("provider", provider), ("model", model)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts < ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def iter_rows(self, limit=None, **filters):
+        """
+        依時間順序逐批讀取符合條件的結果，不會一次載入全部
+        """
+        where, params = self._where(**filters)
+        sql = f"SELECT {', '.join(COLUMNS)} FROM results{where} ORDER BY ts, id"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute(sql, params)
+        while True:
+            with self._lock:
+                batch = cursor.fetchmany(FETCH_SIZE)
+            if not batch:
+                return
+            for row in batch:
+                item = dict(zip(COLUMNS, row))
+                item["links"] = json.loads(item["links"]) if item["links"] else []
+                yield item
+
+    def trend(self, bucket="day", **filters):
+        """
+        依時間區間與 provider/model 分組，逐組計算呼叫數、錯誤數與延遲百分位數；
+        資料庫依分組排序後逐組處理，記憶體只需保存一組的延遲
+        """
+        fmt = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d", "week": "%Y-W%W", "month": "%Y-%m"}[bucket]
+        where, params = self._where(**filters)
+        sql = (f"SELECT strftime('{fmt}', ts, 'unixepoch', 'localtime') AS period, provider, model, elapsed_ms, error "
+               f"FROM results{where} ORDER BY period, provider, model, elapsed_ms")
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute(sql, params)
+
+        group, latencies, calls, errors = None, [], 0, 0
+        while True:
+            with self._lock:
+                batch = cursor.fetchmany(FETCH_SIZE)
+            for period, provider, model, elapsed_ms, error in batch:
+                if (period, provider, model) != group:
+                    if group is not None:
+                        yield _trend_entry(group, calls, errors, latencies)
+                    group, latencies, calls, errors = (period, provider, model), [], 0, 0
+                calls += 1
+                if error:
+                    errors += 1
+                elif elapsed_ms is not None:
+                    latencies.append(elapsed_ms)
+            if not batch:
+                break
+        if group is not None:
+            yield _trend_entry(group, calls, errors, latencies)
+
+def _trend_entry(group, calls, errors, latencies):
+    # SQL 已依 elapsed_ms 排序，latencies 不需要再排序
+    period, provider, model = group
+    p50, p90 = percentile(latencies, 50), percentile(latencies, 90)
+    return {
+        "period": period,
+        "provider": provider,
+        "model": model,
+        "calls": calls,
+        "errors": errors,
+        "p50_ms": None if p50 is None else round(p50, 2),
+        "p90_ms": None if p90 is None else round(p90, 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+    }
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_default_store():
+    """
+    取得共用的測試結果資料庫
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ResultsStore(os.environ.get("SEARCH_RESULTS_PATH", DEFAULT_RESULTS_PATH))
+        return _default_store
+
+def new_run_id():
+    return datetime.now().strftime("%Y%m%d_%H%M%S")
+
+def row_from_result(result, provider=None, model=None):
+    """
+    將測試腳本的結果字典 ({"model", "query", "response", "elapsed_time", "links"}) 轉為一筆資料
+    """
+    response = result.get("response") or ""
+    error = result.get("error") or (response[len(ERROR_PREFIX):].strip() if response.startswith(ERROR_PREFIX) else None)
+    return {
+        "query": result["query"],
+        "provider": provider or result.get("model") or "unknown",
+        "model": model or result.get("model_name") or result.get("model") or "unknown",
+        "elapsed_ms": None if error else round((result.get("elapsed_time") or 0) * 1000, 2),
+        "error": error,
+        "response": None if error else response,
+        "links": result.get("links") or [],
+    }
+
+def record_results(results, run_id=None):
+    """
+    給測試腳本使用：一次寫入多個結果字典，返回 run_id
+    """
+    run_id = run_id or new_run_id()
+    get_default_store().insert_many([row_from_result(result) for result in results], run_id)
+    return run_id
+
+def import_json_files(store, paths):
+    """
+    匯入舊版的 comparison_results_*.json 與 gemini_test_results_*.json，返回匯入的筆數
+    """
+    total = 0
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        stamp = os.path.basename(path).rsplit("_", 2)
+        run_id = "_".join(stamp[-2:]).removesuffix(".json") if len(stamp) == 3 else os.path.basename(path)
+        try:
+            ts = datetime.strptime(run_id, "%Y%m%d_%H%M%S").timestamp()
+        except ValueError:
+            ts = os.path.getmtime(path)
+
+        if "gemini" in data and "perplexity" in data:
+            # comparison_results: {"query", "gemini": {...}, "perplexity": {...}}
+            rows = [row_from_result(data["gemini"], "gemini"), row_from_result(data["perplexity"], "perplexity")]
+        else:
+            # gemini_test_results: {query: {model: {...}}}
+            rows = [row_from_result(result, "gemini", model)
+                    for by_model in data.values() for model, result in by_model.items()]
+        total += store.insert_many(rows, run_id, ts)
+    return total
+
+def parse_time(text):
+    """
+    接受 "2025-03-01"、ISO 時間或 "7d" 這類相對時間，返回 Unix 時間
+    """
+    if text is None:
+        return None
+    from search_metrics import parse_window
+    try:
+        return time.time() - parse_window(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查詢、匯出與匯入搜尋測試結果")
+    parser.add_argument("--db", default=None, help="結果資料庫路徑")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_filters(p):
+        p.add_argument("--query", default=None)
+        p.add_argument("--provider", default=None)
+        p.add_argument("--model", default=None)
+        p.add_argument("--since", default=None, help="起始時間，例如 2025-03-01 或 7d")
+        p.add_argument("--until", default=None, help="結束時間")
+
+    export = sub.add_parser("export", help="逐行匯出符合條件的結果")
+    add_filters(export)
+    export.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    export.add_argument("--limit", type=int, default=None)
+
+    trend = sub.add_parser("trend", help="依時間區間統計各 provider/model 的延遲與錯誤數")
+    add_filters(trend)
+    trend.add_argument("--by", choices=("hour", "day", "week", "month"), default="day")
+    trend.add_argument("--json", action="store_true", help="以 JSON 行輸出")
+
+    importer = sub.add_parser("import", help="匯入舊版的 JSON 結果檔")
+    importer.add_argument("files", nargs="*", help="預設為目前目錄下的 comparison_results_*.json 與 gemini_test_results_*.json")
+
+    args = parser.parse_args(argv)
+    store = ResultsStore(args.db) if args.db else get_default_store()
+
+    if args.command == "import":
+        files = args.files or sorted(glob.glob("comparison_results_*.json") + glob.glob("gemini_test_results_*.json"))
+        print(f"已匯入 {import_json_files(store, files)} 筆結果 ({len(files)} 個檔案)")
+        return 0
+
+    filters = {"query": args.query, "provider": args.provider, "model": args.model,
+               "since": parse_time(args.since), "until": parse_time(args.until)}
+
+    if args.command == "export":
+        rows = store.iter_rows(args.limit, **filters)
+        if args.format == "csv":
+            writer = csv.writer(sys.stdout)
+            writer.writerow(COLUMNS)
+            for row in rows:
+                writer.writerow([json.dumps(row[c], ensure_ascii=False) if c == "links" else row[c] for c in COLUMNS])
+        else:
+            for row in rows:
+                sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+        return 0
+
+    for entry in store.trend(args.by, **filters):
+        if args.json:
+            print(json.dumps(entry, ensure_ascii=False))
+            continue
+        p50 = "-" if entry["p50_ms"] is None else f"{entry['p50_ms']:.0f}"
+        p90 = "-" if entry["p90_ms"] is None else f"{entry['p90_ms']:.0f}"
+        print(f"{entry['period']:<16} {entry['provider']:<12} {entry['model']:<24} "
+              f"呼叫 {entry['calls']:5d}  錯誤 {entry['errors']:4d}  p50 {p50:>7} ms  p90 {p90:>7} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
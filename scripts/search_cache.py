@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+
+# 預設的快取檔案位置與容量
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "search_cache.sqlite3")
+DEFAULT_MAX_ENTRIES = 1000
+DEFAULT_TTL = 600
+
+# 過期的結果再保留多久 (秒)，上游失敗或逾時時作為降級回答
+DEFAULT_STALE_TTL = 24 * 3600
+
+def normalize_query(query):
+    """
+    正規化查詢字串：去除前後空白、合併連續空白並轉為小寫
+    """
+    return " ".join(query.split()).lower()
+
+def make_cache_key(query, model_id, prompt_template):
+    """
+    以正規化後的查詢、模型與提示詞模板產生快取鍵
+    """
+    raw = "\x00".join([normalize_query(query), model_id, prompt_template])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class SearchCache:
+    """
+    以 SQLite 儲存的搜尋結果快取，具有每筆 TTL 與容量上限的 LRU 淘汰；
+    過期的項目會再保留 stale_ttl 秒，供 get_stale 取用
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, default_ttl=DEFAULT_TTL,
+                 stale_ttl=DEFAULT_STALE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS search_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_last_access ON search_cache (last_access)")
+
+    def get(self, key):
+        """
+        讀取快取結果，過期或不存在時返回 None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, expires_at FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            self._conn.execute("UPDATE search_cache SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def get_stale(self, keys):
+        """
+        在多個鍵中找出最新的結果 (包含已過期但仍在保留期內的項目)，
+        返回 (result, age 秒數)，都不存在時返回 (None, None)
+        """
+        if not keys:
+            return None, None
+        now = time.time()
+        placeholders = ",".join("?" for _ in keys)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT result, created_at FROM search_cache WHERE expires_at > ? AND key IN ({placeholders}) "
+                "ORDER BY created_at DESC LIMIT 1",
+                [now - self.stale_ttl] + list(keys),
+            ).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), now - row[1]
+
+    def set(self, key, result, ttl=None):
+        """
+        寫入快取結果，並在超過容量時淘汰最久未使用的項目
+        """
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        payload = json.dumps(result, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, result, created_at, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, now, now + ttl, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM search_cache WHERE expires_at <= ?", (now - self.stale_ttl,))
+        self._conn.execute(
+            """
+            DELETE FROM search_cache WHERE key IN (
+                SELECT key FROM search_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM search_cache")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_default_cache():
+    """
+    取得共用的快取實例，路徑與參數可透過環境變數設定
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SearchCache(
+                path=os.environ.get("GEMINI_SEARCH_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_entries=int(os.environ.get("GEMINI_SEARCH_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                default_ttl=float(os.environ.get("GEMINI_SEARCH_CACHE_TTL", DEFAULT_TTL)),
+                stale_ttl=float(os.environ.get("GEMINI_SEARCH_CACHE_STALE_TTL", DEFAULT_STALE_TTL)),
+            )
+        return _default_cache
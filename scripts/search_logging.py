@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import atexit
+import random
+import logging
+import threading
+
+# 以環境變數設定，常駐模式與 route 啟動的程序也適用
+LEVEL_ENV = "GEMINI_SEARCH_LOG_LEVEL"
+FILE_ENV = "GEMINI_SEARCH_LOG_FILE"
+SAMPLE_ENV = "GEMINI_SEARCH_LOG_SAMPLE_RATE"
+MAX_BYTES_ENV = "GEMINI_SEARCH_LOG_MAX_BYTES"
+
+# 預設只輸出警告以上的訊息；完整回應預設不記錄
+DEFAULT_LEVEL = "WARNING"
+DEFAULT_SAMPLE_RATE = 0.0
+DEFAULT_MAX_BYTES = 2048
+
+class TextFormatter(logging.Formatter):
+    """
+    stderr 使用 "[名稱] 訊息" 格式，payload 接在下一行
+    """
+
+    def format(self, record):
+        text = f"[{record.name}] {record.getMessage()}"
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            text += "\n" + payload
+        return text
+
+class JsonFormatter(logging.Formatter):
+    """
+    檔案輸出使用 JSON 行格式，extra 中的 payload 會一併寫入
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        payload = getattr(record, "payload", None)
+        if payload is not None:
+            entry["payload"] = payload
+        return json.dumps(entry, ensure_ascii=False)
+
+_configured = False
+_configure_lock = threading.Lock()
+_settings = {"sample_rate": DEFAULT_SAMPLE_RATE, "max_bytes": DEFAULT_MAX_BYTES}
+
+def configure(level=None, log_file=None, sample_rate=None, max_bytes=None):
+    """
+    設定 gemini_search 系列的 logger，只會生效一次。
+    stderr 保留簡短的 "[名稱] 訊息" 格式；指定 log_file 時另外以背景執行緒寫入 JSON 行，
+    不會阻塞搜尋
+    """
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+
+        level = (level or os.environ.get(LEVEL_ENV) or DEFAULT_LEVEL).upper()
+        log_file = log_file or os.environ.get(FILE_ENV)
+        _settings["sample_rate"] = float(os.environ.get(SAMPLE_ENV, DEFAULT_SAMPLE_RATE) if sample_rate is None else sample_rate)
+        _settings["max_bytes"] = int(os.environ.get(MAX_BYTES_ENV, DEFAULT_MAX_BYTES) if max_bytes is None else max_bytes)
+
+        root = logging.getLogger("gemini_search")
+        root.setLevel(level)
+        root.propagate = False
+
+        stderr_handler = logging.StreamHandler(sys.stderr)
+        stderr_handler.setFormatter(TextFormatter())
+        # 寫入檔案時，stderr 只保留警告以上的訊息
+        stderr_handler.setLevel(logging.WARNING if log_file else level)
+        root.addHandler(stderr_handler)
+
+        if log_file:
+            import queue
+            from logging.handlers import QueueHandler, QueueListener
+            os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+            file_handler = logging.FileHandler(log_file, encoding="utf-8")
+            file_handler.setFormatter(JsonFormatter())
+            records = queue.SimpleQueue()
+            listener = QueueListener(records, file_handler)
+            listener.start()
+            atexit.register(listener.stop)
+            root.addHandler(QueueHandler(records))
+
+def get_logger(name):
+    """
+    取得 gemini_search 之下的 logger，例如 get_logger("cache") 對應 "gemini_search.cache"
+    """
+    configure()
+    return logging.getLogger(f"gemini_search.{name}" if name != "gemini_search" else name)
+
+def truncate(text, max_bytes=None):
+    """
+    將字串截斷到 max_bytes 位元組以內，並註明原本的長度
+    """
+    max_bytes = _settings["max_bytes"] if max_bytes is None else max_bytes
+    data = text.encode("utf-8")
+    if len(data) <= max_bytes:
+        return text
+    return data[:max_bytes].decode("utf-8", errors="ignore") + f"... [truncated, {len(data)} bytes]"
+
+def should_sample():
+    return _settings["sample_rate"] > 0 and random.random() < _settings["sample_rate"]
+
+def log_payload(logger, message, build_payload, level=logging.DEBUG):
+    """
+    依取樣率記錄大型內容 (例如完整的 API 回應)。
+    只有在該等級啟用且被取樣時才呼叫 build_payload 序列化，內容會被截斷
+    """
+    if not logger.isEnabledFor(level) or not should_sample():
+        return
+    try:
+        payload = truncate(build_payload())
+    except Exception as e:
+        payload = f"<unserializable: {e}>"
+    logger.log(level, message, extra={"payload": payload})
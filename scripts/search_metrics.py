@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+
+from hedging import percentile
+from search_logging import get_logger
+
+log = get_logger(__name__)
+
+# 預設的指標資料庫位置與原始紀錄保留天數
+DEFAULT_METRICS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "search_metrics.sqlite3")
+DEFAULT_RETENTION_DAYS = 30
+
+# 每寫入多少筆清理一次過期的紀錄
+PRUNE_EVERY = 500
+
+# 延遲直方圖的區間上限 (毫秒)
+HISTOGRAM_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+class MetricsStore:
+    """
+    以 SQLite 記錄每次搜尋的模型、token 用量、延遲、快取狀態與結果
+    """
+
+    def __init__(self, path=DEFAULT_METRICS_PATH, retention_days=DEFAULT_RETENTION_DAYS):
+        self.retention = retention_days * 24 * 3600
+        self._lock = threading.Lock()
+        self._writes = 0
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS search_metrics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                provider TEXT NOT NULL,
+                model TEXT NOT NULL,
+                mode TEXT,
+                cache TEXT,
+                outcome TEXT NOT NULL,
+                latency_ms REAL,
+                upstream_ms REAL,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                total_tokens INTEGER
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_search_metrics_ts ON search_metrics (ts, model)")
+
+    def record(self, provider, model, outcome, latency_ms=None, upstream_ms=None, usage=None, cache=None, mode=None):
+        usage = usage or {}
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO search_metrics (ts, provider, model, mode, cache, outcome, latency_ms, upstream_ms,
+                                            prompt_tokens, completion_tokens, total_tokens)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (time.time(), provider, model, mode, cache, outcome, latency_ms, upstream_ms,
+                 usage.get("prompt_tokens"), usage.get("completion_tokens"), usage.get("total_tokens")),
+            )
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self._conn.execute("DELETE FROM search_metrics WHERE ts < ?", (time.time() - self.retention,))
+
+    def rows(self, since, provider=None, model=None):
+        sql = ("SELECT provider, model, cache, outcome, latency_ms, upstream_ms, prompt_tokens, completion_tokens, "
+               "total_tokens FROM search_metrics WHERE ts >= ?")
+        params = [since]
+        if provider:
+            sql += " AND provider = ?"
+            params.append(provider)
+        if model:
+            sql += " AND model = ?"
+            params.append(model)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+def get_default_store():
+    """
+    取得共用的指標資料庫；設定 GEMINI_SEARCH_METRICS=0 時返回 None (停用)
+    """
+    global _default_store
+    if os.environ.get("GEMINI_SEARCH_METRICS") == "0":
+        return None
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = MetricsStore(os.environ.get("GEMINI_SEARCH_METRICS_PATH", DEFAULT_METRICS_PATH))
+        return _default_store
+
+def outcome_of(result):
+    if result.get("degraded"):
+        return "degraded"
+    return "error" if result.get("error") else "ok"
+
+def record_result(provider, model, result, mode=None):
+    """
+    由搜尋結果 (含 timings 與 usage) 寫入一筆指標，失敗時只印出警告
+    """
+    store = get_default_store()
+    if store is None:
+        return
+    timings = result.get("timings") or {}
+    # 快取命中與合併的請求沒有實際消耗 token
+    spent = not result.get("coalesced") and result.get("cache") not in ("hit", "stale", "index")
+    try:
+        store.record(provider, model, outcome_of(result), timings.get("total"), timings.get("upstream"),
+                     result.get("usage") if spent else None, result.get("cache"), mode)
+    except sqlite3.Error as e:
+        log.warning(f"寫入指標失敗: {e}")
+
+def usage_from_response(response):
+    """
+    從 Gemini (usage_metadata) 或 OpenAI 相容 (usage) 的回應物件提取 token 用量
+    """
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "total_tokens": getattr(usage, "total_tokens", None),
+        }
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        return {
+            "prompt_tokens": getattr(usage, "prompt_token_count", None),
+            "completion_tokens": getattr(usage, "candidates_token_count", None),
+            "total_tokens": getattr(usage, "total_token_count", None),
+        }
+    return None
+
+def record_response(provider, model, latency_ms, response=None, outcome="ok", mode=None):
+    """
+    給測試腳本使用：直接由 API 回應物件寫入一筆指標
+    """
+    store = get_default_store()
+    if store is None:
+        return
+    try:
+        store.record(provider, model, outcome, latency_ms, latency_ms, usage_from_response(response), None, mode)
+    except sqlite3.Error as e:
+        log.warning(f"寫入指標失敗: {e}")
+
+def parse_window(text):
+    """
+    將 "90s"、"30m"、"24h"、"7d" 轉為秒數
+    """
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+def histogram(values, buckets=HISTOGRAM_BUCKETS):
+    counts = [0] * (len(buckets) + 1)
+    for value in values:
+        for i, upper in enumerate(buckets):
+            if value <= upper:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    labels = [f"<={upper}ms" for upper in buckets] + [f">{buckets[-1]}ms"]
+    return list(zip(labels, counts))
+
+def summarize(rows):
+    """
+    依 (provider, model) 彙總延遲百分位數、直方圖、token 用量與每秒 token 數
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault((row[0], row[1]), []).append(row)
+
+    report = []
+    for (provider, model), items in sorted(groups.items()):
+        latencies = sorted(r[4] for r in items if r[4] is not None)
+        # 每秒 token 數只計入同時有上游耗時與輸出 token 的呼叫
+        generated = [(r[5], r[7]) for r in items if r[5] and r[7]]
+        upstream_seconds = sum(ms for ms, _ in generated) / 1000
+        report.append({
+            "provider": provider,
+            "model": model,
+            "calls": len(items),
+            "errors": sum(1 for r in items if r[3] == "error"),
+            "degraded": sum(1 for r in items if r[3] == "degraded"),
+            "cache_hits": sum(1 for r in items if r[2] == "hit"),
+            "index_hits": sum(1 for r in items if r[2] == "index"),
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p90": percentile(latencies, 90),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "mean": sum(latencies) / len(latencies) if latencies else None,
+            },
+            "histogram": histogram(latencies),
+            "tokens": {
+                "prompt": sum(r[6] or 0 for r in items),
+                "completion": sum(r[7] or 0 for r in items),
+                "total": sum(r[8] or 0 for r in items),
+            },
+            "completion_tokens_per_second": sum(n for _, n in generated) / upstream_seconds if generated else None,
+        })
+    return report
+
+def print_report(report, window):
+    print(f"時間範圍: 最近 {window}")
+    for entry in report:
+        latency = entry["latency_ms"]
+        print("=" * 60)
+        print(f"{entry['provider']} / {entry['model']}: {entry['calls']} 次呼叫, "
+              f"{entry['errors']} 次錯誤, {entry['degraded']} 次降級, {entry['cache_hits']} 次快取命中, "
+              f"{entry['index_hits']} 次索引命中")
+        if latency["p50"] is not None:
+            print("延遲 (ms): " + ", ".join(f"{k}={v:.1f}" for k, v in latency.items()))
+        tokens = entry["tokens"]
+        tps = entry["completion_tokens_per_second"]
+        print(f"Token: prompt={tokens['prompt']} completion={tokens['completion']} total={tokens['total']}"
+              + (f", 輸出速度 {tps:.1f} tokens/s" if tps is not None else ""))
+        peak = max((count for _, count in entry["histogram"]), default=0)
+        for label, count in entry["histogram"]:
+            bar = "#" * (round(count / peak * 40) if peak else 0)
+            print(f"  {label:>10} {count:6d} {bar}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查詢搜尋的延遲與 token 用量指標")
+    parser.add_argument("--window", default="24h", help="時間範圍，例如 30m、24h、7d")
+    parser.add_argument("--provider", default=None)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--json", action="store_true", help="以 JSON 輸出")
+    parser.add_argument("--db", default=None, help="指標資料庫路徑")
+    args = parser.parse_args(argv)
+
+    store = MetricsStore(args.db) if args.db else get_default_store()
+    if store is None:
+        print("指標記錄已停用 (GEMINI_SEARCH_METRICS=0)", file=sys.stderr)
+        return 1
+    report = summarize(store.rows(time.time() - parse_window(args.window), args.provider, args.model))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report, args.window)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import atexit
+import threading
+
+from search_logging import get_logger
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 沒有 fcntl，只能在同一程序內合併請求
+    fcntl = None
+
+log = get_logger(__name__)
+
+# 預設的鎖檔目錄
+DEFAULT_SINGLEFLIGHT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "singleflight")
+
+# 結果檔保留的秒數，過期的會在下次清理時清除
+RESULT_RETENTION = 60
+
+# 清理目錄的間隔 (秒)：所有程序共用 .cleanup 標記檔的修改時間，間隔內只有一個程序會列出目錄
+CLEANUP_INTERVAL = 30
+
+# 計數器先累積在記憶體中，最多每隔這麼久 (秒) 寫入 stats.json 一次，程序結束時也會寫入
+STATS_FLUSH_INTERVAL = 5
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    合併相同鍵的並行請求：同一時間只有一個呼叫者 (leader) 真正執行，
+    其餘呼叫者等待並共用其結果。
+
+    同一程序內以 threading.Event 合併；跨程序時以 fcntl 檔案鎖選出 leader，
+    結果寫入 <key>.json 讓其他程序讀取。
+    """
+
+    def __init__(self, directory=DEFAULT_SINGLEFLIGHT_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._pending_stats = {}
+        self._stats_flushed_at = time.monotonic()
+        self._next_cleanup = 0.0
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.flush_stats)
+
+    def do(self, key, fn):
+        """
+        執行 fn() 並返回 (result, shared)；shared 為 True 代表結果來自其他呼叫者
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            self._increment("coalesced")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result, shared = self._do_across_processes(key, fn)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _do_across_processes(self, key, fn):
+        if fcntl is None:
+            result = fn()
+            self._increment("leaders")
+            return result, False
+
+        lock_path = os.path.join(self.directory, f"{key}.lock")
+        result_path = os.path.join(self.directory, f"{key}.json")
+        wait_start = time.time()
+
+        while True:
+            with open(lock_path, "a") as lock_file:
+                waited = False
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    # 其他程序正在執行相同請求，等待它完成
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    waited = True
+                if not self._is_current(lock_file, lock_path):
+                    # 等待期間鎖檔被清理刪除，鎖在已刪除的檔案上沒有意義，重新開啟
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    continue
+                if waited:
+                    shared = self._read_result(result_path, wait_start)
+                    if shared is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+                        self._increment("coalesced")
+                        return shared, True
+
+                # 取得鎖的程序成為 leader
+                try:
+                    result = fn()
+                    self._write_result(result_path, result)
+                    self._increment("leaders")
+                    return result, False
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _is_current(lock_file, lock_path):
+        """
+        持有的鎖檔是否仍是目錄中的那個檔案
+        """
+        try:
+            return os.fstat(lock_file.fileno()).st_ino == os.stat(lock_path).st_ino
+        except OSError:
+            return False
+
+    def _read_result(self, path, not_before):
+        """
+        讀取 leader 寫入的結果，只接受等待開始之後才完成的結果
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("finished_at", 0) < not_before:
+            return None
+        return data.get("result")
+
+    def _write_result(self, path, result):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"finished_at": time.time(), "result": result}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._cleanup()
+
+    def _cleanup(self):
+        """
+        清除過期的結果檔與鎖檔；每個程序最多每 CLEANUP_INTERVAL 秒檢查一次標記檔，
+        間隔內已有其他程序清理過時不列出目錄
+        """
+        now = time.monotonic()
+        if now < self._next_cleanup:
+            return
+        self._next_cleanup = now + CLEANUP_INTERVAL
+        marker = os.path.join(self.directory, ".cleanup")
+        cutoff = time.time() - RESULT_RETENTION
+        try:
+            if os.path.getmtime(marker) > time.time() - CLEANUP_INTERVAL:
+                return
+        except OSError:
+            pass
+        try:
+            with open(marker, "a"):
+                os.utime(marker)
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.endswith(".json") or name == "stats.json":
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    self._remove_idle_lock(path[:-len(".json")] + ".lock")
+            except OSError:
+                pass
+
+    @staticmethod
+    def _remove_idle_lock(lock_path):
+        """
+        只刪除目前沒有程序持有的鎖檔；正在執行慢請求的 leader 仍持有鎖時保留
+        """
+        if fcntl is None:
+            return
+        try:
+            with open(lock_path, "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return
+                try:
+                    os.remove(lock_path)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        except OSError:
+            pass
+
+    def _increment(self, name):
+        """
+        累加計數器；先累積在記憶體中，超過 STATS_FLUSH_INTERVAL 才寫入跨程序共用的檔案
+        """
+        with self._lock:
+            self._pending_stats[name] = self._pending_stats.get(name, 0) + 1
+            due = time.monotonic() - self._stats_flushed_at >= STATS_FLUSH_INTERVAL
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """
+        將累積的計數寫入 stats.json
+        """
+        with self._lock:
+            pending, self._pending_stats = self._pending_stats, {}
+            self._stats_flushed_at = time.monotonic()
+        if not pending:
+            return
+        stats_path = os.path.join(self.directory, "stats.json")
+        try:
+            with open(os.path.join(self.directory, "stats.lock"), "a") as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                stats = self._load_stats(stats_path)
+                for name, count in pending.items():
+                    stats[name] = stats.get(name, 0) + count
+                tmp_path = f"{stats_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(stats, f)
+                os.replace(tmp_path, stats_path)
+        except OSError as e:
+            log.warning(f"更新計數器失敗: {e}")
+
+    def _load_stats(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def stats(self):
+        """
+        返回累計的 leader 與被合併的呼叫次數
+        """
+        self.flush_stats()
+        stats = self._load_stats(os.path.join(self.directory, "stats.json"))
+        return {"leaders": stats.get("leaders", 0), "coalesced": stats.get("coalesced", 0)}
+
+_default_singleflight = None
+_default_singleflight_lock = threading.Lock()
+
+def get_default_singleflight():
+    """
+    取得共用的 SingleFlight 實例
+    """
+    global _default_singleflight
+    with _default_singleflight_lock:
+        if _default_singleflight is None:
+            _default_singleflight = SingleFlight(os.environ.get("GEMINI_SINGLEFLIGHT_DIR", DEFAULT_SINGLEFLIGHT_DIR))
+        return _default_singleflight
+
+if __name__ == "__main__":
+    # 印出目前的合併統計
+    print(json.dumps(get_default_singleflight().stats()))
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+import os
+
+# 搜尋流程會寫入的所有狀態位置 (環境變數 → 檔名或目錄名)，預設都在 .cache 之下。
+# 新增會寫入 .cache 的儲存時也要加到這裡，測試與量測工具才能把它指向暫存目錄
+STATE_PATH_VARS = {
+    "GEMINI_SEARCH_CACHE_PATH": "search_cache.sqlite3",
+    "GEMINI_LATENCY_HISTORY_PATH": "latency_history.sqlite3",
+    "GEMINI_SINGLEFLIGHT_DIR": "singleflight",
+    "GEMINI_REDIRECT_CACHE_PATH": "redirect_cache.sqlite3",
+    "SEARCH_RATE_LIMIT_PATH": "rate_limits.sqlite3",
+    "GEMINI_CIRCUIT_PATH": "circuit_breaker.sqlite3",
+    "GEMINI_SEARCH_METRICS_PATH": "search_metrics.sqlite3",
+    "GEMINI_PREFETCH_PATH": "prefetch.sqlite3",
+    "GEMINI_ROUTER_PATH": "model_router.sqlite3",
+    "SEARCH_RESULTS_PATH": "search_results.sqlite3",
+    "GEMINI_ENTRY_POINT_PATH": "entry_points.sqlite3",
+    "GEMINI_ANSWER_INDEX_PATH": "answer_index.sqlite3",
+}
+
+def isolated_env(directory, env=None):
+    """
+    返回所有狀態位置都指向 directory 的環境變數副本，
+    讓每次執行從空的狀態開始，也不會寫入開發者的 .cache
+    """
+    env = dict(os.environ if env is None else env)
+    for name, filename in STATE_PATH_VARS.items():
+        env[name] = os.path.join(directory, filename)
+    return env
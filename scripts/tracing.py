@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import os
+import json
+import time
+import hashlib
+import threading
+
+from search_cache import normalize_query
+from search_logging import get_logger
+
+log = get_logger(__name__)
+
+# 設定此環境變數時，常駐模式與 route 啟動的程序也會寫入追蹤紀錄
+TRACE_FILE_ENV = "GEMINI_SEARCH_TRACE_FILE"
+
+def add_timing(timings, stage, started):
+    """
+    將 started 到現在的耗時 (毫秒) 累加到 timings[stage]，返回現在的時間點
+    """
+    now = time.monotonic()
+    timings[stage] = timings.get(stage, 0.0) + (now - started) * 1000
+    return now
+
+def query_hash(query):
+    """
+    追蹤紀錄不保存原始查詢，只保存正規化後查詢的雜湊
+    """
+    return hashlib.sha256(normalize_query(query or "").encode("utf-8")).hexdigest()[:16]
+
+def make_span(query, model, result, mode="search"):
+    """
+    由一次搜尋的結果建立一筆追蹤紀錄
+    """
+    entry_point = result.get("search_entry_point") or ""
+    return {
+        "ts": time.time(),
+        "mode": mode,
+        "query_hash": query_hash(query),
+        "model": model,
+        "cache": result.get("cache"),
+        "coalesced": result.get("coalesced", False),
+        "error": bool(result.get("error")),
+        "degraded": bool(result.get("degraded")),
+        "attempts": result.get("attempts"),
+        "timings": result.get("timings") or {},
+        "sizes": {
+            "query_chars": len(query or ""),
+            "answer_chars": len(result.get("answer") or ""),
+            "citations": len(result.get("citations") or []),
+            "search_entry_point_bytes": len(entry_point.encode("utf-8")),
+            "result_bytes": len(json.dumps(result, ensure_ascii=False).encode("utf-8")),
+        },
+    }
+
+class TraceWriter:
+    """
+    以附加方式寫入 JSON 行的追蹤紀錄；每行一次 write 呼叫，多個程序同時寫入也不會交錯
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, span):
+        line = json.dumps(span, ensure_ascii=False) + "\n"
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            log.warning(f"寫入追蹤紀錄失敗: {e}")
+
+_trace_writer = None
+_trace_writer_lock = threading.Lock()
+
+def configure_trace_file(path):
+    """
+    指定追蹤紀錄檔 (--trace-file)，None 代表沿用環境變數
+    """
+    global _trace_writer
+    with _trace_writer_lock:
+        _trace_writer = TraceWriter(path) if path else None
+
+def get_trace_writer():
+    global _trace_writer
+    with _trace_writer_lock:
+        if _trace_writer is None and os.environ.get(TRACE_FILE_ENV):
+            _trace_writer = TraceWriter(os.environ[TRACE_FILE_ENV])
+        return _trace_writer
+
+def trace(query, model, result, mode="search"):
+    """
+    有設定追蹤紀錄檔時，寫入這次搜尋的紀錄
+    """
+    writer = get_trace_writer()
+    if writer is not None:
+        writer.write(make_span(query, model, result, mode))
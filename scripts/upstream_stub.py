@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+import re
+import sys
+import math
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 模擬 search_entry_point 的 HTML，結構與真實回應類似 (大段 CSS + 少量內容)
+ENTRY_POINT_STYLE = "<style>" + "".join(
+    f".container-{i} {{ display: flex; align-items: center; padding: {i}px; border-radius: 18px; }}\n"
+    for i in range(60)
+) + "</style>"
+
+def parse_distribution(spec):
+    """
+    解析延遲分佈設定，返回一個取樣函式 (單位：秒)
+
+    支援格式:
+      fixed:0.5
+      uniform:0.2,1.0
+      normal:0.8,0.2
+      lognormal:0.8,0.4      (中位數, sigma)
+      exponential:0.5        (平均值)
+    """
+    name, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if name == "fixed":
+        return lambda: values[0]
+    if name == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if name == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if name == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    if name == "exponential":
+        return lambda: random.expovariate(1.0 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+class StubConfig:
+    """
+    假上游伺服器的設定：預設延遲分佈、各模型的覆寫、錯誤率與串流片段數
+    """
+
+    def __init__(self, latency="fixed:0", model_latency=None, error_rate=0.0, stream_chunks=4, seed=None,
+                 redirect_latency="fixed:0"):
+        self.latency = parse_distribution(latency)
+        self.redirect_latency = parse_distribution(redirect_latency)
+        self.model_latency = {model: parse_distribution(spec) for model, spec in (model_latency or {}).items()}
+        self.error_rate = error_rate
+        self.stream_chunks = stream_chunks
+        self.requests = 0
+        self._lock = threading.Lock()
+        if seed is not None:
+            random.seed(seed)
+
+    def sample_latency(self, model):
+        return self.model_latency.get(model, self.latency)()
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+            return self.requests
+
+def extract_query(text):
+    match = re.search(r"問題:\s*(.+)", text)
+    return (match.group(1) if match else text).strip()
+
+def gemini_response(model, query, answer=None, redirect_base=None):
+    """
+    構建與 Gemini generateContent 相同格式的 JSON 回應；
+    指定 redirect_base 時，引用網址會指向假伺服器自己的轉址端點
+    """
+    answer = answer or f"關於「{query}」的模擬回答。"
+    redirect_base = redirect_base or "https://vertexaisearch.cloud.google.com"
+    return {
+        "candidates": [{
+            "content": {"parts": [{"text": answer}], "role": "model"},
+            "finishReason": "STOP",
+            "groundingMetadata": {
+                "groundingChunks": [
+                    {"web": {"uri": f"{redirect_base}/grounding-api-redirect/stub-{i}", "title": f"source{i % 2}.example.com"}}
+                    for i in range(3)
+                ],
+                "searchEntryPoint": {
+                    "renderedContent": ENTRY_POINT_STYLE + f'<div class="container-0"><a class="chip" href="https://www.google.com/search?q={query}">{query}</a></div>'
+                },
+                "webSearchQueries": [query, f"{query} 最新消息"]
+            }
+        }],
+        "usageMetadata": {
+            "promptTokenCount": len(query) + 20,
+            "candidatesTokenCount": len(answer),
+            "totalTokenCount": len(query) + 20 + len(answer)
+        },
+        "modelVersion": model
+    }
+
+def perplexity_response(model, query):
+    """
+    構建與 Perplexity (OpenAI 相容) chat.completions 相同格式的 JSON 回應
+    """
+    answer = f"Stub answer about: {query}"
+    return {
+        "id": f"stub-{random.getrandbits(32):08x}",
+        "model": model,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "choices": [{
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": answer}
+        }],
+        "citations": [f"https://source{i}.example.com/article" for i in range(3)],
+        "related_questions": [f"What else about {query}?", f"Why does {query} matter?"],
+        "usage": {
+            "prompt_tokens": len(query) + 30,
+            "completion_tokens": len(answer),
+            "total_tokens": len(query) + 30 + len(answer)
+        }
+    }
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = StubConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b"{}"
+        try:
+            return json.loads(body or b"{}")
+        except ValueError:
+            return {}
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error_response(self):
+        self._send_json(429, {"error": {"code": 429, "message": "Resource has been exhausted (stub)", "status": "RESOURCE_EXHAUSTED"}})
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._send_json(200, {"ok": True, "requests": self.config.requests})
+            return
+        redirect = re.match(r"^/grounding-api-redirect/stub-(\d+)$", self.path)
+        if redirect:
+            # 模擬 grounding 轉址：stub-0 與 stub-2 會轉到同一個頁面
+            time.sleep(self.config.redirect_latency())
+            self.send_response(302)
+            self.send_header("Location", f"/page/{int(redirect.group(1)) % 2}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.path.startswith("/page/"):
+            body = b"<html><body>stub page</body></html>"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(body)
+            return
+        self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+    def do_POST(self):
+        self.config.count()
+        gemini = re.match(r"^/[^/]+/models/([^:/]+):(generateContent|streamGenerateContent)", self.path)
+        if gemini:
+            self._handle_gemini(gemini.group(1), gemini.group(2) == "streamGenerateContent")
+            return
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            self._handle_perplexity()
+            return
+        self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+    def _handle_gemini(self, model, stream):
+        request = self._read_json()
+        text = ""
+        for content in request.get("contents", []):
+            for part in content.get("parts", []):
+                text += part.get("text", "")
+        query = extract_query(text)
+
+        latency = self.config.sample_latency(model)
+        if self.config.should_fail():
+            time.sleep(latency / 2)
+            self._send_error_response()
+            return
+
+        response = gemini_response(model, query, redirect_base=f"http://{self.headers.get('Host')}")
+        if not stream:
+            time.sleep(latency)
+            self._send_json(200, response)
+            return
+
+        # 串流：把回答切成數段，以 SSE 逐段送出，grounding metadata 只放在最後一段
+        answer = response["candidates"][0]["content"]["parts"][0]["text"]
+        chunks = max(1, self.config.stream_chunks)
+        size = max(1, -(-len(answer) // chunks))
+        pieces = [answer[i:i + size] for i in range(0, len(answer), size)]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, piece in enumerate(pieces):
+            time.sleep(latency / len(pieces))
+            chunk = {
+                "candidates": [{"content": {"parts": [{"text": piece}], "role": "model"}}],
+                "modelVersion": model
+            }
+            if index == len(pieces) - 1:
+                chunk["candidates"][0]["groundingMetadata"] = response["candidates"][0]["groundingMetadata"]
+                chunk["candidates"][0]["finishReason"] = "STOP"
+                chunk["usageMetadata"] = response["usageMetadata"]
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _handle_perplexity(self):
+        request = self._read_json()
+        model = request.get("model", "sonar")
+        messages = request.get("messages", [])
+        query = messages[-1].get("content", "") if messages else ""
+
+        latency = self.config.sample_latency(model)
+        time.sleep(latency)
+        if self.config.should_fail():
+            self._send_error_response()
+            return
+        self._send_json(200, perplexity_response(model, query))
+
+def make_server(host="127.0.0.1", port=0, config=None):
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def start_stub(host="127.0.0.1", port=0, config=None):
+    """
+    在背景執行緒啟動假上游伺服器，返回 (server, base_url)
+    """
+    server = make_server(host, port, config)
+    threading.Thread(target=server.serve_forever, name="upstream-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def parse_model_latency(values):
+    model_latency = {}
+    for value in values or []:
+        model, _, spec = value.partition("=")
+        model_latency[model] = spec
+    return model_latency
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="模擬 Gemini 與 Perplexity API 的離線伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:0.8,0.4", help="預設延遲分佈，例如 fixed:0.5 或 lognormal:0.8,0.4")
+    parser.add_argument("--model-latency", action="append", metavar="MODEL=DIST", help="個別模型的延遲分佈")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="回傳 429 的機率")
+    parser.add_argument("--stream-chunks", type=int, default=4, help="串流回應的片段數")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--redirect-latency", default="fixed:0.05", help="引用轉址端點的延遲分佈")
+    args = parser.parse_args(argv)
+
+    config = StubConfig(args.latency, parse_model_latency(args.model_latency), args.error_rate, args.stream_chunks, args.seed,
+                        args.redirect_latency)
+    server = make_server(args.host, args.port, config)
+    print(f"[upstream_stub] 監聽於 http://{args.host}:{server.server_address[1]}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
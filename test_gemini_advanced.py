@@ -1,10 +1,18 @@
 import os
-import json
+import sys
 import time
 from datetime import datetime
 from google.generativeai import GenerativeModel, configure
 from openai import OpenAI
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from rate_limiter import wait_for_slot, report_if_throttled
+from search_metrics import record_response
+from results_store import record_results
+
+# 這些腳本直接呼叫實際的 API，預設套用免費方案的額度以避免 429；可用 SEARCH_RATE_LIMITS 覆寫，SEARCH_RATE_LIMIT=0 停用
+os.environ.setdefault("SEARCH_RATE_LIMITS", "free-tier")
+
 # 設置 API 金鑰
 GEMINI_API_KEY = os.environ.get("NEXT_PUBLIC_GEMINI_API_KEY", "your_gemini_api_key_here")
 PERPLEXITY_API_KEY = os.environ.get("PERPLEXITY_API_KEY", "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")
@@ -23,6 +31,9 @@ def test_gemini_web_search(query, model="gemini-2.0-flash-exp"):
         print(f"\n[Gemini] 查詢: {query}")
         print("-" * 50)
         
+        # 依共用的限流額度等待，避免 API 限制
+        model_name = model
+        wait_for_slot("gemini", model_name)
         start_time = time.time()
         
         # 初始化 Gemini 模型
@@ -56,6 +67,7 @@ def test_gemini_web_search(query, model="gemini-2.0-flash-exp"):
         
         end_time = time.time()
         elapsed_time = end_time - start_time
+        record_response("gemini", model_name, elapsed_time * 1000, response, mode="test")
         
         # 提取並打印回答
         if response and response.text:
@@ -82,6 +94,7 @@ def test_gemini_web_search(query, model="gemini-2.0-flash-exp"):
             
             return {
                 "model": "gemini",
+                "model_name": model_name,
                 "query": query,
                 "response": answer,
                 "elapsed_time": elapsed_time,
@@ -91,6 +104,7 @@ def test_gemini_web_search(query, model="gemini-2.0-flash-exp"):
             print("[Gemini] 未收到有效回答")
             return {
                 "model": "gemini",
+                "model_name": model_name,
                 "query": query,
                 "response": "未收到有效回答",
                 "elapsed_time": elapsed_time,
@@ -99,8 +113,11 @@ def test_gemini_web_search(query, model="gemini-2.0-flash-exp"):
         
     except Exception as e:
         print(f"[Gemini] 錯誤: {e}")
+        report_if_throttled("gemini", model_name, e)
+        record_response("gemini", model_name, None, outcome="error", mode="test")
         return {
             "model": "gemini",
+            "model_name": model_name,
             "query": query,
             "response": f"錯誤: {str(e)}",
             "elapsed_time": 0,
@@ -115,6 +132,8 @@ def test_perplexity_web_search(query, model="sonar-small-online"):
         print(f"\n[Perplexity] 查詢: {query}")
         print("-" * 50)
         
+        # 依共用的限流額度等待，避免 API 限制
+        wait_for_slot("perplexity", model)
         start_time = time.time()
         
         messages = [
@@ -153,6 +172,7 @@ def test_perplexity_web_search(query, model="sonar-small-online"):
         
         end_time = time.time()
         elapsed_time = end_time - start_time
+        record_response("perplexity", model, elapsed_time * 1000, response, mode="test")
         
         # 提取並打印回答
         if hasattr(response, 'choices') and len(response.choices) > 0:
@@ -183,6 +203,7 @@ def test_perplexity_web_search(query, model="sonar-small-online"):
             
             return {
                 "model": "perplexity",
+                "model_name": model,
                 "query": query,
                 "response": answer,
                 "elapsed_time": elapsed_time,
@@ -192,6 +213,7 @@ def test_perplexity_web_search(query, model="sonar-small-online"):
             print("[Perplexity] 未收到有效回答")
             return {
                 "model": "perplexity",
+                "model_name": model,
                 "query": query,
                 "response": "未收到有效回答",
                 "elapsed_time": elapsed_time,
@@ -200,8 +222,11 @@ def test_perplexity_web_search(query, model="sonar-small-online"):
         
     except Exception as e:
         print(f"[Perplexity] 錯誤: {e}")
+        report_if_throttled("perplexity", model, e)
+        record_response("perplexity", model, None, outcome="error", mode="test")
         return {
             "model": "perplexity",
+            "model_name": model,
             "query": query,
             "response": f"錯誤: {str(e)}",
             "elapsed_time": 0,
@@ -233,19 +258,9 @@ def compare_results(gemini_result, perplexity_result):
     print(f"\nGemini 回答長度: {gemini_length} 字符")
     print(f"Perplexity 回答長度: {perplexity_length} 字符")
     
-    # 保存結果到文件
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"comparison_results_{timestamp}.json"
-    
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump({
-            "query": gemini_result['query'],
-            "gemini": gemini_result,
-            "perplexity": perplexity_result,
-            "timestamp": timestamp
-        }, f, ensure_ascii=False, indent=2)
-    
-    print(f"\n結果已保存到文件: {filename}")
+    # 寫入結果資料庫，以 scripts/results_store.py 查詢與匯出
+    run_id = record_results([gemini_result, perplexity_result])
+    print(f"\n結果已保存到結果資料庫 (run_id: {run_id})")
 
 def main():
     # 測試案例
@@ -276,9 +291,6 @@ def main():
         print("\n" + "=" * 50)
         print(f"查詢 '{query}' 測試完成")
         print("=" * 50)
-        
-        # 等待一下，避免 API 限制
-        time.sleep(2)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,14 +1,21 @@
 import os
-import json
+import sys
 import time
 from datetime import datetime
 from google import genai
 from google.genai.types import Tool, GenerateContentConfig, GoogleSearch
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from rate_limiter import wait_for_slot, report_if_throttled
+from results_store import record_results
+
 # 加載 .env.local 文件
 load_dotenv('.env.local')
 
+# 這些腳本直接呼叫實際的 API，預設套用免費方案的額度以避免 429；可用 SEARCH_RATE_LIMITS 覆寫，SEARCH_RATE_LIMIT=0 停用
+os.environ.setdefault("SEARCH_RATE_LIMITS", "free-tier")
+
 # 設置 API 金鑰
 GEMINI_API_KEY = os.environ.get("NEXT_PUBLIC_GEMINI_API_KEY", "your_gemini_api_key_here")
 
@@ -24,6 +31,8 @@ def test_gemini_web_search(query, model_id="gemini-2.0-flash"):
         print(f"\n[Gemini] 查詢: {query}")
         print("-" * 50)
         
+        # 依共用的限流額度等待，避免 API 限制
+        wait_for_slot("gemini", model_id)
         start_time = time.time()
         
         # 初始化 Gemini 客戶端
@@ -85,6 +94,7 @@ def test_gemini_web_search(query, model_id="gemini-2.0-flash"):
             
             return {
                 "model": "gemini",
+                "model_name": model_id,
                 "query": query,
                 "response": answer,
                 "elapsed_time": elapsed_time,
@@ -94,6 +104,7 @@ def test_gemini_web_search(query, model_id="gemini-2.0-flash"):
             print("[Gemini] 未收到有效回答")
             return {
                 "model": "gemini",
+                "model_name": model_id,
                 "query": query,
                 "response": "未收到有效回答",
                 "elapsed_time": elapsed_time,
@@ -102,8 +113,10 @@ def test_gemini_web_search(query, model_id="gemini-2.0-flash"):
         
     except Exception as e:
         print(f"[Gemini] 錯誤: {e}")
+        report_if_throttled("gemini", model_id, e)
         return {
             "model": "gemini",
+            "model_name": model_id,
             "query": query,
             "response": f"錯誤: {str(e)}",
             "elapsed_time": 0,
@@ -127,9 +140,6 @@ def test_different_models(query):
         print(f"\n測試模型: {model}")
         result = test_gemini_web_search(query, model)
         results[model] = result
-        
-        # 等待一下，避免 API 限制
-        time.sleep(2)
     
     return results
 
@@ -159,18 +169,10 @@ def main():
         print("\n" + "=" * 50)
         print(f"查詢 '{query}' 測試完成")
         print("=" * 50)
-        
-        # 等待一下，避免 API 限制
-        time.sleep(2)
-    
-    # 保存結果到文件
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"gemini_test_results_{timestamp}.json"
-    
-    with open(filename, "w", encoding="utf-8") as f:
-        json.dump(all_results, f, ensure_ascii=False, indent=2)
     
-    print(f"\n結果已保存到文件: {filename}")
+    # 一次寫入結果資料庫，以 scripts/results_store.py 查詢與匯出
+    run_id = record_results([result for results in all_results.values() for result in results.values()])
+    print(f"\n結果已保存到結果資料庫 (run_id: {run_id})")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,111 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from answer_index import DEFAULT_MIN_SIMILARITY, AnswerIndex, similarity
+
+# 同一個問題的不同問法，應直接使用舊的回答
+PARAPHRASES = [
+    ("NVIDIA 股票的當前價格是多少？", "NVIDIA 現在股價多少"),
+    ("台積電今天的股價是多少", "今天台積電股價"),
+    ("2024 年台灣總統大選結果", "2024 年台灣總統選舉的結果是什麼"),
+    ("東京明天天氣如何", "明天東京的天氣"),
+    ("什麼是量子電腦", "量子電腦是什麼"),
+    ("請問 OpenAI 最新的模型是什麼", "OpenAI 最新模型"),
+    ("特斯拉 Model Y 的價格", "Model Y 特斯拉多少錢"),
+    ("美元兌日圓匯率是多少", "美元對日圓的匯率"),
+    ("Python 3.12 有哪些新功能", "Python 3.12 新功能"),
+    ("What is the current price of NVIDIA stock?", "NVIDIA stock price now"),
+    ("how tall is the eiffel tower", "eiffel tower height how tall"),
+]
+
+# 相關但不同的問題：實體、數字或日期不同，或多問了一件事
+DIFFERENT = [
+    ("NVIDIA 股價", "AMD 股價"),
+    ("2023 年台灣 GDP 成長率", "2024 年台灣 GDP 成長率"),
+    ("iPhone 15 價格", "iPhone 16 價格"),
+    ("東京今天天氣", "東京明天天氣"),
+    ("Python 3.12 新功能", "Python 3.13 新功能"),
+    ("NVIDIA 股價", "NVIDIA 股價下跌的原因"),
+    ("蘋果股價", "微軟股價"),
+    ("台積電股價", "聯電股價"),
+    ("美元兌日圓匯率", "美元兌台幣匯率"),
+    ("量子電腦是什麼", "量子電腦的原理"),
+    ("台北天氣", "台北交通"),
+    ("what is the price of apple stock", "what is the price of tesla stock"),
+]
+
+# 沒有用來決定門檻的配對：中文名稱或方向不同的問題必須不命中
+HELD_OUT_DIFFERENT = [
+    ("台北市長選舉的最新民調結果", "新北市長選舉的最新民調結果"),
+    ("北京到上海的高鐵票價", "上海到北京的高鐵票價"),
+    ("高雄到台南的火車時刻表", "台南到高雄的火車時刻表"),
+    ("日圓兌美元匯率", "美元兌日圓匯率"),
+    ("周杰倫的新專輯", "蔡依林的新專輯"),
+    ("台中市長是誰", "台南市長是誰"),
+    ("王建民的生涯戰績", "王建明的生涯戰績"),
+    ("巴黎奧運台灣金牌數", "東京奧運台灣金牌數"),
+    ("颱風什麼時候登陸台灣", "颱風什麼時候離開台灣"),
+]
+
+HELD_OUT_PARAPHRASES = [
+    ("台積電的股價", "台積電股票價格是多少"),
+    ("量子電腦是什麼", "請問什麼是量子電腦"),
+    ("台積電和聯電哪個營收比較高", "聯電和台積電哪個營收比較高"),
+]
+
+def answer(text):
+    return {"answer": text, "citations": [{"title": "來源", "url": "https://example.com"}]}
+
+@pytest.mark.parametrize("a, b", PARAPHRASES + HELD_OUT_PARAPHRASES)
+def test_paraphrase_is_similar(a, b):
+    assert similarity(a, b) >= DEFAULT_MIN_SIMILARITY
+    assert similarity(b, a) == similarity(a, b)
+
+@pytest.mark.parametrize("a, b", DIFFERENT + HELD_OUT_DIFFERENT)
+def test_different_question_is_not_similar(a, b):
+    assert similarity(a, b) < DEFAULT_MIN_SIMILARITY
+
+@pytest.mark.parametrize("a, b", [
+    ("NVIDIA 股價", "AMD 股價"),
+    ("2023 年台灣 GDP 成長率", "2024 年台灣 GDP 成長率"),
+    ("東京今天天氣", "東京明天天氣"),
+])
+def test_different_entity_number_or_date_scores_zero(a, b):
+    assert similarity(a, b) == 0.0
+
+def test_rephrased_query_hits():
+    index = AnswerIndex(":memory:")
+    index.add("NVIDIA 股票的當前價格是多少？", "gemini-2.0-flash", answer("NVIDIA 目前股價為 120 美元"),
+              upstream_ms=1500, now=1000)
+    result, match = index.lookup("請根據網路搜尋回答。問題: NVIDIA 現在股價多少", now=1060)
+    assert result["answer"] == "NVIDIA 目前股價為 120 美元"
+    assert result["citations"][0]["title"] == "來源"
+    assert match["similarity"] >= DEFAULT_MIN_SIMILARITY
+    assert index.stats()["hits"] == 1
+
+@pytest.mark.parametrize("query", [
+    "AMD 現在股價多少",
+    "NVIDIA 2023 年的股價",
+    "NVIDIA 股價下跌的原因",
+])
+def test_different_entity_or_number_misses(query):
+    index = AnswerIndex(":memory:")
+    index.add("NVIDIA 現在股價多少", "gemini-2.0-flash", answer("NVIDIA 目前股價為 120 美元"), now=1000)
+    assert index.lookup(query, now=1060) == (None, None)
+    assert index.stats()["hits"] == 0
+
+def test_different_chinese_name_misses():
+    index = AnswerIndex(":memory:")
+    index.add("台北市長選舉的最新民調結果", "gemini-2.0-flash", answer("台北市長選舉民調"), now=1000)
+    assert index.lookup("新北市長選舉的最新民調結果", now=1060) == (None, None)
+    assert index.lookup("台北市長選舉最新的民調結果是什麼", now=1060)[0]["answer"] == "台北市長選舉民調"
+
+def test_stale_answer_misses():
+    index = AnswerIndex(":memory:")
+    index.add("NVIDIA 現在股價多少", "gemini-2.0-flash", answer("NVIDIA 目前股價為 120 美元"), now=1000)
+    # 即時資訊只沿用 10 分鐘
+    assert index.lookup("NVIDIA 股票的當前價格是多少？", now=1000 + 11 * 60) == (None, None)
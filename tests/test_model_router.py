@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from model_router import MIN_SAMPLES, ModelRouter
+
+class NoHistory:
+    def percentile(self, model, p):
+        return None
+
+class ClosedBreaker:
+    def state(self):
+        return []
+
+def make_router(models):
+    return ModelRouter(":memory:", candidates={model: 3 for model in models}, explore_rate=0.0,
+                       history=NoHistory(), breaker=ClosedBreaker())
+
+def test_always_failing_model_leaves_warmup():
+    router = make_router(["broken", "healthy"])
+    chosen = []
+    for _ in range(20):
+        model, route = router.choose()
+        chosen.append(model)
+        if model == "broken":
+            router.record(model, None, error=True)
+        else:
+            router.record(model, 800.0)
+    assert chosen.count("broken") == MIN_SAMPLES
+    assert chosen[-1] == "healthy"
+    assert route["reason"] == "fastest"
+
+def test_failing_model_ranks_after_slower_healthy_model():
+    router = make_router(["flaky", "slow"])
+    for _ in range(MIN_SAMPLES):
+        router.record("slow", 3000.0)
+        router.record("flaky", 200.0)
+    # 錯誤率 EWMA 在連續失敗 4 次後超過 FAILING_ERROR_RATE
+    for _ in range(4):
+        router.record("flaky", None, error=True)
+    scores = {e["model"]: e for e in router.scores()}
+    assert scores["flaky"]["failing"] and not scores["slow"]["failing"]
+    assert router.choose()[0] == "slow"
+
+def test_only_failing_models_still_route():
+    router = make_router(["broken"])
+    for _ in range(MIN_SAMPLES):
+        router.record("broken", None, error=True)
+    assert router.choose() == ("broken", {"model": "broken", "reason": "failing", "score": None})
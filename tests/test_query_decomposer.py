@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+
+from query_decomposer import split_query
+
+@pytest.mark.parametrize("query", [
+    "如何同時使用兩個螢幕",
+    "台北還有哪些景點值得去",
+    "特斯拉另外推出了什麼新車款",
+    "台積電以及聯發科的股價",
+    "What is the capital of France?",
+])
+def test_single_question_is_not_split(query):
+    assert split_query(query) == [query]
+
+@pytest.mark.parametrize("query, parts", [
+    ("台積電今天的股價是多少？聯發科最新的財報表現如何？", ["台積電今天的股價是多少", "聯發科最新的財報表現如何"]),
+    ("台積電今天的股價是多少，另外明天台北的天氣如何", ["台積電今天的股價是多少", "明天台北的天氣如何"]),
+    ("東京明天的天氣如何？還有大阪最近有什麼活動", ["東京明天的天氣如何", "大阪最近有什麼活動"]),
+])
+def test_independent_questions_are_split(query, parts):
+    assert split_query(query) == parts
+
+def test_short_first_fragment_is_merged():
+    assert split_query("天氣？台北明天會不會下雨") == ["天氣？台北明天會不會下雨"]
+    assert split_query("天氣？台北明天會不會下雨？高雄明天會不會下雨") == ["天氣，台北明天會不會下雨", "高雄明天會不會下雨"]
+
+def test_dependent_fragment_keeps_context():
+    assert split_query("台積電今天的股價是多少？和聯發科相比呢") == ["台積電今天的股價是多少？和聯發科相比呢"]